@@ -6,9 +6,10 @@ import threading
 import time
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-import queue
 import weakref
 
+from webhook_intake import webhook_intake, RESULT_DUPLICATE
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -22,12 +23,11 @@ app = Flask(__name__)
 MAX_WORKERS = 4  # Оптимизированное количество воркеров
 REQUEST_TIMEOUT = 30  # Таймаут для HTTP запросов
 HEALTH_CHECK_INTERVAL = 60  # Интервал проверки здоровья (секунды)
-WEBHOOK_QUEUE_SIZE = 1000  # Размер очереди webhook обновлений
 
 # === ГЛОБАЛЬНЫЕ ОБЪЕКТЫ ===
 bot_thread = None
 bot_running = False
-webhook_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+webhook_queue = webhook_intake  # Дедупликация по update_id и сброс на диск при переполнении
 webhook_processor_thread = None
 health_check_thread = None
 
@@ -85,7 +85,7 @@ def home():
         },
         "optimizations": {
             "max_workers": MAX_WORKERS,
-            "webhook_queue_size": WEBHOOK_QUEUE_SIZE,
+            "webhook_queue_size": webhook_queue.maxsize,
             "cache_ttl": cache_ttl
         }
     })
@@ -107,6 +107,7 @@ def health():
         "bot_status": "running" if bot_running else "stopped",
         "system_info": {
             "webhook_queue_size": webhook_queue.qsize(),
+            "webhook_intake": webhook_queue.stats(),
             "active_workers": len(webhook_executor._threads) if hasattr(webhook_executor, '_threads') else 0,
             "cache_size": len(response_cache)
         }
@@ -144,13 +145,13 @@ def webhook():
                 logger.error(f"Failed to start bot automatically: {e}")
                 return jsonify({"status": "error", "message": "Bot not ready"}), 503
         
-        # Добавляем в очередь для асинхронной обработки
-        try:
-            webhook_queue.put_nowait(update)
-            logger.info(f"Update {update_id} queued for processing")
-        except queue.Full:
-            logger.warning(f"Webhook queue full, dropping update {update_id}")
-            return jsonify({"status": "warning", "message": "Queue full"}), 429
+        # Добавляем в очередь для асинхронной обработки; при переполнении обновление
+        # пишется в журнал на диске, поэтому Telegram всегда получает 200
+        result = webhook_queue.offer(update)
+        if result == RESULT_DUPLICATE:
+            logger.info(f"Update {update_id} is a duplicate, skipped")
+            return jsonify({"status": "ok", "queued": False, "duplicate": True})
+        logger.info(f"Update {update_id} {result} for processing")
         
         return jsonify({"status": "ok", "queued": True})
         
@@ -185,9 +186,8 @@ def webhook_processor():
     while bot_running:
         try:
             # Получаем обновление из очереди с таймаутом
-            try:
-                update_data = webhook_queue.get(timeout=1.0)
-            except queue.Empty:
+            update_data = webhook_queue.get(timeout=1.0)
+            if update_data is None:
                 continue
             
             if update_data:
@@ -280,6 +280,7 @@ def bot_status():
         "bot_thread_alive": bot_thread.is_alive() if bot_thread else False,
         "webhook_processor_alive": webhook_processor_thread.is_alive() if webhook_processor_thread else False,
         "webhook_queue_size": webhook_queue.qsize(),
+        "webhook_intake": webhook_queue.stats(),
         "active_workers": len(webhook_executor._threads) if hasattr(webhook_executor, '_threads') else 0,
         "timestamp": time.time()
     })
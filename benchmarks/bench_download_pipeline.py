@@ -0,0 +1,412 @@
+"""
+Пропускная способность конвейера загрузок: yt-dlp + ffmpeg на локальном медиасервере.
+
+Фикстуры (mp3 нескольких размеров; m4a, opus и wav - если есть ffmpeg)
+отдаются локальным HTTP-сервером в отдельном процессе, ссылки на них
+скачивает настоящий download_worker.ydl_download_blocking через generic
+экстрактор yt-dlp - с теми же настройками, что и в боте. Перебираются:
+    * одновременные загрузки (MAX_CONCURRENT_DOWNLOADS, семафор как в боте);
+    * исполнитель: thread - пул потоков в процессе бота (yt_executor),
+      process - ProcessPoolExecutor, workers - процессы download_worker
+      с очередью в SQLite;
+    * конвертация: none - без ffmpeg (только mp3-фикстуры), 192 и 320 kbps.
+
+Для каждой конфигурации печатается: треков в минуту, CPU-секунды на трек
+(процесс бенчмарка и все завершившиеся дочерние, включая ffmpeg, без
+медиасервера), пиковая RSS процесса с потомками и байты на диске на трек.
+
+Запуск:
+    python benchmarks/bench_download_pipeline.py
+    python benchmarks/bench_download_pipeline.py --concurrency 1,2,4,8 --executors thread,workers \\
+        --transcode 192 --tracks 40 --sizes-mb 2,8 --media-kbps 20000 --report pipeline.json
+
+Нужны yt-dlp и (для конвертации и кодеков кроме mp3) ffmpeg в PATH;
+без ffmpeg остаётся только режим --transcode none. Пиковая RSS считается
+по /proc (Linux), на других системах - ru_maxrss процесса.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import yt_dlp
+from aiohttp import web
+
+import download_worker
+from load_harness import MP3_FRAME
+
+MP3_FRAME_SECONDS = 1152 / 44100
+CONTENT_TYPES = {"mp3": "audio/mpeg", "m4a": "audio/mp4", "opus": "audio/ogg", "wav": "audio/wav"}
+FFMPEG_CODECS = {"m4a": ["-c:a", "aac", "-b:a", "128k"], "opus": ["-c:a", "libopus", "-b:a", "96k"]}
+RSS_SAMPLE_INTERVAL = 0.1
+
+class BenchYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL без строки прогресса; при transcode = False - и без постобработки"""
+
+    transcode = True
+
+    def __init__(self, params=None, *args, **kwargs):
+        params = dict(params or {}, noprogress=True)
+        if not self.transcode:
+            params["postprocessors"] = []
+        super().__init__(params, *args, **kwargs)
+
+
+def set_transcode_mode(mode: str):
+    """none - убрать FFmpegExtractAudio; в дочерних процессах вызывается как initializer"""
+    BenchYoutubeDL.transcode = mode != "none"
+    yt_dlp.YoutubeDL = BenchYoutubeDL
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+# === Фикстуры ===
+
+def make_mp3(path: str, size: int):
+    with open(path, "wb") as f:
+        f.write(MP3_FRAME * max(1, size // len(MP3_FRAME)))
+
+
+def make_wav(path: str, seconds: float, rate: int = 44100):
+    """Шум, а не тишина: кодеку приходится работать как на настоящей записи"""
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        block = os.urandom(rate * 4)
+        for _ in range(int(seconds)):
+            f.writeframes(block)
+
+
+def make_fixtures(directory: str, sizes_mb, codecs, ffmpeg: bool) -> dict:
+    """{имя: (путь, расширение, длительность)}; размер задает длительность mp3 128 kbps"""
+    fixtures = {}
+    for size_mb in sizes_mb:
+        size = int(size_mb * 1024 * 1024)
+        seconds = size // len(MP3_FRAME) * MP3_FRAME_SECONDS
+        for codec in codecs:
+            name = f"{codec}_{size_mb:g}mb"
+            path = os.path.join(directory, f"{name}.{codec}")
+            if codec == "mp3":
+                make_mp3(path, size)
+            elif not ffmpeg:
+                continue
+            elif codec == "wav":
+                make_wav(path, seconds)
+            else:
+                source = os.path.join(directory, f"{name}.source.wav")
+                make_wav(source, seconds)
+                subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", source, *FFMPEG_CODECS[codec], path],
+                               check=True)
+                os.remove(source)
+            fixtures[name] = (path, codec, seconds)
+    return fixtures
+
+
+# === Медиасервер (отдельный процесс, его CPU не попадает в замеры) ===
+
+def run_media_server(fixtures: dict, media_kbps: float, port_queue):
+    data = {name: open(path, "rb").read() for name, (path, _, _) in fixtures.items()}
+
+    async def handle(request):
+        name = request.match_info["name"]
+        body = data.get(name)
+        if body is None:
+            raise web.HTTPNotFound()
+        response = web.StreamResponse(headers={"Content-Type": CONTENT_TYPES[fixtures[name][1]],
+                                               "Content-Length": str(len(body))})
+        await response.prepare(request)
+        if request.method == "HEAD":
+            return response
+        chunk = 64 * 1024
+        delay = chunk / (media_kbps * 1024 / 8) if media_kbps else 0
+        try:
+            for offset in range(0, len(body), chunk):
+                await response.write(body[offset:offset + chunk])
+                if delay:
+                    await asyncio.sleep(delay)
+            await response.write_eof()
+        except ConnectionError:
+            # generic экстрактор закрывает первое соединение, прочитав только заголовки
+            pass
+        return response
+
+    async def serve():
+        app = web.Application()
+        app.router.add_get("/fixtures/{name}/{job}", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port_queue.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+# === Ресурсы ===
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _process_tree(root: int, exclude: int) -> list:
+    """root и все его потомки, кроме поддерева exclude (медиасервер)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        if pid == exclude:
+            continue
+        tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+class ResourceSampler:
+    """Пиковая RSS дерева процессов и пиковый объем папки загрузок"""
+
+    def __init__(self, directory: str, exclude_pid: int):
+        self.directory = directory
+        self.exclude_pid = exclude_pid
+        self.proc = os.path.isdir("/proc/self")
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="resource_sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.sample()
+
+    def sample(self):
+        if self.proc:
+            rss = sum(_rss_bytes(pid) for pid in _process_tree(os.getpid(), self.exclude_pid))
+            self.peak_rss = max(self.peak_rss, rss)
+        self.peak_disk = max(self.peak_disk, directory_bytes(self.directory))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+        if not self.proc:
+            self.peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def directory_bytes(path: str) -> int:
+    total = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+    return total
+
+
+def cpu_seconds(who) -> float:
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+# === Прогон одной конфигурации ===
+
+async def download_all(urls, concurrency: int, submit):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(url):
+        async with semaphore:
+            started = time.perf_counter()
+            result = await submit(url)
+            latencies.append(time.perf_counter() - started)
+            return bool(result) and os.path.exists(result[0])
+
+    results = await asyncio.gather(*(one(url) for url in urls))
+    return sum(results), latencies
+
+
+def run_config(executor: str, concurrency: int, transcode: str, urls, workdir: str, server_pid: int) -> dict:
+    outdir = os.path.join(workdir, f"out_{executor}_{concurrency}_{transcode}")
+    os.makedirs(outdir)
+    outtmpl = os.path.join(outdir, "%(title)s.%(ext)s")
+    is_premium = transcode == "320"
+    set_transcode_mode(transcode)
+    children_before = cpu_seconds(resource.RUSAGE_CHILDREN)
+
+    processes = []
+    pool = None
+    if executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="yt_downloader")
+    elif executor == "process":
+        pool = ProcessPoolExecutor(max_workers=concurrency, initializer=set_transcode_mode, initargs=(transcode,))
+        # Процессы пула поднимаются при первой задаче - до начала замера
+        for future in [pool.submit(time.sleep, 0) for _ in range(concurrency)]:
+            future.result()
+    else:
+        queue = download_worker.DownloadJobQueue(os.path.join(workdir, f"jobs_{executor}_{concurrency}_{transcode}.db"))
+        for index in range(concurrency):
+            process = multiprocessing.Process(target=_bench_worker, args=(f"bench-{index}", queue.path, transcode))
+            process.start()
+            processes.append(process)
+        while queue.alive_workers() < concurrency:
+            time.sleep(0.05)
+
+    async def submit(url):
+        loop = asyncio.get_running_loop()
+        if executor == "workers":
+            return await queue.run(url, outtmpl, None, is_premium)
+        return await loop.run_in_executor(pool, download_worker.ydl_download_blocking, url, outtmpl, None, is_premium)
+
+    sampler = ResourceSampler(outdir, server_pid)
+    sampler.start()
+    self_before = cpu_seconds(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    ok, latencies = asyncio.run(download_all(urls, concurrency, submit))
+    wall = time.perf_counter() - started
+    self_cpu = cpu_seconds(resource.RUSAGE_SELF) - self_before
+    sampler.stop()
+
+    # CPU дочерних процессов учитывается только после их завершения
+    if pool is not None:
+        pool.shutdown(wait=True)
+    for process in processes:
+        process.terminate()
+        process.join()
+    children_cpu = cpu_seconds(resource.RUSAGE_CHILDREN) - children_before
+    final_disk = directory_bytes(outdir)
+    shutil.rmtree(outdir, ignore_errors=True)
+
+    per_track = max(ok, 1)
+    return {
+        "executor": executor,
+        "concurrency": concurrency,
+        "transcode": transcode,
+        "tracks": len(urls),
+        "ok": ok,
+        "wall_s": wall,
+        "tracks_per_min": ok / wall * 60 if wall else 0.0,
+        "latency_p50_s": statistics.median(latencies) if latencies else None,
+        "cpu_s_per_track": (self_cpu + children_cpu) / per_track,
+        "cpu_self_s": self_cpu,
+        "cpu_children_s": children_cpu,
+        "peak_rss_mb": sampler.peak_rss / 1024 / 1024,
+        "disk_bytes_per_track": final_disk / per_track,
+        "peak_disk_mb": sampler.peak_disk / 1024 / 1024,
+    }
+
+
+def _bench_worker(name: str, path: str, transcode: str):
+    set_transcode_mode(transcode)
+    download_worker.run_worker(name, path)
+
+
+def parse_list(text: str, cast=str) -> list:
+    return [cast(item) for item in text.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность загрузок yt-dlp + ffmpeg")
+    parser.add_argument("--concurrency", default="1,3,8", help="Значения MAX_CONCURRENT_DOWNLOADS")
+    parser.add_argument("--executors", default="thread,process,workers", help="thread, process, workers")
+    parser.add_argument("--transcode", default="none,192,320", help="none, 192, 320")
+    parser.add_argument("--tracks", type=int, default=24, help="Загрузок на конфигурацию")
+    parser.add_argument("--sizes-mb", default="1,4,10", help="Размеры фикстур (по mp3 128 kbps)")
+    parser.add_argument("--codecs", default="mp3,m4a,opus,wav", help="Кодеки фикстур кроме mp3 - только с ffmpeg")
+    parser.add_argument("--media-kbps", type=float, default=0, help="Скорость отдачи на соединение (0 - без ограничения)")
+    parser.add_argument("--report", default="", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    ffmpeg = shutil.which("ffmpeg") is not None
+    transcode_modes = parse_list(args.transcode)
+    if not ffmpeg and any(mode != "none" for mode in transcode_modes):
+        print("ffmpeg не найден: конвертация и кодеки кроме mp3 пропускаются")
+        transcode_modes = [mode for mode in transcode_modes if mode == "none"]
+
+    workdir = tempfile.mkdtemp(prefix="bench_download_pipeline_")
+    fixtures = make_fixtures(workdir, parse_list(args.sizes_mb, float), parse_list(args.codecs), ffmpeg)
+    fixture_info = {name: {"codec": codec, "seconds": round(seconds, 1), "bytes": os.path.getsize(path)}
+                    for name, (path, codec, seconds) in fixtures.items()}
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=run_media_server, args=(fixtures, args.media_kbps, port_queue),
+                                     daemon=True)
+    server.start()
+    base_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+    print(f"Фикстуры: {', '.join(sorted(fixtures))}; медиасервер {base_url}\n")
+
+    results = []
+    header = (f"{'исполнитель':12}{'потоков':>8}{'конв.':>6}{'ок':>7}{'треков/мин':>12}{'p50, с':>8}"
+              f"{'CPU-с/трек':>12}{'пик RSS, МБ':>13}{'диск/трек, МБ':>15}")
+    print(header)
+    try:
+        job_index = 0
+        for transcode in transcode_modes:
+            # Без конвертации yt-dlp оставляет исходное расширение, а бот ждет mp3
+            names = [name for name in sorted(fixtures) if transcode != "none" or fixtures[name][1] == "mp3"]
+            for executor in parse_list(args.executors):
+                for concurrency in parse_list(args.concurrency, int):
+                    urls = []
+                    for i in range(args.tracks):
+                        name = names[i % len(names)]
+                        job_index += 1
+                        urls.append(f"{base_url}/fixtures/{name}/job_{job_index:06d}.{fixtures[name][1]}")
+                    result = run_config(executor, concurrency, transcode, urls, workdir, server.pid)
+                    results.append(result)
+                    print(f"{executor:12}{concurrency:>8}{transcode:>6}{result['ok']:>4}/{result['tracks']:<2}"
+                          f"{result['tracks_per_min']:>12.1f}{result['latency_p50_s'] or 0:>8.2f}"
+                          f"{result['cpu_s_per_track']:>12.3f}{result['peak_rss_mb']:>13.1f}"
+                          f"{result['disk_bytes_per_track'] / 1024 / 1024:>15.2f}")
+    finally:
+        server.terminate()
+        server.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.report:
+        report = {
+            "params": {key: value for key, value in vars(args).items() if key != "report"},
+            "fixtures": fixture_info,
+            "ffmpeg": ffmpeg,
+            "results": results,
+        }
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nОтчет: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Микробенчмарки чистых горячих функций music_bot_new на синтетических данных.
+
+Генерируются user_tracks (по умолчанию 100 000 пользователей и 5 000 000
+треков), кэш поиска предельного размера, папка cache с файлами коллекций и
+осиротевшими файлами. Замеряются:
+    build_tracks_keyboard, get_cached_search (попадание/промах),
+    set_cached_search, is_file_in_collection (худший случай - промах),
+    file_refs_reconcile (cleanup_orphaned_files: сверка file_refs с папкой),
+    load_tracks_with_validation, is_valid_genre_track, save_tracks.
+
+Результаты дописываются строкой JSON в историю (--history) вместе с
+коммитом и параметрами; печатается сравнение с предыдущим запуском на тех
+же параметрах, поэтому любую оптимизацию можно измерить до и после.
+
+Запуск:
+    python benchmarks/bench_hot_paths.py                       # полный объем (~несколько ГБ памяти)
+    python benchmarks/bench_hot_paths.py --scale 0.01          # 1000 пользователей, 50 000 треков
+    python benchmarks/bench_hot_paths.py --scale 0.01 --only build_tracks_keyboard,get_cached_search_hit
+
+Модуль бота импортируется целиком, поэтому нужны зависимости из
+requirements.txt; обязательные переменные окружения подставляются
+заглушками, данные пишутся во временную папку, а не рядом с ботом.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# music_bot_new проверяет эти переменные при импорте
+PLACEHOLDER_ENV = {
+    "BOT_TOKEN": "123456:" + "A" * 35,
+    "PAYMENT_PROVIDER_TOKEN": "bench", "YOOMONEY_CLIENT_ID": "bench", "YOOMONEY_CLIENT_SECRET": "bench",
+    "YOOMONEY_REDIRECT_URI": "bench", "YOOMONEY_ACCOUNT": "bench", "CARD_NUMBER": "bench",
+    "TON_WALLET": "bench", "PAYMENT_AMOUNT_USD": "1", "PAYMENT_AMOUNT_USDT": "1", "TON_API_KEY": "bench",
+    "STATE_BACKEND": "memory", "LOG_LEVEL": "WARNING",
+}
+
+DEFAULT_HISTORY = os.path.join(ROOT, "benchmarks", "results", "hot_paths.jsonl")
+WORDS = ["love", "night", "city", "dream", "fire", "rain", "summer", "heart", "light", "road",
+         "ночь", "город", "лето", "звезда", "море"]
+GENRE_WORDS = ["rock song", "jazz music", "live concert", "full album mix", "rap track", "review",
+               "pop audio", "how to play", "electronic beat", "karaoke version"]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def make_title(rng):
+    return f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} - {rng.choice(WORDS)} {rng.randint(1, 999)}"
+
+
+def make_cache_files(cache_dir, count, prefix):
+    paths = []
+    for i in range(count):
+        path = os.path.join(cache_dir, f"{prefix} {i:06d}.mp3")
+        with open(path, "wb") as f:
+            f.write(b"ID3")
+        paths.append(path)
+    return paths
+
+
+def make_user_tracks(users, tracks, collection_files, rng):
+    """Треки распределены по пользователям неравномерно; популярные файлы общие"""
+    per_user = max(1, tracks // users)
+    data = {}
+    remaining = tracks
+    for u in range(users):
+        count = per_user if u < users - 1 else remaining
+        remaining -= count
+        user_list = []
+        for _ in range(count):
+            path = collection_files[min(len(collection_files) - 1, int(rng.paretovariate(1.2)) - 1)]
+            user_list.append({
+                "title": os.path.basename(path),
+                "url": f"file://{path}",
+                "original_url": f"https://www.youtube.com/watch?v={rng.getrandbits(40):011x}",
+                "size_mb": 4.2,
+                "needs_migration": False,
+                "duration": rng.randint(90, 420),
+            })
+        data[str(100000000 + u)] = user_list
+    return data
+
+
+def make_search_results(rng, count=10):
+    return [{"id": f"{rng.getrandbits(40):011x}", "title": make_title(rng), "duration": rng.randint(60, 600),
+             "url": f"https://www.youtube.com/watch?v={rng.getrandbits(40):011x}", "source": "yt"}
+            for _ in range(count)]
+
+
+def measure(func, number, repeat, setup=None):
+    """Время одного вызова (секунды) по каждому из repeat прогонов"""
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number)
+    return samples
+
+
+def load_previous(history, params):
+    if not os.path.exists(history):
+        return None
+    previous = None
+    with open(history, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("params") == params:
+                previous = record
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих функций бота")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--tracks", type=int, default=5000000)
+    parser.add_argument("--scale", type=float, default=1.0, help="Множитель для --users/--tracks")
+    parser.add_argument("--collection-files", type=int, default=5000, help="Файлов в cache, на которые ссылаются треки")
+    parser.add_argument("--orphan-files", type=int, default=2000, help="Осиротевших файлов в cache")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", default="", help="Через запятую: какие замеры выполнить")
+    parser.add_argument("--history", default=DEFAULT_HISTORY)
+    parser.add_argument("--label", default="", help="Метка запуска в истории")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    for key, value in PLACEHOLDER_ENV.items():
+        os.environ.setdefault(key, value)
+    import music_bot_new as bot_module
+
+    users = max(1, int(args.users * args.scale))
+    tracks = max(users, int(args.tracks * args.scale))
+    only = {name for name in args.only.split(",") if name}
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench_hot_paths_")
+    cache_dir = os.path.join(workdir, "cache")
+    os.makedirs(cache_dir)
+
+    # Данные бота - только во временной папке
+    bot_module.TRACKS_FILE = os.path.join(workdir, "tracks.json")
+    bot_module.SEARCH_CACHE_FILE = os.path.join(workdir, "search_cache.json")
+    bot_module.CACHE_DIR = cache_dir
+    bot_module.DEFERRED_DELETES_FILE = os.path.join(workdir, "deferred_deletes.json")
+    bot_module.file_refs.directory = cache_dir
+    bot_module.CLEANUP_LOGGING = False
+
+    print(f"Генерация: {users} пользователей, {tracks} треков, {args.collection_files} файлов коллекций...")
+    started = time.perf_counter()
+    collection_files = make_cache_files(cache_dir, args.collection_files, "track")
+    data = make_user_tracks(users, tracks, collection_files, rng)
+    bot_module.user_tracks.clear()
+    bot_module.user_tracks.update(data)
+    keyboard_tracks = [track for user_list in itertools.islice(data.values(), 50) for track in user_list][:500]
+    bot_module.search_cache.clear()
+    queries = [f"{make_title(rng)} {i}" for i in range(100)]
+    for query in queries:
+        bot_module.search_cache[bot_module.normalize_query(query, bot_module.SEARCH_CACHE_TRANSLITERATE)] = {
+            "time": time.time(), "results": make_search_results(rng)}
+    genre_results = [dict(result, title=f"{make_title(rng)} {rng.choice(GENRE_WORDS)}")
+                     for result in make_search_results(rng, 10000)]
+    print(f"Готово за {time.perf_counter() - started:.1f} с, папка {workdir}\n")
+
+    def orphan_setup():
+        make_cache_files(cache_dir, args.orphan_files, "orphan")
+        # Каждый повтор сверки начинает с пустой очереди удаления, как после перезапуска
+        bot_module.deferred_deletes.clear()
+
+    cases = [
+        ("build_tracks_keyboard", lambda: bot_module.build_tracks_keyboard(keyboard_tracks, page=3), 2000, None),
+        ("get_cached_search_hit", lambda: bot_module.get_cached_search(rng.choice(queries)), 20000, None),
+        ("get_cached_search_miss", lambda: bot_module.get_cached_search("missing query 123"), 20000, None),
+        ("set_cached_search", lambda: bot_module.set_cached_search(rng.choice(queries), make_search_results(rng)), 200, None),
+        ("is_file_in_collection_miss", lambda: bot_module.is_file_in_collection(os.path.join(cache_dir, "absent.mp3")), 1, None),
+        ("is_valid_genre_track_10k", lambda: [bot_module.is_valid_genre_track(r) for r in genre_results], 20, None),
+        ("save_tracks", bot_module.save_tracks, 1, None),
+        ("load_tracks_with_validation", bot_module.load_tracks_with_validation, 1, None),
+        # Раньше замер назывался cleanup_orphaned_files и удалял файлы пачками - с ним результаты несравнимы
+        ("file_refs_reconcile", lambda: asyncio.run(bot_module.cleanup_orphaned_files()), 1, orphan_setup),
+    ]
+
+    params = {"users": users, "tracks": tracks, "collection_files": args.collection_files,
+              "orphan_files": args.orphan_files, "seed": args.seed}
+    results = {}
+    try:
+        for name, func, number, setup in cases:
+            if only and name not in only:
+                continue
+            if name == "load_tracks_with_validation" and not os.path.exists(bot_module.TRACKS_FILE):
+                bot_module.save_tracks()
+            samples = measure(func, number, args.repeat, setup)
+            results[name] = {
+                "median_ms": statistics.median(samples) * 1000,
+                "min_ms": min(samples) * 1000,
+                "number": number,
+                "repeat": args.repeat,
+            }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    previous = load_previous(args.history, params)
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "label": args.label,
+        "python": platform.python_version(),
+        "params": params,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    base = previous["results"] if previous else {}
+    print(f"{'замер':32}{'медиана, мс':>14}{'мин, мс':>12}{'было, мс':>12}{'изменение':>12}")
+    for name, item in results.items():
+        before = base.get(name, {}).get("median_ms")
+        change = f"{(item['median_ms'] / before - 1) * 100:+.1f}%" if before else ""
+        before_text = f"{before:.3f}" if before else ""
+        print(f"{name:32}{item['median_ms']:>14.3f}{item['min_ms']:>12.3f}{before_text:>12}{change:>12}")
+    if previous:
+        print(f"\nСравнение с {previous['timestamp']} ({previous.get('commit')}{', ' + previous['label'] if previous.get('label') else ''})")
+    print(f"История: {args.history}")
+
+
+if __name__ == "__main__":
+    main()
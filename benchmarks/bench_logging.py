@@ -0,0 +1,162 @@
+"""
+Стоимость логирования на одно обновление: прежние f-строки против log_events.
+
+Одно "обновление" - то, что логировалось при поиске и удалении трека:
+проверки is_admin / is_premium_user, send_search_results на 5 результатов
+и delete_track при коллекциях --users пользователей по --tracks треков.
+
+Запуск:
+    python benchmarks/bench_logging.py --updates 2000 --users 200 --tracks 30
+
+Печатаются байты лога и процессорное время на обновление: в потоке
+обработчика (то, что тормозит event loop) и всего по процессу.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import log_events
+from log_events import get_event_logger, setup_logging, shutdown_logging
+
+
+class CountingStream:
+    """Поток вывода, который только считает байты"""
+
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode("utf-8", "replace"))
+
+    def flush(self):
+        pass
+
+
+def make_data(users, tracks):
+    user_tracks = {
+        str(1000 + u): [
+            {"title": f"Artist {u} - Track {t}.mp3", "url": f"file://cache/Artist {u} - Track {t}.mp3",
+             "original_url": f"https://www.youtube.com/watch?v={u:05d}{t:06d}", "size_mb": 4.2,
+             "needs_migration": False, "source": "yt"}
+            for t in range(tracks)
+        ]
+        for u in range(users)
+    }
+    results = [
+        {"id": f"vid{i:08d}", "title": f"Some Artist - Some Song {i} (Official Video)", "duration": 215 + i,
+         "url": f"https://www.youtube.com/watch?v=vid{i:08d}", "source": "yt"}
+        for i in range(10)
+    ]
+    premium = {"premium_users": [str(5000 + i) for i in range(300)], "premium_usernames": [f"user{i}" for i in range(300)]}
+    return user_tracks, results, premium
+
+
+def old_update(user_tracks, results, premium, user_id, chat_id):
+    """Логи в том виде, в каком они были до перехода на log_events"""
+    admin_ids = ["123456789", "987654321"]
+    admin_usernames = ["wtfguys4"]
+    logging.info(f"🔍 Проверка админских прав: user_id={user_id}, username=None")
+    logging.info(f"🔍 Список админов ID: {admin_ids}")
+    logging.info(f"🔍 Список админов username: {admin_usernames}")
+    logging.info(f"❌ Пользователь {user_id} (None) не найден в списке админов")
+
+    logging.info(f"🔍 Проверка премиум статуса: user_id={user_id}, username=None")
+    logging.info(f"🔍 Список премиум ID: {premium.get('premium_users', [])}")
+    logging.info(f"🔍 Список премиум username: {premium.get('premium_usernames', [])}")
+    logging.info(f"❌ Пользователь {user_id} (None) не найден в списке премиум")
+
+    logging.info(f"🔍 send_search_results: начало обработки для чата {chat_id}")
+    logging.info(f"🔍 send_search_results: получены результаты: {results}")
+    logging.info(f"🔍 send_search_results: тип результатов: {type(results)}")
+    logging.info(f"🔍 send_search_results: результаты прошли проверку, начинаем фильтрацию")
+    for i, video in enumerate(results[:5]):
+        logging.info(f"🔍 send_search_results: обработка видео {i+1}: {video}")
+        logging.info(f"🔍 send_search_results: YouTube видео {i+1} добавлено в валидные")
+    logging.info(f"🔍 send_search_results: найдено валидных результатов: 5")
+    logging.info(f"🔍 send_search_results: начинаем создание клавиатуры")
+    for i, video in enumerate(results[:5]):
+        logging.info(f"🔍 send_search_results: создание кнопки {i+1}: title='{video['title']}', duration={video['duration']}, duration_text='3:35', source='yt'")
+        logging.info(f"🔍 send_search_results: текст кнопки {i+1}: '{video['title']} ⏱ 3:35'")
+    logging.info(f"🔍 send_search_results: клавиатура создана, отправляем сообщение")
+    logging.info(f"✅ Результаты поиска успешно отправлены в чат {chat_id}: 5 треков")
+
+    logging.info(f"🔍 === НАЧАЛО УДАЛЕНИЯ ТРЕКА ===")
+    logging.info(f"🔍 Пользователь: {user_id}")
+    logging.info(f"🔍 Индекс трека: del:0")
+    logging.info(f"🔍 Глобальный user_tracks до удаления: {user_tracks}")
+    logging.info(f"✅ Трек удален из списка: title")
+    logging.info(f"🔍 После удаления: всего треков у пользователя {user_id}: {len(user_tracks.get(user_id, []))}")
+    logging.info(f"🔍 Обновленный user_tracks для пользователя {user_id}: {user_tracks.get(user_id, [])}")
+    logging.info(f"🔍 Глобальный user_tracks после обновления: {user_tracks}")
+    logging.info(f"🔍 === КОНЕЦ УДАЛЕНИЯ ТРЕКА ===")
+    logging.info(f"🔍 Финальный user_tracks: {user_tracks}")
+    logging.info(f"🔍 Треки пользователя {user_id}: {user_tracks.get(user_id, [])}")
+
+
+def new_update(events, user_tracks, results, premium, user_id, chat_id):
+    """Те же места после перехода на события"""
+    events.debug("admin_check", user_id=user_id, username=None, result=False)
+    events.debug("premium_check", user_id=user_id, username=None, result=False)
+    events.debug("search_results_start", chat_id=chat_id, results=results)
+    for i, video in enumerate(results[:5]):
+        events.debug("search_result_button", chat_id=chat_id, index=i + 1, source="yt", text=f"{video['title']} ⏱ 3:35")
+    events.info("search_results_sent", chat_id=chat_id, count=5, sources=["yt"] * 5)
+    events.debug("track_delete_start", user_id=user_id, data="del:0")
+    events.info("track_deleted", user_id=user_id, index=0, title="title",
+                remaining=len(user_tracks.get(user_id, [])), saved=True)
+
+
+def measure(run, updates):
+    cpu_thread = time.thread_time()
+    cpu_process = time.process_time()
+    wall = time.perf_counter()
+    for n in range(updates):
+        run(n)
+    return (time.thread_time() - cpu_thread, time.process_time() - cpu_process, time.perf_counter() - wall)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Стоимость логирования на одно обновление")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--tracks", type=int, default=30)
+    args = parser.parse_args()
+
+    user_tracks, results, premium = make_data(args.users, args.tracks)
+    root = logging.getLogger()
+    stream = CountingStream()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+    # До: синхронный обработчик, f-строки
+    old = measure(lambda n: old_update(user_tracks, results, premium, str(1000 + n % args.users), n), args.updates)
+    old_bytes = stream.bytes
+
+    # После: события и запись в фоновом потоке
+    stream.bytes = 0
+    setup_logging("INFO")
+    events = get_event_logger("music_bot")
+    new_thread, _, new_wall = measure(
+        lambda n: new_update(events, user_tracks, results, premium, str(1000 + n % args.users), n), args.updates)
+    process_before = time.process_time()
+    shutdown_logging()  # Дожидаемся, пока фоновый поток допишет очередь
+    new_process = time.process_time() - process_before + new_thread
+    new_bytes = stream.bytes
+
+    per = 1e6 / args.updates
+    print(f"Обновлений: {args.updates}, коллекции: {args.users} x {args.tracks}")
+    print(f"{'':12}{'байт/обн.':>14}{'CPU поток, мкс':>18}{'CPU процесс, мкс':>20}{'стена, мкс':>14}")
+    print(f"{'до':12}{old_bytes / args.updates:>14.0f}{old[0] * per:>18.1f}{old[1] * per:>20.1f}{old[2] * per:>14.1f}")
+    print(f"{'после':12}{new_bytes / args.updates:>14.0f}{new_thread * per:>18.1f}{new_process * per:>20.1f}{new_wall * per:>14.1f}")
+    print(f"Счетчики log_events: {log_events.log_stats()}")
+
+
+if __name__ == "__main__":
+    main()
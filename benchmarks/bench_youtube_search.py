@@ -0,0 +1,106 @@
+"""
+Сравнение поиска YouTube: innertube через общий пул aiohttp против
+прежнего пути (ytsearchN: + extract_flat в yt-dlp в отдельном потоке).
+
+Запуск:
+    python benchmarks/bench_youtube_search.py --rounds 3 --concurrency 5
+
+Для каждого пути печатаются медиана/p95 задержки запроса, общее время
+и процессорное время процесса. Нужен доступ к youtube.com.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+
+from http_pool import close_sessions
+from youtube_search import youtube_client
+
+QUERIES = [
+    "eminem lose yourself",
+    "daft punk get lucky",
+    "queen bohemian rhapsody",
+    "кино группа крови",
+    "billie eilish bad guy",
+    "the weeknd blinding lights",
+    "arctic monkeys do i wanna know",
+    "земфира хочешь",
+    "nirvana smells like teen spirit",
+    "dua lipa levitating",
+]
+
+
+def ytdlp_search_blocking(query, limit):
+    """Прежний путь: новый YoutubeDL и flat-извлечение на каждый запрос"""
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'ignoreerrors': True,
+        'extract_flat': True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(f"ytsearch{limit}:{query}", download=False)
+    return (info or {}).get("entries") or []
+
+
+async def run_ytdlp(query, limit):
+    return await asyncio.to_thread(ytdlp_search_blocking, query, limit)
+
+
+async def run_innertube(query, limit):
+    return await youtube_client.search(query, limit) or []
+
+
+async def bench(name, func, queries, limit, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    empty = 0
+
+    async def one(query):
+        nonlocal empty
+        async with semaphore:
+            started = time.perf_counter()
+            results = await func(query, limit)
+            latencies.append(time.perf_counter() - started)
+            if not results:
+                empty += 1
+
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in queries))
+    wall = time.perf_counter() - wall_started
+    cpu = time.process_time() - cpu_started
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name:10} запросов={len(queries):4d} пустых={empty:3d} "
+          f"медиана={statistics.median(latencies) * 1000:8.1f} мс  p95={p95 * 1000:8.1f} мс  "
+          f"всего={wall:6.2f} с  CPU={cpu:6.2f} с")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3, help="сколько раз прогнать список запросов")
+    parser.add_argument("--limit", type=int, default=5, help="результатов на запрос")
+    parser.add_argument("--concurrency", type=int, default=5, help="одновременных запросов")
+    args = parser.parse_args()
+
+    queries = QUERIES * args.rounds
+    try:
+        await bench("innertube", run_innertube, queries, args.limit, args.concurrency)
+        await bench("yt-dlp", run_ytdlp, queries, args.limit, args.concurrency)
+    finally:
+        await close_sessions()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,514 @@
+"""
+Нагрузочный стенд music_bot_new без api.telegram.org, YouTube и SoundCloud.
+
+Части стенда:
+    * поддельный Bot API (aiohttp): записывает вызовы sendMessage, sendAudio,
+      editMessage* и прочие, добавляет задержку и с заданной вероятностью
+      отвечает 429 с retry_after;
+    * медиасервер: отдает mp3-фикстуру по /media/<id>.mp3 (с ограничением
+      скорости), а подмененный yt_dlp.YoutubeDL с экстрактором FixtureIE
+      скачивает ссылки YouTube/SoundCloud с него - настоящим загрузчиком
+      yt-dlp, в том же пуле потоков, что и в боте;
+    * поиск YouTube/SoundCloud подменяется каталогом фикстур с задержкой;
+    * генератор обновлений: N виртуальных пользователей проходят сценарий
+      /start -> find_track -> запрос -> dl:<id> -> my_music -> play:0
+      с общей частотой --rate обновлений в секунду.
+
+Серверы работают в отдельном потоке со своим event loop, бот - в основном
+loop, обновления подаются через dp.feed_raw_update (как в webhook_server).
+В конце печатается отчет: пропускная способность, перцентили задержки
+обновлений (от генерации до конца обработчика), вызовы Bot API, спаны
+трассировки, CPU, пиковая память и задержка event loop.
+
+Запуск:
+    python benchmarks/load_harness.py --users 200 --rate 50 --duration 60
+    python benchmarks/load_harness.py --users 50 --rate 20 --duration 30 \\
+        --api-latency 80 --retry-after-rate 0.02 --media-kbps 2000 --report load_report.json
+
+Нужны зависимости бота (aiogram, aiohttp, yt-dlp); без ffmpeg конвертация
+пропускается, фикстура сразу сохраняется как mp3. Данные бота пишутся во
+временную папку.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiohttp import web
+
+from bench_hot_paths import PLACEHOLDER_ENV
+
+FAKE_TOKEN = "123456:" + "A" * 35
+QUERY_WORDS = ["love", "night", "city", "dream", "fire", "rain", "summer", "heart", "light", "road",
+               "ночь", "город", "лето", "звезда", "море", "кино", "rock", "jazz", "remix", "live"]
+# Кадр MPEG-1 Layer III, 128 kbps, 44.1 kHz (417 байт, тишина)
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0x44]) + bytes(413)
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return values[min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))]
+
+    return {"count": len(values), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": values[-1]}
+
+
+# === Поддельный Bot API и медиасервер ===
+
+class FakeServers:
+    """Bot API и медиасервер на одном aiohttp-приложении в отдельном потоке"""
+
+    def __init__(self, api_latency_ms: float, retry_after_rate: float, retry_after: int,
+                 fixture_kb: int, media_kbps: float, seed: int):
+        self.api_latency = api_latency_ms / 1000
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.fixture = MP3_FRAME * max(1, fixture_kb * 1024 // len(MP3_FRAME))
+        self.media_kbps = media_kbps
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.retry_after_sent = Counter()
+        self.api_bytes = 0
+        self.media_requests = 0
+        self.message_ids = itertools.count(1000)
+        self.loop = None
+        self.port = None
+        self._ready = threading.Event()
+        self._runner = None
+
+    # --- Bot API ---
+
+    def _message(self, method: str, params) -> dict:
+        chat_id = params.get("chat_id", 0)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = 0
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 123456, "is_bot": True, "first_name": "bench_bot"},
+        }
+        file_id = f"fx_file_{message['message_id']}"
+        if method == "sendaudio":
+            message["audio"] = {"file_id": file_id, "file_unique_id": file_id, "duration": 180}
+        elif method == "senddocument":
+            message["document"] = {"file_id": file_id, "file_unique_id": file_id}
+        elif method in ("sendphoto", "editmessagemedia"):
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 512, "height": 512}]
+        else:
+            message["text"] = str(params.get("text") or params.get("caption") or "")
+        return message
+
+    async def handle_api(self, request):
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        self.api_bytes += request.content_length or 0
+        params = await request.post() if request.can_read_body else {}
+        await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.api_latency)
+
+        if self.retry_after_rate and self.rng.random() < self.retry_after_rate:
+            self.retry_after_sent[method] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        if method == "getme":
+            result = {"id": 123456, "is_bot": True, "first_name": "bench_bot", "username": "bench_bot"}
+        elif method.startswith(("send", "edit", "copy", "forward")):
+            result = self._message(method, params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    # --- Медиа ---
+
+    async def handle_media(self, request):
+        self.media_requests += 1
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg",
+                                               "Content-Length": str(len(self.fixture))})
+        await response.prepare(request)
+        chunk = 64 * 1024
+        delay = chunk / (self.media_kbps * 1024 / 8) if self.media_kbps else 0
+        for offset in range(0, len(self.fixture), chunk):
+            await response.write(self.fixture[offset:offset + chunk])
+            if delay:
+                await asyncio.sleep(delay)
+        await response.write_eof()
+        return response
+
+    # --- Поток серверов ---
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_api)
+        app.router.add_get("/media/{media_id}.mp3", self.handle_media)
+        self._runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    def start(self) -> str:
+        threading.Thread(target=self._run, name="fake_servers", daemon=True).start()
+        self._ready.wait()
+        return f"http://127.0.0.1:{self.port}"
+
+    def stop(self):
+        if self.loop:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result(timeout=10)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+# === Подмена yt-dlp и поиска ===
+
+def install_fixture_sources(base_url: str, catalog: int, search_latency_ms: float, seed: int):
+    """Подменяет yt_dlp.YoutubeDL и клиентов поиска на фикстуры медиасервера"""
+    import yt_dlp
+    from yt_dlp.extractor.common import InfoExtractor
+
+    from soundcloud_search import soundcloud_client
+    from youtube_search import youtube_client
+
+    class FixtureIE(InfoExtractor):
+        IE_NAME = "fixture"
+        _VALID_URL = (r"https?://(?:www\.)?(?:youtube\.com/watch\?v=(?P<yt>[A-Za-z0-9_-]{11})"
+                      r"|soundcloud\.com/(?P<sc>[^?#]+))")
+
+        def _real_extract(self, url):
+            match = re.match(self._VALID_URL, url)
+            media_id = match.group("yt") or match.group("sc").replace("/", "_")
+            return {
+                "id": media_id,
+                "title": f"Fixture {media_id}",
+                "url": f"{base_url}/media/{media_id}.mp3",
+                "ext": "mp3",
+                "acodec": "mp3",
+                "vcodec": "none",
+                "duration": 180,
+            }
+
+    ffmpeg_available = shutil.which("ffmpeg") is not None
+    original_youtube_dl = yt_dlp.YoutubeDL
+
+    class FixtureYoutubeDL(original_youtube_dl):
+        def __init__(self, params=None, auto_init=True):
+            params = dict(params or {})
+            if not ffmpeg_available:
+                params.pop("postprocessors", None)
+            super().__init__(params, auto_init=False)
+            self.add_info_extractor(FixtureIE())
+
+    yt_dlp.YoutubeDL = FixtureYoutubeDL
+
+    latency = search_latency_ms / 1000
+
+    def catalog_ids(query, limit, prefix):
+        # Один и тот же запрос дает одни и те же треки: работают кэши и дедупликация загрузок
+        rng = random.Random(f"{seed}:{prefix}:{query}")
+        return [rng.randrange(catalog) for _ in range(limit)]
+
+    async def youtube_search(query, limit=5):
+        await asyncio.sleep(latency)
+        return [{"id": f"fx{n:09d}", "title": f"Fixture Artist {n} - Song {n} official audio",
+                 "duration": 120 + n % 240, "url": f"https://www.youtube.com/watch?v=fx{n:09d}",
+                 "source": "yt"} for n in catalog_ids(query, limit, "yt")]
+
+    async def soundcloud_search(query, limit=10):
+        await asyncio.sleep(latency)
+        return [{"title": f"Fixture SC {n} - Track {n}", "url": f"https://soundcloud.com/fixture-user/track-{n}",
+                 "duration": 120 + n % 240, "source": "sc"} for n in catalog_ids(query, limit, "sc")]
+
+    youtube_client.search = youtube_search
+    soundcloud_client.search_tracks = soundcloud_search
+    return ffmpeg_available
+
+
+# === Генератор обновлений ===
+
+class UpdateGenerator:
+    """Виртуальные пользователи и их сценарии"""
+
+    SCRIPT = ("start", "find_track", "search", "download", "my_music", "play")
+
+    def __init__(self, users: int, catalog: int, seed: int):
+        self.rng = random.Random(seed)
+        self.catalog = catalog
+        self.seed = seed
+        self.users = [900000000 + i for i in range(users)]
+        self.step = defaultdict(int)
+        self.last_results = {}
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.sent = Counter()
+        self.queries = [" ".join(self.rng.sample(QUERY_WORDS, 2)) for _ in range(200)]
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+    def _message(self, user_id, text):
+        return {"message_id": next(self.message_ids), "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id), "text": text}
+
+    def _callback(self, user_id, data):
+        bot_message = {"message_id": next(self.message_ids), "date": int(time.time()),
+                       "chat": {"id": user_id, "type": "private"},
+                       "from": {"id": 123456, "is_bot": True, "first_name": "bench_bot"}, "text": "menu"}
+        return {"id": str(next(self.message_ids)), "from": self._user(user_id), "chat_instance": str(user_id),
+                "message": bot_message, "data": data}
+
+    def _query(self):
+        # Популярные запросы повторяются чаще (распределение Ципфа)
+        index = min(len(self.queries) - 1, int(self.rng.paretovariate(1.1)) - 1)
+        return self.queries[index]
+
+    def next_update(self):
+        user_id = self.rng.choice(self.users)
+        action = self.SCRIPT[self.step[user_id] % len(self.SCRIPT)]
+        self.step[user_id] += 1
+        update = {"update_id": next(self.update_ids)}
+        if action == "start":
+            update["message"] = self._message(user_id, "/start")
+        elif action == "find_track":
+            update["callback_query"] = self._callback(user_id, "find_track")
+        elif action == "search":
+            query = self._query()
+            self.last_results[user_id] = query
+            update["message"] = self._message(user_id, query)
+        elif action == "download":
+            # Первый результат YouTube по последнему запросу - тот же, что вернул поиск-фикстура
+            query = self.last_results.get(user_id, self._query())
+            n = random.Random(f"{self.seed}:yt:{query}").randrange(self.catalog)
+            update["callback_query"] = self._callback(user_id, f"dl:fx{n:09d}")
+        elif action == "my_music":
+            update["callback_query"] = self._callback(user_id, "my_music")
+        else:
+            update["callback_query"] = self._callback(user_id, "play:0")
+        self.sent[action] += 1
+        return update, action
+
+
+# === Запуск ===
+
+async def run_load(args, bot_module, servers, generator):
+    from aiogram import BaseMiddleware
+    from tracing import tracer
+
+    bot, dp = bot_module.bot, bot_module.dp
+    created = {}
+    latencies = defaultdict(list)
+    handled = Counter()
+    failed = Counter()
+
+    class LatencyMiddleware(BaseMiddleware):
+        """Внутри полосы: время от генерации обновления до конца обработчика"""
+
+        async def __call__(self, handler, event, data):
+            try:
+                return await handler(event, data)
+            except Exception:
+                failed[created.get(event.update_id, (0, "unknown"))[1]] += 1
+                raise
+            finally:
+                started, action = created.pop(event.update_id, (None, "unknown"))
+                if started is not None:
+                    latencies[action].append(time.perf_counter() - started)
+                    handled[action] += 1
+
+    dp.update.outer_middleware(LatencyMiddleware())
+
+    lag_samples = []
+
+    async def sample_lag():
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(0.1)
+            lag_samples.append(max(0.0, loop.time() - started - 0.1))
+
+    lag_task = asyncio.create_task(sample_lag())
+    await dp.emit_startup(bot=bot)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    interval = 1 / args.rate
+    next_at = started
+    sent = 0
+    behind = 0
+    while time.perf_counter() - started < args.duration:
+        update, action = generator.next_update()
+        created[update["update_id"]] = (time.perf_counter(), action)
+        await dp.feed_raw_update(bot, update)
+        sent += 1
+        next_at += interval
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            behind += 1
+            await asyncio.sleep(0)
+    generation_time = time.perf_counter() - started
+
+    # Ждем, пока полосы разберут очереди
+    drain_deadline = time.perf_counter() + args.drain_timeout
+    while created and time.perf_counter() < drain_deadline:
+        await asyncio.sleep(0.2)
+    total_time = time.perf_counter() - started
+    cpu_time = time.process_time() - cpu_started
+    lag_task.cancel()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    spans = tracer.percentiles()
+    report = {
+        "params": {key: value for key, value in vars(args).items() if key != "report"},
+        "sent": sent,
+        "handled": sum(handled.values()),
+        "unfinished": len(created),
+        "failed": dict(failed),
+        "generator_behind": behind,
+        "generation_seconds": generation_time,
+        "total_seconds": total_time,
+        "throughput_per_sec": sum(handled.values()) / total_time if total_time else 0,
+        "latency": percentiles(all_latencies),
+        "latency_by_action": {action: percentiles(values) for action, values in latencies.items()},
+        "bot_api_calls": dict(servers.calls),
+        "bot_api_retry_after": dict(servers.retry_after_sent),
+        "bot_api_bytes": servers.api_bytes,
+        "media_requests": servers.media_requests,
+        "spans": spans,
+        "cpu_seconds": cpu_time,
+        "cpu_percent": cpu_time / total_time * 100 if total_time else 0,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "event_loop_lag": percentiles(lag_samples),
+        "update_executor": {key: value for key, value in bot_module.update_executor.stats(top=0).items()
+                            if not isinstance(value, list)},
+    }
+    return report
+
+
+def print_report(report):
+    def ms(item, key):
+        return f"{item[key] * 1000:.0f}" if key in item else "-"
+
+    print(f"\nОтправлено обновлений: {report['sent']}, обработано: {report['handled']}, "
+          f"не завершено: {report['unfinished']}, ошибок: {sum(report['failed'].values())}")
+    print(f"Время: {report['total_seconds']:.1f} с, пропускная способность: {report['throughput_per_sec']:.1f} обн/с"
+          f"{', генератор не успевал: ' + str(report['generator_behind']) if report['generator_behind'] else ''}")
+    latency = report["latency"]
+    print(f"Задержка обновлений, мс: p50 {ms(latency, 'p50')} / p95 {ms(latency, 'p95')} / "
+          f"p99 {ms(latency, 'p99')} / max {ms(latency, 'max')}")
+    for action, item in sorted(report["latency_by_action"].items()):
+        print(f"  {action:12} n={item['count']:<6} p50 {ms(item, 'p50'):>6}  p95 {ms(item, 'p95'):>6}  p99 {ms(item, 'p99'):>6}")
+    print(f"Вызовы Bot API: {report['bot_api_calls']}")
+    if report["bot_api_retry_after"]:
+        print(f"Ответы 429 (retry_after): {report['bot_api_retry_after']}")
+    print(f"Загрузок с медиасервера: {report['media_requests']}")
+    print("Спаны (p50 / p95 / p99, мс):")
+    for name, item in sorted(report["spans"].items(), key=lambda kv: kv[1]["p95"], reverse=True)[:15]:
+        print(f"  {name:28} {ms(item, 'p50'):>6} {ms(item, 'p95'):>6} {ms(item, 'p99'):>6}  n={item['count']}")
+    lag = report["event_loop_lag"]
+    print(f"CPU: {report['cpu_seconds']:.1f} с ({report['cpu_percent']:.0f}%), пик памяти {report['max_rss_mb']:.0f} МБ, "
+          f"задержка event loop p95 {ms(lag, 'p95')} мс, max {ms(lag, 'max')} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд бота с поддельным Bot API и источниками")
+    parser.add_argument("--users", type=int, default=100, help="Виртуальных пользователей")
+    parser.add_argument("--rate", type=float, default=20, help="Обновлений в секунду")
+    parser.add_argument("--duration", type=float, default=30, help="Секунд генерации нагрузки")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="Сколько ждать обработки после генерации")
+    parser.add_argument("--api-latency", type=float, default=50, help="Средняя задержка Bot API, мс")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--search-latency", type=float, default=300, help="Задержка поиска, мс")
+    parser.add_argument("--catalog", type=int, default=1000, help="Треков в каталоге фикстур")
+    parser.add_argument("--fixture-kb", type=int, default=512, help="Размер mp3-фикстуры, КБ")
+    parser.add_argument("--media-kbps", type=float, default=0, help="Скорость медиасервера, кбит/с (0 - без ограничения)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--report", help="Сохранить отчет в JSON")
+    args = parser.parse_args()
+
+    for key, value in PLACEHOLDER_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ["BOT_TOKEN"] = FAKE_TOKEN
+    os.chdir(ROOT)  # bear.png и прочие ресурсы бот открывает по относительным путям
+    # Все данные бота - во временной папке: базы открываются при импорте, поэтому пути задаются заранее
+    workdir = tempfile.mkdtemp(prefix="load_harness_")
+    os.environ.setdefault("STATE_DB_FILE", os.path.join(workdir, "state.db"))
+    os.environ.setdefault("DOWNLOAD_JOBS_DB", os.path.join(workdir, "download_jobs.db"))
+    os.environ.setdefault("LEADER_LEASE_DB", os.path.join(workdir, "leader_lease.db"))
+
+    servers = FakeServers(args.api_latency, args.retry_after_rate, args.retry_after,
+                          args.fixture_kb, args.media_kbps, args.seed)
+    base_url = servers.start()
+    ffmpeg_available = install_fixture_sources(base_url, args.catalog, args.search_latency, args.seed)
+
+    import music_bot_new as bot_module
+    from aiogram.client.telegram import TelegramAPIServer
+
+    bot_module.TRACKS_FILE = os.path.join(workdir, "tracks.json")
+    bot_module.SEARCH_CACHE_FILE = os.path.join(workdir, "search_cache.json")
+    bot_module.DEFERRED_DELETES_FILE = os.path.join(workdir, "deferred_deletes.json")
+    bot_module.INTEGRITY_FILE = os.path.join(workdir, "integrity.json")
+    bot_module.STATIC_ASSETS_FILE = os.path.join(workdir, "static_assets.json")
+    # yt-dlp перезаписывает файл cookies после загрузки - даем ему копию
+    cookies_file = os.path.join(workdir, "cookies.txt")
+    if os.path.exists(bot_module.COOKIES_FILE):
+        shutil.copyfile(bot_module.COOKIES_FILE, cookies_file)
+    bot_module.COOKIES_FILE = cookies_file
+    bot_module.CACHE_DIR = os.path.join(workdir, "cache")
+    bot_module.CACHE_OUTTMPL = os.path.join(bot_module.CACHE_DIR, "%(title)s.%(ext)s")
+    bot_module.file_refs.directory = bot_module.CACHE_DIR
+    bot_module.disk_quota.directory = bot_module.CACHE_DIR
+    os.makedirs(bot_module.CACHE_DIR)
+    bot_module.bot.session.api = TelegramAPIServer.from_base(base_url)
+
+    print(f"Стенд: {base_url}, пользователей {args.users}, {args.rate} обн/с, {args.duration} с"
+          f"{'' if ffmpeg_available else ' (ffmpeg не найден - без конвертации)'}")
+    generator = UpdateGenerator(args.users, args.catalog, args.seed)
+
+    async def run():
+        try:
+            return await run_load(args, bot_module, servers, generator)
+        finally:
+            await bot_module.bot.session.close()
+
+    try:
+        report = asyncio.run(run())
+    finally:
+        servers.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчет: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Канонизация поисковых запросов и ссылок.
+
+normalize_query приводит запросы к единому виду (NFKC, casefold, схлопывание
+пробелов, замена кириллических двойников латиницы в смешанных словах,
+опционально транслитерация), чтобы "Eminem  Lose Yourself" и
+"eminem lose yourself " попадали в один ключ кэша.
+
+canonical_url / media_key сводят разные формы ссылок YouTube и SoundCloud
+(youtu.be, music.youtube.com, /shorts/, m.soundcloud.com, метки ?si=, utm_*)
+к одному каноническому идентификатору трека.
+"""
+
+import re
+import unicodedata
+import urllib.parse
+from typing import Optional, Tuple
+
+# Кириллические буквы, которые выглядят как латинские (после casefold)
+_CONFUSABLES = str.maketrans({
+    "а": "a", "в": "b", "е": "e", "ё": "e", "к": "k", "м": "m", "н": "h", "о": "o",
+    "р": "p", "с": "c", "т": "t", "у": "y", "х": "x", "і": "i", "ј": "j", "ѕ": "s",
+    "һ": "h", "ԁ": "d", "ԛ": "q", "ԝ": "w",
+})
+
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "kh", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "і": "i", "ї": "yi", "є": "ye", "ґ": "g",
+})
+
+# Разделители, которые не влияют на смысл запроса
+_SEPARATORS_RE = re.compile(r"[\-‐‑‒–—―_.,;:!?|/\\\"«»“”„()\[\]{}]+")
+_WHITESPACE_RE = re.compile(r"\s+")
+_LATIN_RE = re.compile(r"[a-z]")
+_CYRILLIC_RE = re.compile(r"[Ѐ-ӿ]")
+
+_YOUTUBE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+_YOUTUBE_HOSTS = {
+    "youtube.com", "m.youtube.com", "music.youtube.com",
+    "youtube-nocookie.com", "gaming.youtube.com",
+}
+_YOUTUBE_PATH_PREFIXES = ("shorts", "embed", "live", "v", "e")
+_SOUNDCLOUD_HOSTS = {"soundcloud.com", "m.soundcloud.com"}
+# Служебные разделы SoundCloud, которые не являются профилями исполнителей
+_SOUNDCLOUD_RESERVED = {"discover", "search", "charts", "stream", "you", "upload", "pages", "stations"}
+# Метки отслеживания, которые отбрасываются из неизвестных ссылок
+_TRACKING_PARAMS = {"si", "feature", "fbclid", "gclid", "igshid", "ref", "ab_channel", "pp", "in", "in_system_playlist"}
+
+
+def _fix_confusables(word: str) -> str:
+    """Заменяет кириллических двойников на латиницу, если слово смешанное"""
+    if _LATIN_RE.search(word) and _CYRILLIC_RE.search(word):
+        return word.translate(_CONFUSABLES)
+    return word
+
+
+def transliterate(text: str) -> str:
+    """Простая транслитерация кириллицы в латиницу"""
+    return text.translate(_TRANSLIT)
+
+
+def normalize_query(query: str, transliterate_cyrillic: bool = False) -> str:
+    """Канонический вид поискового запроса для ключей кэша"""
+    if not query:
+        return ""
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = _SEPARATORS_RE.sub(" ", text)
+    words = [_fix_confusables(word) for word in _WHITESPACE_RE.split(text) if word]
+    text = " ".join(words)
+    if transliterate_cyrillic:
+        text = transliterate(text)
+    return text
+
+
+def _split_url(text: str) -> Optional[urllib.parse.SplitResult]:
+    text = (text or "").strip()
+    if not text or " " in text:
+        return None
+    if "://" not in text:
+        text = "https://" + text
+    try:
+        parts = urllib.parse.urlsplit(text)
+    except ValueError:
+        return None
+    if not parts.netloc:
+        return None
+    return parts
+
+
+def parse_media_url(text: str) -> Optional[Tuple[str, str]]:
+    """
+    Извлекает (источник, идентификатор) из ссылки:
+    ('yt', '<11 символов>') или ('sc', '<user>/<track>'). Для прочих ссылок None.
+    """
+    parts = _split_url(text)
+    if not parts:
+        return None
+
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    segments = [segment for segment in parts.path.split("/") if segment]
+
+    if host == "youtu.be":
+        if segments and _YOUTUBE_ID_RE.match(segments[0]):
+            return "yt", segments[0]
+        return None
+
+    if host in _YOUTUBE_HOSTS:
+        if segments and segments[0] == "watch":
+            video_id = urllib.parse.parse_qs(parts.query).get("v", [""])[0]
+            if _YOUTUBE_ID_RE.match(video_id):
+                return "yt", video_id
+        elif len(segments) >= 2 and segments[0] in _YOUTUBE_PATH_PREFIXES:
+            if _YOUTUBE_ID_RE.match(segments[1]):
+                return "yt", segments[1]
+        return None
+
+    if host in _SOUNDCLOUD_HOSTS:
+        if len(segments) == 2 and segments[0].lower() not in _SOUNDCLOUD_RESERVED:
+            return "sc", f"{segments[0].lower()}/{segments[1].lower()}"
+        return None
+
+    return None
+
+
+def canonical_url(text: str) -> Optional[str]:
+    """Каноническая ссылка на трек YouTube/SoundCloud или None"""
+    parsed = parse_media_url(text)
+    if not parsed:
+        return None
+    source, media_id = parsed
+    if source == "yt":
+        return f"https://www.youtube.com/watch?v={media_id}"
+    return f"https://soundcloud.com/{media_id}"
+
+
+def strip_tracking_params(url: str) -> str:
+    """Убирает utm_* и прочие метки отслеживания из произвольной ссылки"""
+    parts = _split_url(url)
+    if not parts:
+        return (url or "").strip()
+    query = [
+        (key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if key not in _TRACKING_PARAMS and not key.startswith("utm_")
+    ]
+    return urllib.parse.urlunsplit((
+        parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/") or "/",
+        urllib.parse.urlencode(query), "",
+    ))
+
+
+def media_key(url: str) -> str:
+    """Ключ трека для кэшей и single-flight: 'yt:<id>', 'sc:<user>/<track>' или очищенная ссылка"""
+    parsed = parse_media_url(url)
+    if parsed:
+        return f"{parsed[0]}:{parsed[1]}"
+    return f"url:{strip_tracking_params(url)}"
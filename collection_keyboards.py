@@ -0,0 +1,75 @@
+"""
+Готовые клавиатуры страниц коллекции «Моя музыка».
+
+У каждой коллекции есть версия в state_backend, которая меняется при любом
+изменении коллекции (bump()). Отрисованная страница запоминается по
+(пользователь, страница, владелец кнопок, версия, отпечаток), поэтому
+my_music, music_page: и перерисовка после delete_track без изменений
+коллекции берут готовую InlineKeyboardMarkup из словаря. Страницы старых
+версий больше не запрашиваются и вытесняются из LRU сами.
+
+Версия - время изменения в наносекундах, а не счетчик +1: два процесса,
+одновременно изменившие одну коллекцию, не запишут одинаковую версию.
+Версия и коллекция лежат в разных BackendDict со своими кэшами чтения,
+поэтому процесс может увидеть новую версию со старым списком треков.
+Отпечаток (fingerprint) - число треков и хэш треков страницы, по которым
+она отрисована: устаревший список дает другой ключ, а не чужую страницу.
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, MutableMapping, Optional
+
+from aiogram.types import InlineKeyboardMarkup
+
+import metrics
+
+KEYBOARD_CACHE_SIZE = int(os.getenv("KEYBOARD_CACHE_SIZE", 2000))  # Сколько отрисованных страниц держать в памяти
+
+
+class CollectionKeyboards:
+    """Версии коллекций и LRU отрисованных страниц"""
+
+    def __init__(self, versions: MutableMapping, max_entries: int = KEYBOARD_CACHE_SIZE):
+        self.versions = versions  # пользователь -> версия коллекции, хранится в state_backend
+        self.max_entries = max_entries
+        self._pages: "OrderedDict[tuple, InlineKeyboardMarkup]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, user_id) -> int:
+        return self.versions.get(str(user_id), 0)
+
+    def bump(self, user_id):
+        """Коллекция пользователя изменилась: отрисованные страницы больше не подходят"""
+        user_id = str(user_id)
+        self.versions[user_id] = max(time.time_ns(), self.version(user_id) + 1)
+
+    @staticmethod
+    def fingerprint(tracks: list, start: int, end: int) -> tuple:
+        """Число треков (от него зависит навигация) и хэш треков страницы"""
+        page_tracks = json.dumps(tracks[start:end], ensure_ascii=False, sort_keys=True, default=str)
+        return len(tracks), hash(page_tracks)
+
+    def page(self, user_id, page: int, build: Callable[[], InlineKeyboardMarkup],
+             owner: Optional[str] = None, fingerprint: tuple = ()) -> InlineKeyboardMarkup:
+        """Клавиатура страницы из памяти или build(), если коллекция с тех пор изменилась"""
+        key = (str(user_id), page, owner, self.version(user_id), fingerprint)
+        markup = self._pages.get(key)
+        if markup is not None:
+            self._pages.move_to_end(key)
+            self.hits += 1
+            metrics.CACHE_REQUESTS.labels(cache="keyboard", result="hit").inc()
+            return markup
+        self.misses += 1
+        metrics.CACHE_REQUESTS.labels(cache="keyboard", result="miss").inc()
+        markup = build()
+        self._pages[key] = markup
+        while len(self._pages) > self.max_entries:
+            self._pages.popitem(last=False)
+        return markup
+
+    def stats(self) -> dict:
+        return {"pages": len(self._pages), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,253 @@
+"""
+Квота на папку cache: учёт байт по файлам и классам владельцев, вытеснение LRU.
+
+Каждый mp3 в cache принадлежит одному классу:
+    premium    - в коллекции премиум-пользователя (файл и есть его хранилище);
+    collection - в коллекции обычного пользователя (при воспроизведении
+                 трек всё равно скачивается заново по original_url);
+    temp       - загрузки для поиска, жанров и уже отправленные файлы.
+
+Файлы premium и файлы, которые прямо сейчас отправляются или скачиваются
+(pin()), закреплены. Когда объём превышает DISK_QUOTA_MB, удаляются
+незакреплённые файлы, которые дольше всего не воспроизводились, пока объём
+не опустится до DISK_QUOTA_LOW_WATERMARK от квоты. Порядок хранится в
+OrderedDict: touch() и вытеснение - O(1) на файл.
+
+Если освободить место нельзя (всё закреплено или на диске осталось меньше
+DISK_MIN_FREE_MB), новые загрузки ждут в wait_for_space() до
+DISK_PRESSURE_WAIT секунд и затем отклоняются.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics
+
+DISK_QUOTA_MB = int(os.getenv("DISK_QUOTA_MB", 700))  # Квота на папку cache (диск на Render - 1 ГБ, часть занимает проект)
+DISK_QUOTA_LOW_WATERMARK = 0.9  # Вытеснение идет до этой доли квоты, чтобы не срабатывать на каждом файле
+DISK_MIN_FREE_MB = int(os.getenv("DISK_MIN_FREE_MB", 100))  # Свободного места на диске меньше этого - давление
+DISK_PRESSURE_WAIT = 30  # Сколько загрузка ждет освобождения места, прежде чем отказать
+DISK_PRESSURE_POLL = 1.0
+
+OWNER_PREMIUM = "premium"
+OWNER_COLLECTION = "collection"
+OWNER_TEMP = "temp"
+OWNERS = (OWNER_PREMIUM, OWNER_COLLECTION, OWNER_TEMP)
+PINNED_OWNERS = (OWNER_PREMIUM,)
+
+
+class DiskQuota:
+    """Учет файлов кэша и вытеснение давно не воспроизводившихся"""
+
+    def __init__(self, directory: str, quota_bytes: int = DISK_QUOTA_MB * 1024 * 1024,
+                 min_free_bytes: int = DISK_MIN_FREE_MB * 1024 * 1024):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.files: "OrderedDict[str, list]" = OrderedDict()  # путь -> [размер, владелец]; начало - давно не играли
+        self.bytes_by_owner: Dict[str, int] = {owner: 0 for owner in OWNERS}
+        self.total_bytes = 0
+        self.pins: Dict[str, int] = {}
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self.rejected_downloads = 0
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path)
+
+    # --- Учет ---
+
+    def _account(self, key: str, size: int, owner: str):
+        self.files[key] = [size, owner]
+        self.bytes_by_owner[owner] = self.bytes_by_owner.get(owner, 0) + size
+        self.total_bytes += size
+
+    def _unaccount(self, key: str) -> Optional[list]:
+        entry = self.files.pop(key, None)
+        if entry is not None:
+            self.bytes_by_owner[entry[1]] -= entry[0]
+            self.total_bytes -= entry[0]
+        return entry
+
+    def add(self, path: str, owner: str = OWNER_TEMP):
+        """Новый файл в кэше (только что скачан) - самый свежий в порядке LRU"""
+        key = self._key(path)
+        try:
+            size = os.path.getsize(key)
+        except OSError:
+            return
+        previous = self._unaccount(key)
+        if previous is not None and owner == OWNER_TEMP:
+            owner = previous[1]
+        self._account(key, size, owner)
+        # Сам новый файл не вытесняется: его еще ждут загрузка и отправка
+        with self.pin(key):
+            self.enforce()
+
+    def touch(self, path: str):
+        """Файл воспроизведен или отправлен"""
+        key = self._key(path)
+        if key in self.files:
+            self.files.move_to_end(key)
+
+    def set_owner(self, path: str, owner: str):
+        key = self._key(path)
+        entry = self.files.get(key)
+        if entry is None:
+            self.add(key, owner)
+        elif entry[1] != owner:
+            self.bytes_by_owner[entry[1]] -= entry[0]
+            self.bytes_by_owner[owner] = self.bytes_by_owner.get(owner, 0) + entry[0]
+            entry[1] = owner
+
+    def forget(self, path: str):
+        """Файл удален мимо квоты (очистка, удаление трека пользователем)"""
+        self._unaccount(self._key(path))
+
+    def rescan(self, owners: Dict[str, str]):
+        """
+        Полная сверка с папкой: размеры с диска, владельцы из owners
+        (путь -> класс, остальные файлы - temp). Порядок LRU сохраняется,
+        новые файлы встают по времени последнего доступа.
+        """
+        found = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".mp3") and entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        found[self._key(entry.path)] = (stat.st_size, max(stat.st_atime, stat.st_mtime))
+        except OSError as e:
+            logging.error(f"❌ Не удалось просканировать {self.directory}: {e}")
+            return
+        normalized = {self._key(path): owner for path, owner in owners.items()}
+
+        files = OrderedDict()
+        for key in self.files:
+            if key in found:
+                files[key] = [found[key][0], normalized.get(key, OWNER_TEMP)]
+        for key, (size, _) in sorted(found.items(), key=lambda item: item[1][1]):
+            if key not in files:
+                files[key] = [size, normalized.get(key, OWNER_TEMP)]
+        self.files = files
+        self.bytes_by_owner = {owner: 0 for owner in OWNERS}
+        for size, owner in files.values():
+            self.bytes_by_owner[owner] = self.bytes_by_owner.get(owner, 0) + size
+        self.total_bytes = sum(self.bytes_by_owner.values())
+
+    # --- Закрепление ---
+
+    @contextmanager
+    def pin(self, path: str):
+        """Файл не вытесняется, пока его отправляют или обрабатывают"""
+        key = self._key(path)
+        self.pins[key] = self.pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            count = self.pins.get(key, 0) - 1
+            if count > 0:
+                self.pins[key] = count
+            else:
+                self.pins.pop(key, None)
+
+    def _evictable(self, key: str, entry: list) -> bool:
+        return entry[1] not in PINNED_OWNERS and key not in self.pins
+
+    # --- Вытеснение ---
+
+    def enforce(self) -> int:
+        """Если квота превышена - вытесняет до нижней отметки; возвращает освобожденные байты"""
+        if self.total_bytes <= self.quota_bytes:
+            return 0
+        return self.evict(self.total_bytes - int(self.quota_bytes * DISK_QUOTA_LOW_WATERMARK))
+
+    def evict(self, need_bytes: int) -> int:
+        """Удаляет незакрепленные файлы с начала порядка LRU, пока не освободит need_bytes"""
+        victims = []
+        planned = 0
+        for key, entry in self.files.items():
+            if planned >= need_bytes:
+                break
+            if self._evictable(key, entry):
+                victims.append((key, entry))
+                planned += entry[0]
+
+        freed = 0
+        for key, entry in victims:
+            try:
+                os.remove(key)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"❌ Не удалось вытеснить {key}: {e}")
+                continue
+            self._unaccount(key)
+            freed += entry[0]
+            self.evicted_files += 1
+            self.evicted_bytes += entry[0]
+            metrics.DISK_EVICTIONS.labels(owner=entry[1]).inc()
+            metrics.DISK_EVICTED_BYTES.labels(owner=entry[1]).inc(entry[0])
+        if freed:
+            logging.info(f"🧹 Квота cache: вытеснено {freed / 1024 / 1024:.1f} MB, "
+                         f"занято {self.total_bytes / 1024 / 1024:.1f} из {self.quota_bytes / 1024 / 1024:.0f} MB")
+        return freed
+
+    def free_disk_bytes(self) -> Optional[int]:
+        try:
+            return shutil.disk_usage(self.directory).free
+        except OSError:
+            return None
+
+    def under_pressure(self) -> bool:
+        """Квота исчерпана закрепленными файлами или на диске почти нет места"""
+        if self.total_bytes >= self.quota_bytes:
+            return True
+        free = self.free_disk_bytes()
+        return free is not None and free < self.min_free_bytes
+
+    def relieve(self) -> bool:
+        """Пытается снять давление вытеснением; True - место есть"""
+        if not self.under_pressure():
+            return True
+        need = self.total_bytes - int(self.quota_bytes * DISK_QUOTA_LOW_WATERMARK)
+        free = self.free_disk_bytes()
+        if free is not None and free < self.min_free_bytes:
+            need = max(need, self.min_free_bytes - free)
+        self.evict(need)
+        return not self.under_pressure()
+
+    async def wait_for_space(self, timeout: float = DISK_PRESSURE_WAIT) -> bool:
+        """Перед новой загрузкой: ждет, пока место освободится; False - загрузку нужно отклонить"""
+        if self.relieve():
+            return True
+        logging.warning(f"💽 Нехватка места в cache ({self.total_bytes / 1024 / 1024:.1f} MB), загрузка приостановлена")
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(DISK_PRESSURE_POLL)
+            if self.relieve():
+                return True
+        self.rejected_downloads += 1
+        metrics.DISK_REJECTED_DOWNLOADS.inc()
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self.files),
+            "total_bytes": self.total_bytes,
+            "quota_bytes": self.quota_bytes,
+            "bytes_by_owner": dict(self.bytes_by_owner),
+            "pinned_files": len(self.pins),
+            "free_disk_bytes": self.free_disk_bytes(),
+            "under_pressure": self.under_pressure(),
+            "evicted_files": self.evicted_files,
+            "evicted_bytes": self.evicted_bytes,
+            "rejected_downloads": self.rejected_downloads,
+        }
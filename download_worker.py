@@ -0,0 +1,430 @@
+"""
+Процессы-загрузчики: yt-dlp и ffmpeg вне процесса, обслуживающего Telegram.
+
+Процесс бота ставит задачу в локальную очередь (таблица SQLite) и ждёт
+результат, а воркеры в отдельных процессах забирают задачи, скачивают и
+конвертируют трек и записывают путь к файлу и краткую информацию о треке.
+Бот только планирует загрузки и отправляет готовые файлы.
+
+Запуск воркеров (на той же машине, что и бот - файлы общие):
+    python download_worker.py                # по числу ядер минус одно
+    python download_worker.py --workers 4
+
+В боте очередь включается переменной DOWNLOAD_WORKERS_ENABLED=true. Если
+живых воркеров нет, бот скачивает сам в пуле потоков, как раньше.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import yt_dlp
+
+from source_health import YdlErrorCollector
+
+DOWNLOAD_JOBS_DB = os.getenv("DOWNLOAD_JOBS_DB", os.path.join(os.path.dirname(__file__), "download_jobs.db"))
+DOWNLOAD_WORKERS_ENABLED = os.getenv("DOWNLOAD_WORKERS_ENABLED", "false").lower() == "true"
+DOWNLOAD_JOB_TIMEOUT = 600  # Сколько бот ждет результата задачи
+DOWNLOAD_POLL_INTERVAL = 0.25  # Интервал опроса очереди (и воркером, и ботом)
+WORKER_HEARTBEAT_INTERVAL = 5  # Как часто воркер отмечается в таблице workers
+WORKER_STALE_AFTER = 60  # Воркер без отметок дольше этого считается упавшим
+FINISHED_JOB_TTL = 3600  # Результаты, которые бот так и не забрал, удаляются через час
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Поля информации yt-dlp, которые передаются обратно в бот
+INFO_FIELDS = ("id", "title", "duration", "uploader", "webpage_url", "extractor_key", "ext", "thumbnail",
+               "transcode_seconds", "track", "artist", "creator", "channel", "acodec", "abr")
+
+
+def default_worker_count() -> int:
+    """Одно ядро оставляем процессу бота"""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def ydl_download_blocking(url, outtmpl, cookiefile, is_premium=False, errors=None):
+    """Блокирующая функция для скачивания через yt-dlp (тексты ошибок дописываются в errors)"""
+    try:
+        # Проверяем входные параметры
+        if not url or not isinstance(url, str):
+            logging.error("🌨️ ydl_download_blocking: некорректный URL")
+            return None
+
+        if not outtmpl or not isinstance(outtmpl, str):
+            logging.error("🌨️ ydl_download_blocking: некорректный шаблон имени файла")
+            return None
+
+        # Базовые настройки
+        ydl_opts = {
+            'format': 'bestaudio/best',
+            'outtmpl': outtmpl,
+            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}],
+            'quiet': True,
+            'no_warnings': True,
+            'ignoreerrors': True,
+            'extract_flat': False,  # Для загрузки нужно False
+            'timeout': 300,  # Увеличиваем таймаут до 5 минут
+            'retries': 3,  # Количество попыток
+        }
+        if errors is not None:
+            ydl_opts['logger'] = YdlErrorCollector(errors)
+
+        # Время постобработки (ffmpeg) отдельно от скачивания - для метрик
+        postprocess_started = {}
+        postprocess_seconds = [0.0]
+
+        def postprocessor_hook(d):
+            if d.get('status') == 'started':
+                postprocess_started[d.get('postprocessor')] = time.perf_counter()
+            elif d.get('status') == 'finished' and d.get('postprocessor') in postprocess_started:
+                postprocess_seconds[0] += time.perf_counter() - postprocess_started.pop(d.get('postprocessor'))
+
+        ydl_opts['postprocessor_hooks'] = [postprocessor_hook]
+
+        # Премиум настройки для качества 320 kbps
+        if is_premium:
+            ydl_opts['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '320'}]
+            logging.info(f"💎 Премиум загрузка: качество 320 kbps для {url}")
+        else:
+            logging.info(f"📱 Обычная загрузка: качество 192 kbps для {url}")
+
+        # Проверяем cookies файл
+        if cookiefile and os.path.exists(cookiefile):
+            try:
+                ydl_opts['cookiefile'] = cookiefile
+                logging.info(f"🍪 Используем cookies файл: {cookiefile}")
+            except Exception as cookie_error:
+                logging.warning(f"🐻‍❄️ Ошибка с cookies файлом: {cookie_error}")
+        else:
+            logging.info("🍪 Cookies файл не найден, используем поиск без авторизации")
+
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            try:
+                # Получаем информацию о видео
+                info = ydl.extract_info(url, download=True)
+
+                if not info:
+                    logging.error(f"🌨️ Не удалось получить информацию о видео: {url}")
+                    return None
+
+                # Получаем имя файла
+                filename = ydl.prepare_filename(info)
+                if not filename:
+                    logging.error(f"🌨️ Не удалось подготовить имя файла для: {url}")
+                    return None
+
+                # Преобразуем в .mp3
+                mp3_filename = os.path.splitext(filename)[0] + ".mp3"
+
+                # Проверяем, что файл действительно создался
+                if not os.path.exists(mp3_filename):
+                    logging.error(f"🌨️ MP3 файл не был создан: {mp3_filename}")
+                    return None
+
+                # Проверяем размер файла
+                try:
+                    file_size = os.path.getsize(mp3_filename)
+                    if file_size == 0:
+                        logging.error(f"🌨️ Созданный файл пустой: {mp3_filename}")
+                        return None
+                    quality_text = "320 kbps" if is_premium else "192 kbps"
+                    logging.info(f"🐻‍❄️ Файл создан успешно: {mp3_filename} ({file_size} байт, {quality_text})")
+                except Exception as size_error:
+                    logging.error(f"🌨️ Ошибка проверки размера файла: {size_error}")
+                    return None
+
+                info['transcode_seconds'] = postprocess_seconds[0]
+                return mp3_filename, info
+
+            except Exception as extract_error:
+                logging.error(f"🌨️ Ошибка извлечения информации: {extract_error}")
+                if errors is not None:
+                    errors.append(str(extract_error))
+                return None
+
+    except Exception as e:
+        logging.error(f"🌨️ Критическая ошибка в ydl_download_blocking: {e}")
+        return None
+
+
+class DownloadJobQueue:
+    """Очередь задач загрузки в SQLite, общая для бота и воркеров"""
+
+    def __init__(self, path: str = DOWNLOAD_JOBS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        # Запросы бота - в своем потоке: при блокировке БД воркерами (busy_timeout 30 сек) event loop не встает
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение создается лениво: после fork у каждого процесса должно быть свое
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, outtmpl TEXT NOT NULL, "
+                "cookiefile TEXT, is_premium INTEGER NOT NULL DEFAULT 0, "
+                "status TEXT NOT NULL, worker TEXT, filename TEXT, info TEXT, errors TEXT, "
+                "created REAL NOT NULL, started REAL, finished REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "name TEXT PRIMARY KEY, pid INTEGER, host TEXT, started REAL, last_seen REAL, "
+                "processed INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    async def _in_thread(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="download-jobs")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # --- Сторона бота ---
+
+    def submit(self, url: str, outtmpl: str, cookiefile: Optional[str], is_premium: bool = False) -> int:
+        with self._lock:
+            cursor = self._connection().execute(
+                "INSERT INTO jobs (url, outtmpl, cookiefile, is_premium, status, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (url, outtmpl, cookiefile, int(bool(is_premium)), STATUS_QUEUED, time.time()),
+            )
+            return cursor.lastrowid
+
+    def result(self, job_id: int) -> Optional[tuple]:
+        """(status, filename, info, errors) задачи"""
+        rows = self._execute("SELECT status, filename, info, errors FROM jobs WHERE id = ?", (job_id,))
+        return rows[0] if rows else None
+
+    def forget(self, job_id: int):
+        self._execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def cancel(self, job_id: int):
+        """Снимает задачу, которую еще не взял ни один воркер"""
+        self._execute("DELETE FROM jobs WHERE id = ? AND status = ?", (job_id, STATUS_QUEUED))
+
+    def alive_workers(self) -> int:
+        cutoff = time.time() - WORKER_STALE_AFTER
+        return self._execute("SELECT COUNT(*) FROM workers WHERE last_seen >= ?", (cutoff,))[0][0]
+
+    async def alive_workers_async(self) -> int:
+        return await self._in_thread(self.alive_workers)
+
+    async def run(self, url, outtmpl, cookiefile, is_premium=False, errors: Optional[List[str]] = None,
+                  timeout: float = DOWNLOAD_JOB_TIMEOUT) -> Optional[Tuple[str, dict]]:
+        """Ставит задачу и ждет ее результат; возвращает (filename, info) или None"""
+        job_id = await self._in_thread(self.submit, url, outtmpl, cookiefile, is_premium)
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(DOWNLOAD_POLL_INTERVAL)
+                row = await self._in_thread(self.result, job_id)
+                if row is None:
+                    return None
+                status, filename, info, job_errors = row
+                if status == STATUS_DONE:
+                    return filename, json.loads(info or "{}")
+                if status == STATUS_FAILED:
+                    if errors is not None:
+                        errors.extend(json.loads(job_errors or "[]"))
+                    return None
+            logging.warning(f"⏰ Задача загрузки {job_id} не выполнена за {timeout:.0f} сек: {url}")
+            if errors is not None:
+                errors.append("download job timed out")
+            return None
+        finally:
+            await self._in_thread(self._finish, job_id)
+
+    def _finish(self, job_id: int):
+        """Снимает невзятую задачу и удаляет завершенную"""
+        self.cancel(job_id)
+        row = self.result(job_id)
+        if row and row[0] in (STATUS_DONE, STATUS_FAILED):
+            self.forget(job_id)
+
+    def stats(self) -> dict:
+        counts = dict(self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+        return {
+            "queued": counts.get(STATUS_QUEUED, 0),
+            "running": counts.get(STATUS_RUNNING, 0),
+            "workers": self.alive_workers(),
+        }
+
+    async def stats_async(self) -> dict:
+        return await self._in_thread(self.stats)
+
+    # --- Сторона воркера ---
+
+    def claim(self, worker: str) -> Optional[tuple]:
+        """Забирает самую старую задачу из очереди"""
+        with self._lock:
+            conn = self._connection()
+            # BEGIN IMMEDIATE сразу берет блокировку записи: два воркера не возьмут одну задачу
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, url, outtmpl, cookiefile, is_premium FROM jobs "
+                    "WHERE status = ? ORDER BY id LIMIT 1", (STATUS_QUEUED,)
+                ).fetchone()
+                if row:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, started = ? WHERE id = ?",
+                        (STATUS_RUNNING, worker, time.time(), row[0]),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def complete(self, job_id: int, worker: str, filename: str, info: dict):
+        self._execute(
+            "UPDATE jobs SET status = ?, filename = ?, info = ?, finished = ? WHERE id = ?",
+            (STATUS_DONE, filename, json.dumps(info, ensure_ascii=False), time.time(), job_id),
+        )
+        self._execute("UPDATE workers SET processed = processed + 1 WHERE name = ?", (worker,))
+
+    def fail(self, job_id: int, worker: str, errors: List[str]):
+        self._execute(
+            "UPDATE jobs SET status = ?, errors = ?, finished = ? WHERE id = ?",
+            (STATUS_FAILED, json.dumps(errors[-5:], ensure_ascii=False), time.time(), job_id),
+        )
+        self._execute("UPDATE workers SET failed = failed + 1 WHERE name = ?", (worker,))
+
+    def heartbeat(self, worker: str):
+        self._execute(
+            "INSERT INTO workers (name, pid, host, started, last_seen) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET last_seen = excluded.last_seen, pid = excluded.pid",
+            (worker, os.getpid(), socket.gethostname(), time.time(), time.time()),
+        )
+
+    def requeue_orphaned(self) -> int:
+        """Возвращает в очередь задачи воркеров, переставших отмечаться"""
+        cutoff = time.time() - WORKER_STALE_AFTER
+        with self._lock:
+            cursor = self._connection().execute(
+                "UPDATE jobs SET status = ?, worker = NULL, started = NULL WHERE status = ? AND worker IN "
+                "(SELECT name FROM workers WHERE last_seen < ?)",
+                (STATUS_QUEUED, STATUS_RUNNING, cutoff),
+            )
+            return cursor.rowcount
+
+    def purge_finished(self, max_age: float = FINISHED_JOB_TTL) -> int:
+        with self._lock:
+            cursor = self._connection().execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                (STATUS_DONE, STATUS_FAILED, time.time() - max_age),
+            )
+            return cursor.rowcount
+
+    def unregister(self, worker: str):
+        self._execute("DELETE FROM workers WHERE name = ?", (worker,))
+
+
+def _short_info(info: dict) -> dict:
+    return {field: info.get(field) for field in INFO_FIELDS if info.get(field) is not None}
+
+
+def run_worker(worker: str, path: str = DOWNLOAD_JOBS_DB):
+    """Цикл одного процесса-загрузчика"""
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [{worker}] %(levelname)s %(message)s")
+    queue = DownloadJobQueue(path)
+    queue.heartbeat(worker)
+    logging.info(f"🛠️ Воркер загрузок {worker} запущен (pid {os.getpid()})")
+    last_heartbeat = time.monotonic()
+    try:
+        while True:
+            if time.monotonic() - last_heartbeat >= WORKER_HEARTBEAT_INTERVAL:
+                queue.heartbeat(worker)
+                requeued = queue.requeue_orphaned()
+                if requeued:
+                    logging.warning(f"♻️ Возвращено в очередь {requeued} задач упавших воркеров")
+                queue.purge_finished()
+                last_heartbeat = time.monotonic()
+
+            job = queue.claim(worker)
+            if job is None:
+                time.sleep(DOWNLOAD_POLL_INTERVAL)
+                continue
+
+            job_id, url, outtmpl, cookiefile, is_premium = job
+            # Во время долгой загрузки отмечаемся из отдельного потока, чтобы задачу не сочли брошенной
+            stop = threading.Event()
+            beat = threading.Thread(target=_heartbeat_loop, args=(path, worker, stop), daemon=True)
+            beat.start()
+            errors = []
+            try:
+                fn_info = ydl_download_blocking(url, outtmpl, cookiefile, bool(is_premium), errors)
+            except Exception as e:
+                fn_info = None
+                errors.append(str(e))
+            finally:
+                stop.set()
+            if fn_info:
+                queue.complete(job_id, worker, fn_info[0], _short_info(fn_info[1]))
+            else:
+                queue.fail(job_id, worker, errors or ["download failed"])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.unregister(worker)
+        logging.info(f"🛑 Воркер загрузок {worker} остановлен")
+
+
+def _heartbeat_loop(path: str, worker: str, stop: threading.Event):
+    queue = DownloadJobQueue(path)
+    while not stop.wait(WORKER_HEARTBEAT_INTERVAL):
+        try:
+            queue.heartbeat(worker)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось отметить воркер {worker}: {e}")
+
+
+download_jobs = DownloadJobQueue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Процессы-загрузчики треков")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("DOWNLOAD_WORKERS", 0)) or default_worker_count(),
+                        help="количество процессов (по умолчанию - число ядер минус одно)")
+    parser.add_argument("--db", default=DOWNLOAD_JOBS_DB, help="файл очереди задач")
+    args = parser.parse_args()
+
+    host = socket.gethostname()
+    processes = []
+    for index in range(args.workers):
+        name = f"{host}-{os.getpid()}-{index}"
+        process = multiprocessing.Process(target=run_worker, args=(name, args.db), name=name)
+        process.start()
+        processes.append(process)
+    print(f"🛠️ Запущено воркеров загрузок: {args.workers}")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
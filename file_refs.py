@@ -0,0 +1,335 @@
+"""
+Подсчёт ссылок на файлы cache и отложенное удаление.
+
+Файл держат:
+    store             - запись в хранилище загрузок (download_store);
+    collection:<id>   - коллекция пользователя <id>;
+    send              - отправка файла в Telegram прямо сейчас.
+
+Когда последняя ссылка отпускается, файл попадает в список отложенного
+удаления (путь -> время удаления) в общем хранилище состояния и удаляется
+через grace секунд, если за это время его никто снова не взял. Список
+переживает перезапуск (в хранилище в памяти - через save(), который
+записывает его в JSON): просроченные записи удаляются при старте.
+
+Ссылки живут в памяти процесса. После перезапуска их восстанавливает
+reconcile() по коллекциям и хранилищу загрузок; он же раз в несколько
+часов исправляет расхождения (файлы, удалённые или созданные мимо учёта).
+
+С общим хранилищем (несколько процессов) хранилище загрузок и отправки у
+каждого процесса свои, поэтому процесс публикует в holders, какие файлы он
+держит (путь -> процесс -> время), и раз в минуту отмечается в processes.
+Файл, который держит другой живой процесс, не удаляется и не считается
+сиротой при сверке, даже если локальных ссылок на него нет.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, MutableMapping, Optional
+
+HOLDER_STORE = "store"
+HOLDER_SEND = "send"
+COLLECTION_PREFIX = "collection:"
+TRANSIENT_HOLDERS = (HOLDER_SEND,)  # Не восстанавливаются reconcile() - их держат только текущие операции
+FILE_REFS_MAX_SLEEP = 60  # Не спим дольше: записи могут добавить другие процессы
+FILE_REFS_PROCESS_TTL = 3 * FILE_REFS_MAX_SLEEP  # Процесс без отметки дольше этого считается упавшим
+
+
+def collection_holder(user_id) -> str:
+    return f"{COLLECTION_PREFIX}{user_id}"
+
+
+class FileRefs:
+    """Счетчики ссылок на файлы и список отложенного удаления"""
+
+    def __init__(self, directory: str, pending: MutableMapping, grace: float = 1.0,
+                 on_delete: Optional[Callable[[str], None]] = None, save: Optional[Callable[[], None]] = None,
+                 holders: Optional[MutableMapping] = None, processes: Optional[MutableMapping] = None,
+                 process: str = ""):
+        self.directory = directory
+        self.pending = pending  # путь -> время удаления (time.time()), хранится в state_backend
+        self.grace = grace
+        self.on_delete = on_delete
+        self.save = save  # Сохраняет pending, если хранилище не переживает перезапуск
+        self.refs: Dict[str, Dict[str, int]] = {}  # путь -> держатель -> число ссылок
+        # Только для общего хранилища: путь -> процесс -> время публикации и процесс -> последняя отметка
+        self.holders = holders
+        self.processes = processes
+        self.process = process
+        self.deleted_files = 0
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path)
+
+    def _unpend(self, key: str) -> bool:
+        try:
+            del self.pending[key]
+        except KeyError:
+            return False
+        return True
+
+    def _saved(self):
+        if self.save is not None:
+            try:
+                self.save()
+            except Exception as e:
+                logging.error(f"❌ Не удалось сохранить очередь удаления файлов: {e}")
+
+    # --- Ссылки других процессов ---
+
+    @property
+    def shared(self) -> bool:
+        return self.holders is not None and self.processes is not None
+
+    def heartbeat(self):
+        """Отметка, что процесс жив: его опубликованные ссылки учитываются другими процессами"""
+        if self.shared:
+            try:
+                self.processes[self.process] = time.time()
+            except Exception as e:
+                logging.error(f"❌ Не удалось отметить процесс в учете ссылок: {e}")
+
+    def _publish(self, key: str, held: bool):
+        """Публикует, держит ли этот процесс файл"""
+        def change(current):
+            current = dict(current or {})
+            if held:
+                current[self.process] = time.time()
+            else:
+                current.pop(self.process, None)
+            return current
+        try:
+            self.holders.mutate(key, change, wait=False)
+        except Exception as e:
+            logging.error(f"❌ Не удалось опубликовать ссылку на {key}: {e}")
+
+    def _live_processes(self) -> set:
+        now = time.time()
+        return {process for process, seen in self.processes.items()
+                if process != self.process and now - seen < FILE_REFS_PROCESS_TTL}
+
+    def held_elsewhere(self, key: str, live: Optional[set] = None) -> bool:
+        """Файл держит другой живой процесс"""
+        if not self.shared:
+            return False
+        try:
+            published = self.holders.get(key) or {}
+            if not any(process != self.process for process in published):
+                return False
+            live = self._live_processes() if live is None else live
+            return any(process in live for process in published)
+        except Exception as e:
+            # Не знаем, держит ли файл кто-то еще - не удаляем
+            logging.error(f"❌ Не удалось проверить ссылки других процессов на {key}: {e}")
+            return True
+
+    def count(self, path: str) -> int:
+        return sum(self.refs.get(self._key(path), {}).values())
+
+    def holds(self, path: str, holder: str) -> bool:
+        return self.refs.get(self._key(path), {}).get(holder, 0) > 0
+
+    def acquire(self, path: str, holder: str):
+        """holder берет ссылку на файл; отложенное удаление отменяется"""
+        key = self._key(path)
+        holders = self.refs.setdefault(key, {})
+        if not holders and self.shared:
+            self._publish(key, True)
+        holders[holder] = holders.get(holder, 0) + 1
+        if key in self.pending and self._unpend(key):
+            self._saved()
+
+    def release(self, path: str, holder: Optional[str] = None, grace: Optional[float] = None) -> bool:
+        """
+        holder отпускает ссылку (holder=None - ссылок не было, файл просто больше
+        не нужен вызывающему). Если ссылок не осталось, файл удаляется через
+        grace секунд (0 - сразу). True - удаление запланировано или выполнено.
+        """
+        key = self._key(path)
+        holders = self.refs.get(key)
+        if holders and holder is not None and holder in holders:
+            holders[holder] -= 1
+            if holders[holder] <= 0:
+                del holders[holder]
+        if holders:
+            return False
+        if self.refs.pop(key, None) is not None and self.shared:
+            self._publish(key, False)
+        self._schedule(key, self.grace if grace is None else grace)
+        return True
+
+    @contextmanager
+    def held(self, path: str, holder: str = HOLDER_SEND, grace: Optional[float] = None):
+        """Ссылка на время операции (отправки), после нее - release()"""
+        self.acquire(path, holder)
+        try:
+            yield
+        finally:
+            self.release(path, holder, grace)
+
+    # --- Отложенное удаление ---
+
+    def _schedule(self, key: str, grace: float):
+        if grace <= 0:
+            self._delete(key)
+            return
+        self.pending[key] = time.time() + grace
+        self._saved()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _delete(self, key: str, save: bool = True) -> bool:
+        if key in self.pending and self._unpend(key) and save:
+            self._saved()
+        if self.refs.get(key) or self.held_elsewhere(key):
+            # Ссылку держит этот или другой процесс - он и запланирует удаление, когда отпустит
+            return False
+        try:
+            size = os.path.getsize(key)
+            os.remove(key)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logging.error(f"❌ Не удалось удалить файл {key}: {e}")
+            return False
+        self.deleted_files += 1
+        if self.on_delete is not None:
+            self.on_delete(key)
+        logging.info(f"🧹 Файл удален (ссылок не осталось): {key} ({size / 1024 / 1024:.2f} MB)")
+        return True
+
+    def drain(self, now: Optional[float] = None) -> Optional[float]:
+        """Удаляет файлы, срок которых подошел; возвращает время ближайшего следующего удаления"""
+        now = time.time() if now is None else now
+        nearest = None
+        changed = False
+        for key, due in list(self.pending.items()):
+            if self.refs.get(key):
+                # Ссылку взяли в другом месте, минуя acquire() этого процесса
+                changed = self._unpend(key) or changed
+            elif due <= now:
+                self._delete(key, save=False)
+                changed = True
+            elif nearest is None or due < nearest:
+                nearest = due
+        if changed:
+            self._saved()
+        return nearest
+
+    async def run(self):
+        """Фоновая задача: удаляет файлы из списка по мере наступления срока"""
+        self._wakeup = asyncio.Event()
+        while True:
+            self.heartbeat()
+            try:
+                nearest = self.drain()
+            except Exception as e:
+                logging.error(f"❌ Ошибка отложенного удаления файлов: {e}")
+                nearest = None
+            timeout = FILE_REFS_MAX_SLEEP if nearest is None else min(max(nearest - time.time(), 0), FILE_REFS_MAX_SLEEP)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    # --- Сверка ---
+
+    def reconcile(self, holders: Dict[str, Iterable[str]], schedule_orphans: bool = True) -> dict:
+        """
+        Восстанавливает постоянные ссылки по holders (путь -> держатели) и
+        сверяет учет с папкой: ссылки на несуществующие файлы снимаются,
+        файлы без ссылок попадают в список отложенного удаления.
+        """
+        refs: Dict[str, Dict[str, int]] = {}
+        for path, path_holders in holders.items():
+            key = self._key(path)
+            counts = refs.setdefault(key, {})
+            for holder in path_holders:
+                counts[holder] = counts.get(holder, 0) + 1
+        # Текущие отправки сверка не трогает
+        for key, counts in self.refs.items():
+            for holder in TRANSIENT_HOLDERS:
+                if counts.get(holder):
+                    refs.setdefault(key, {})[holder] = counts[holder]
+
+        on_disk = set()
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".mp3") and entry.is_file(follow_symlinks=False):
+                        on_disk.add(self._key(entry.path))
+        except OSError as e:
+            logging.error(f"❌ Не удалось просканировать {self.directory}: {e}")
+            return {}
+
+        missing = [key for key in refs if key not in on_disk]
+        for key in missing:
+            del refs[key]
+        self.refs = refs
+        live = set()
+        if self.shared:
+            self.heartbeat()
+            self._republish(on_disk)
+            live = self._live_processes()
+
+        dropped = 0
+        for key in list(self.pending):
+            if key not in on_disk or key in refs:
+                dropped += 1
+                self._unpend(key)
+        orphans = 0
+        if schedule_orphans:
+            due = time.time() + self.grace
+            for key in on_disk:
+                # Хранилище загрузок и отправки других процессов этой сверке не видны - их файлы не сироты
+                if key not in refs and key not in self.pending and not self.held_elsewhere(key, live):
+                    orphans += 1
+                    self.pending[key] = due
+        if dropped or orphans:
+            self._saved()
+            if orphans and self._wakeup is not None:
+                self._wakeup.set()
+        result = {"referenced": len(refs), "missing": len(missing), "dropped_pending": dropped, "orphans": orphans}
+        if missing or dropped or orphans:
+            logging.info(f"🧹 Сверка ссылок на файлы: {result}")
+        return result
+
+    def _republish(self, on_disk: set):
+        """Приводит опубликованные ссылки процесса к восстановленным; чистит записи упавших процессов"""
+        live = self._live_processes() | {self.process}
+        for key, published in list(self.holders.items()):
+            stale = [process for process in published or {} if process not in live]
+            mine = self.process in (published or {})
+            if key not in on_disk or stale or (mine and key not in self.refs):
+                def clean(current, key=key):
+                    current = {process: seen for process, seen in (current or {}).items() if process in live}
+                    if key not in self.refs:
+                        current.pop(self.process, None)
+                    return current
+                try:
+                    if key in on_disk:
+                        self.holders.mutate(key, clean)
+                    else:
+                        del self.holders[key]
+                except KeyError:
+                    pass
+                except Exception as e:
+                    logging.error(f"❌ Не удалось обновить ссылки на {key}: {e}")
+        for key in self.refs:
+            published = self.holders.get(key) or {}
+            if self.process not in published:
+                self._publish(key, True)
+
+    def stats(self) -> dict:
+        return {
+            "referenced_files": len(self.refs),
+            "sending": sum(1 for counts in self.refs.values() if counts.get(HOLDER_SEND)),
+            "pending_deletes": len(self.pending),
+            "deleted_files": self.deleted_files,
+        }
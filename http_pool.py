@@ -0,0 +1,69 @@
+"""
+Общий пул HTTP-соединений для обращений к внешним сервисам (SoundCloud, YouTube).
+
+Вместо того чтобы открывать новую aiohttp.ClientSession на каждый запрос,
+сервисы получают именованную сессию с keep-alive соединениями и кэшем DNS.
+Сессия привязана к event loop, в котором была создана: если код запущен
+в другом loop (например, из отдельного потока), создаётся новая сессия.
+"""
+
+import asyncio
+import logging
+
+import aiohttp
+
+HTTP_POOL_LIMIT = 100  # Всего соединений на сессию
+HTTP_POOL_LIMIT_PER_HOST = 20  # Соединений на один хост
+HTTP_KEEPALIVE_TIMEOUT = 60  # Сколько держать простаивающее соединение (сек)
+HTTP_DNS_CACHE_TTL = 300  # Кэш DNS (сек)
+HTTP_DEFAULT_TIMEOUT = 15  # Общий таймаут запроса (сек)
+HTTP_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
+# name -> (session, loop)
+_sessions = {}
+
+
+def get_session(name="default", timeout=HTTP_DEFAULT_TIMEOUT, headers=None):
+    """Возвращает общую сессию aiohttp для текущего event loop (создаёт при необходимости)"""
+    loop = asyncio.get_running_loop()
+    entry = _sessions.get(name)
+    if entry:
+        session, session_loop = entry
+        if not session.closed and session_loop is loop:
+            return session
+
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+    )
+    session_headers = {"User-Agent": HTTP_USER_AGENT}
+    if headers:
+        session_headers.update(headers)
+
+    session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        headers=session_headers,
+    )
+    _sessions[name] = (session, loop)
+    logging.info(f"🌐 Создан пул HTTP-соединений: {name}")
+    return session
+
+
+async def close_sessions():
+    """Закрывает все сессии, созданные в текущем event loop"""
+    loop = asyncio.get_running_loop()
+    for name, (session, session_loop) in list(_sessions.items()):
+        if session_loop is not loop:
+            continue
+        try:
+            if not session.closed:
+                await session.close()
+        except Exception as e:
+            logging.error(f"❌ Ошибка закрытия пула HTTP-соединений {name}: {e}")
+        _sessions.pop(name, None)
@@ -0,0 +1,416 @@
+"""
+Инкрементальная проверка целостности аудиофайлов коллекций.
+
+Для каждого файла хранится запись (размер, mtime, контрольная сумма, время
+последней проверки, статус). За проход файл читается целиком, только если он
+новый, изменился (размер или mtime), был помечен подозрительным или давно не
+перепроверялся. Проход продолжает с места, где остановился предыдущий
+(курсор по пути в хранилище), и ограничен бюджетом чтения
+INTEGRITY_IO_BUDGET_MB со скоростью не выше INTEGRITY_READ_MBPS, поэтому за
+несколько проходов проверяются все файлы, а не одни и те же первые.
+
+Проверяется структура, а не только заголовок:
+    MP3 - ID3v2/ID3v1/APE-теги пропускаются, все MPEG-кадры проходятся по
+          длинам из заголовков; обрезанный последний кадр, потеря
+          синхронизации и расхождение с числом кадров в заголовке Xing/Info -
+          повреждение;
+    M4A - атомы верхнего уровня должны точно покрывать файл, нужны ftyp,
+          moov (с mvhd) и mdat.
+
+Повреждение считается подтверждённым, если файл не прошёл проверку два
+прохода подряд и за это время не менялся: файл, который ещё дописывается,
+в ремонт не попадает.
+
+Чтение и разбор выполняются в пуле потоков; записи меняются только в event loop.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import struct
+import time
+from typing import Dict, List, MutableMapping, Optional, Tuple
+
+INTEGRITY_IO_BUDGET_MB = int(os.getenv("INTEGRITY_IO_BUDGET_MB", 200))  # Сколько МБ читать за один проход
+INTEGRITY_READ_MBPS = float(os.getenv("INTEGRITY_READ_MBPS", 20))  # Ограничение скорости чтения, МБ/с
+INTEGRITY_REVERIFY_DAYS = 30  # Неизменившиеся файлы перечитываются не чаще (ловит порчу на диске)
+INTEGRITY_MAX_STATS = 5000  # Сколько файлов за проход сверить по stat
+INTEGRITY_SETTLE_SECONDS = 120  # Файлы, измененные недавно, еще могут дописываться - пропускаем
+INTEGRITY_CHUNK = 1024 * 1024
+
+MP3_MAX_RESYNCS = 3  # Сколько раз можно потерять и найти синхронизацию
+MP3_RESYNC_WINDOW = 4096  # В каком окне искать следующий кадр
+MP3_MIN_FRAMES = 10
+XING_TOLERANCE = 2  # Допустимое расхождение с числом кадров в заголовке Xing/Info
+
+STATUS_OK = "ok"
+STATUS_SUSPECT = "suspect"
+STATUS_DAMAGED = "damaged"
+
+# Битрейты (кбит/с) по (версия MPEG 1 или 2, слой); MPEG 2.5 использует таблицы MPEG 2
+_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {0b11: (44100, 48000, 32000), 0b10: (22050, 24000, 16000), 0b00: (11025, 12000, 8000)}
+_LAYERS = {0b11: 1, 0b10: 2, 0b01: 3}
+
+
+# --- MP3 ---
+
+def mp3_frame(data, pos: int) -> Optional[Tuple[int, int, int, int]]:
+    """Заголовок MPEG-кадра в pos: (длина кадра, версия, слой, режим каналов) или None"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (data[pos + 1] >> 3) & 0b11
+    layer = _LAYERS.get((data[pos + 1] >> 1) & 0b11)
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 0b11
+    if version_bits == 0b01 or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    version = 1 if version_bits == 0b11 else 2
+    bitrate = _BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][rate_index]
+    padding = (data[pos + 2] >> 1) & 1
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version == 2:
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        length = 144 * bitrate // sample_rate + padding
+    return length, version, layer, data[pos + 3] >> 6
+
+
+def _id3v2_end(data) -> int:
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _audio_end(data) -> int:
+    """Конец аудиоданных без ID3v1 и APEv2 в хвосте"""
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    if end >= 32 and data[end - 32:end - 24] == b"APETAGEX":
+        size, flags = struct.unpack_from("<II", data, end - 32 + 12)
+        end -= size + (32 if flags & 0x80000000 else 0)
+    return max(end, 0)
+
+
+def _xing_frames(data, pos: int, version: int, channel_mode: int) -> Optional[int]:
+    """Число кадров из заголовка Xing/Info первого кадра, если оно там записано"""
+    mono = channel_mode == 0b11
+    offset = pos + 4 + ((17 if mono else 32) if version == 1 else (9 if mono else 17))
+    if data[offset:offset + 4] not in (b"Xing", b"Info") or offset + 12 > len(data):
+        return None
+    flags = struct.unpack_from(">I", data, offset + 4)[0]
+    if not flags & 0x1:
+        return None
+    return struct.unpack_from(">I", data, offset + 8)[0]
+
+
+def _resync(data, pos: int, end: int) -> Optional[int]:
+    """Следующая позиция, где подряд идут два корректных кадра"""
+    limit = min(pos + MP3_RESYNC_WINDOW, end)
+    pos = data.find(b"\xff", pos + 1, limit)
+    while pos != -1:
+        frame = mp3_frame(data, pos)
+        if frame and pos + frame[0] <= end and (pos + frame[0] == end or mp3_frame(data, pos + frame[0])):
+            return pos
+        pos = data.find(b"\xff", pos + 1, limit)
+    return None
+
+
+def validate_mp3(data) -> Tuple[bool, str]:
+    end = _audio_end(data)
+    pos = _id3v2_end(data)
+    if pos >= end:
+        return False, "нет аудиоданных после тегов"
+    if not mp3_frame(data, pos):
+        pos = _resync(data, pos, end)
+        if pos is None:
+            return False, "не найден первый MPEG-кадр"
+
+    first = mp3_frame(data, pos)
+    expected = _xing_frames(data, pos, first[1], first[3])
+    frames = 0
+    resyncs = 0
+    while pos < end:
+        frame = mp3_frame(data, pos)
+        if frame is None:
+            found = _resync(data, pos, end)
+            if found is None:
+                # Хвост без кадров (нули, мусор кодировщика) допустим только совсем короткий
+                if end - pos <= MP3_RESYNC_WINDOW and frames >= MP3_MIN_FRAMES and not any(data[pos:end]):
+                    break
+                return False, f"потеряна синхронизация на байте {pos}"
+            resyncs += 1
+            if resyncs > MP3_MAX_RESYNCS:
+                return False, f"синхронизация терялась больше {MP3_MAX_RESYNCS} раз"
+            pos = found
+            continue
+        if frame[0] <= 4:
+            return False, f"некорректная длина кадра на байте {pos}"
+        if pos + frame[0] > end:
+            return False, f"последний кадр обрезан ({end - pos} из {frame[0]} байт)"
+        pos += frame[0]
+        frames += 1
+
+    if frames < MP3_MIN_FRAMES:
+        return False, f"слишком мало кадров ({frames})"
+    # Xing/Info считает кадры с самим информационным кадром или без него - в зависимости от кодировщика
+    if expected and abs(frames - expected) > XING_TOLERANCE and abs(frames - 1 - expected) > XING_TOLERANCE:
+        return False, f"кадров {frames}, в заголовке Xing/Info - {expected}"
+    return True, ""
+
+
+# --- M4A ---
+
+def _atoms(data, start: int, end: int):
+    pos = start
+    while pos < end:
+        if pos + 8 > end:
+            yield None, pos, end
+            return
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                yield None, pos, end
+                return
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            yield None, pos, end
+            return
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def validate_m4a(data) -> Tuple[bool, str]:
+    kinds = []
+    moov = None
+    for kind, body, atom_end in _atoms(data, 0, len(data)):
+        if kind is None:
+            return False, f"атом на байте {body} обрезан"
+        kinds.append(kind)
+        if kind == b"moov":
+            moov = (body, atom_end)
+    if not kinds or kinds[0] != b"ftyp":
+        return False, "первый атом не ftyp"
+    if moov is None:
+        return False, "нет атома moov"
+    if b"mdat" not in kinds:
+        return False, "нет атома mdat"
+    moov_kinds = []
+    for kind, body, _ in _atoms(data, moov[0], moov[1]):
+        if kind is None:
+            return False, f"атом внутри moov на байте {body} обрезан"
+        moov_kinds.append(kind)
+    if b"mvhd" not in moov_kinds:
+        return False, "в moov нет mvhd"
+    return True, ""
+
+
+def validate_audio(data, path: str = "") -> Tuple[bool, str]:
+    """Проверка структуры файла; формат по содержимому, а если не распознан - по расширению"""
+    if len(data) == 0:
+        return False, "пустой файл"
+    if data[4:8] == b"ftyp":
+        return validate_m4a(data)
+    if data[:3] == b"ID3" or mp3_frame(data, 0):
+        return validate_mp3(data)
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".m4a", ".mp4", ".aac"):
+        return validate_m4a(data)
+    if ext == ".mp3":
+        return validate_mp3(data)
+    return False, "неизвестный формат"
+
+
+# --- Чтение с бюджетом ---
+
+class ReadBudget:
+    """Бюджет чтения на проход: объем и скорость (вызывается из потока пула)"""
+
+    def __init__(self, limit_bytes: int, rate_bytes: float):
+        self.limit_bytes = limit_bytes
+        self.rate_bytes = rate_bytes
+        self.spent = 0
+        self.started = time.monotonic()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent >= self.limit_bytes
+
+    def consume(self, size: int):
+        self.spent += size
+        if self.rate_bytes > 0:
+            ahead = self.spent / self.rate_bytes - (time.monotonic() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+def read_and_validate(path: str, budget: Optional[ReadBudget] = None) -> Tuple[bool, str, str]:
+    """Читает файл (с учетом бюджета), возвращает (цел, причина, контрольная сумма)"""
+    digest = hashlib.blake2b(digest_size=16)
+    data = bytearray()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(INTEGRITY_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            data += chunk
+            if budget is not None:
+                budget.consume(len(chunk))
+    ok, reason = validate_audio(data, path)
+    return ok, reason, digest.hexdigest()
+
+
+def check_audio_file(path: str) -> Tuple[bool, str]:
+    """Разовая проверка файла без бюджета и записей"""
+    try:
+        ok, reason, _ = read_and_validate(path)
+        return ok, reason
+    except OSError as e:
+        return False, str(e)
+
+
+# --- Сканер ---
+
+class IntegrityScanner:
+    """Записи о проверенных файлах, курсор прохода и подтверждение повреждений"""
+
+    def __init__(self, records: MutableMapping, state: MutableMapping, save=None,
+                 io_budget_bytes: int = INTEGRITY_IO_BUDGET_MB * 1024 * 1024,
+                 read_rate_bytes: float = INTEGRITY_READ_MBPS * 1024 * 1024,
+                 reverify_after: float = INTEGRITY_REVERIFY_DAYS * 86400, max_stats: int = INTEGRITY_MAX_STATS):
+        self.records = records  # путь -> {size, mtime, checksum, verified, status, reason}
+        self.state = state  # "cursor" -> последний просмотренный путь
+        self.save = save  # Сохраняет records и state, если хранилище не переживает перезапуск
+        self.io_budget_bytes = io_budget_bytes
+        self.read_rate_bytes = read_rate_bytes
+        self.reverify_after = reverify_after
+        self.max_stats = max_stats
+        self.last_pass: dict = {}
+
+    def _order(self, paths: List[str]) -> Tuple[List[str], Optional[str]]:
+        """Пути после курсора (дойдя до конца, начинаем сначала) и последний путь списка"""
+        paths = sorted(set(paths))
+        if not paths:
+            return [], None
+        start = bisect.bisect_right(paths, self.state.get("cursor") or "")
+        if start >= len(paths):
+            start = 0
+        return paths[start:start + self.max_stats], paths[-1]
+
+    def _scan_blocking(self, batch: List[Tuple[str, Optional[dict]]]) -> Tuple[List[Tuple[str, Optional[dict]]], Optional[str], dict]:
+        """Поток пула: stat, чтение и проверка; возвращает обновления записей и новый курсор"""
+        budget = ReadBudget(self.io_budget_bytes, self.read_rate_bytes)
+        now = time.time()
+        updates = []
+        cursor = None
+        stats = {"examined": 0, "read": 0, "bytes": 0, "failed": 0}
+        for path, record in batch:
+            if budget.exhausted:
+                break
+            cursor = path
+            stats["examined"] += 1
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                if record is not None:
+                    updates.append((path, None))
+                continue
+            except OSError:
+                continue
+            if now - st.st_mtime < INTEGRITY_SETTLE_SECONDS:
+                continue
+            unchanged = record is not None and record.get("size") == st.st_size and record.get("mtime") == st.st_mtime
+            if unchanged:
+                status = record.get("status")
+                if status == STATUS_DAMAGED:
+                    continue
+                if status == STATUS_OK and now - record.get("verified", 0) < self.reverify_after:
+                    continue
+            try:
+                ok, reason, checksum = read_and_validate(path, budget)
+            except OSError as e:
+                ok, reason, checksum = False, str(e), ""
+            stats["read"] += 1
+            stats["bytes"] = budget.spent
+            if ok:
+                status = STATUS_OK
+            else:
+                stats["failed"] += 1
+                # Второй отказ подряд на том же содержимом - повреждение подтверждено
+                confirmed = unchanged and record.get("status") == STATUS_SUSPECT and record.get("checksum") == checksum
+                status = STATUS_DAMAGED if confirmed else STATUS_SUSPECT
+            if unchanged and record.get("status") == STATUS_OK and record.get("checksum") not in (None, checksum):
+                reason = reason or "содержимое изменилось без изменения размера и mtime"
+                logging.warning(f"⚠️ Файл {path} изменился на диске без изменения размера и mtime")
+            updates.append((path, {"size": st.st_size, "mtime": st.st_mtime, "checksum": checksum,
+                                   "verified": now, "status": status, "reason": reason}))
+        stats["bytes"] = budget.spent
+        return updates, cursor, stats
+
+    async def scan(self, paths: List[str], executor=None) -> List[str]:
+        """Один проход по paths с курсора; возвращает пути с подтвержденным повреждением"""
+        batch_paths, last_path = self._order(paths)
+        if not batch_paths:
+            return []
+        batch = [(path, self.records.get(path)) for path in batch_paths]
+        loop = asyncio.get_running_loop()
+        updates, cursor, stats = await loop.run_in_executor(executor, self._scan_blocking, batch)
+
+        damaged = []
+        for path, record in updates:
+            if record is None:
+                self.records.pop(path, None)
+                continue
+            previous = self.records.get(path)
+            self.records[path] = record
+            if record["status"] == STATUS_DAMAGED and (previous or {}).get("status") != STATUS_DAMAGED:
+                damaged.append(path)
+                logging.warning(f"🔧 Подтверждено повреждение файла {path}: {record['reason']}")
+            elif record["status"] == STATUS_SUSPECT:
+                logging.info(f"🔧 Файл {path} не прошел проверку ({record['reason']}), перепроверим в следующем проходе")
+
+        if cursor is not None:
+            self.state["cursor"] = cursor
+        finished = cursor == last_path
+        if finished:
+            # Полный круг: записи о файлах, которых больше нет в коллекциях, не нужны
+            known = set(paths)
+            for path in [path for path in self.records if path not in known]:
+                self.records.pop(path, None)
+        if self.save is not None:
+            self.save()
+
+        stats["damaged"] = len(damaged)
+        stats["finished_round"] = finished
+        self.last_pass = stats
+        return damaged
+
+    def forget(self, path: str):
+        """Файл удален или перезагружен - следующая проверка начнется с нуля"""
+        self.records.pop(path, None)
+
+    def stats(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for record in list(self.records.values()):
+            status = record.get("status", STATUS_OK)
+            statuses[status] = statuses.get(status, 0) + 1
+        return {"files": sum(statuses.values()), "statuses": statuses, "last_pass": dict(self.last_pass)}
@@ -0,0 +1,214 @@
+"""
+Выбор лидера для фоновых задач при запуске нескольких процессов бота.
+
+Лидерство - аренда (lease) в таблице SQLite: процесс-лидер продлевает её
+каждые LEADER_LEASE_TTL / 3 секунд. Если лидер упал или завис, аренда
+истекает и её забирает другой процесс. Общие периодические задачи
+(очистка файлов, мониторинг премиума, проверка целостности) выполняет
+только лидер, а время последнего запуска каждой задачи хранится в той же
+БД, поэтому после смены лидера задача не запускается раньше срока и не
+выполняется дважды.
+
+Файл БД должен быть общим для процессов, т.е. процессы работают на одной
+машине (как и с STATE_BACKEND=sqlite).
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+LEADER_LEASE_DB = os.getenv("LEADER_LEASE_DB", os.path.join(os.path.dirname(__file__), "leader_lease.db"))
+LEADER_LEASE_TTL = int(os.getenv("LEADER_LEASE_TTL", 30))  # Через сколько секунд без продления аренда свободна
+LEADER_LEASE_NAME = "background_tasks"
+
+
+class LeaderLease:
+    """Аренда лидерства и журнал запусков периодических задач"""
+
+    def __init__(self, path: str = LEADER_LEASE_DB, ttl: float = LEADER_LEASE_TTL, name: str = LEADER_LEASE_NAME):
+        self.path = path
+        self.ttl = ttl
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self._lock = threading.Lock()
+        self._conn = None
+        # Транзакции BEGIN IMMEDIATE могут ждать блокировку до busy_timeout - не в event loop
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "name TEXT PRIMARY KEY, holder TEXT NOT NULL, acquired REAL NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_runs ("
+                "name TEXT PRIMARY KEY, last_run REAL NOT NULL, holder TEXT, status TEXT, "
+                "duration REAL, runs INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn = conn
+        return self._conn
+
+    async def _in_thread(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="leader-lease")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _transaction(self, func):
+        """Выполняет func(conn) под блокировкой записи БД"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # --- Аренда ---
+
+    def try_acquire(self) -> bool:
+        """Захватывает или продлевает аренду; возвращает, является ли процесс лидером"""
+        def acquire(conn):
+            now = time.time()
+            row = conn.execute("SELECT holder, expires FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if row and row[0] != self.holder and row[1] > now:
+                return False
+            if row and row[0] == self.holder:
+                conn.execute("UPDATE leases SET expires = ? WHERE name = ?", (now + self.ttl, self.name))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, holder, acquired, expires) VALUES (?, ?, ?, ?)",
+                    (self.name, self.holder, now, now + self.ttl),
+                )
+            return True
+
+        try:
+            leader = self._transaction(acquire)
+        except Exception as e:
+            logging.error(f"❌ Ошибка продления аренды лидера: {e}")
+            leader = False
+
+        if leader and not self.is_leader:
+            logging.info(f"👑 Процесс {self.holder} стал лидером фоновых задач")
+        elif not leader and self.is_leader:
+            logging.warning(f"⚠️ Процесс {self.holder} потерял лидерство")
+        self.is_leader = leader
+        return leader
+
+    def release(self):
+        try:
+            self._transaction(lambda conn: conn.execute(
+                "DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder)
+            ))
+        except Exception as e:
+            logging.error(f"❌ Ошибка освобождения аренды лидера: {e}")
+        self.is_leader = False
+
+    async def maintain(self):
+        """Фоновая задача: держит или ожидает аренду"""
+        try:
+            while True:
+                await self._in_thread(self.try_acquire)
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            if self.is_leader:
+                # При отмене задачи ждать поток нельзя - освобождаем аренду синхронно, один раз
+                self.release()
+
+    # --- Журнал запусков ---
+
+    def should_run(self, task_name: str, interval_sec: float) -> bool:
+        """
+        Лидер отмечает запуск задачи, если с прошлого запуска в кластере прошло
+        interval_sec. При первой встрече задачи отсчет интервала начинается сейчас.
+        """
+        if not self.is_leader:
+            return False
+
+        def claim(conn):
+            now = time.time()
+            # Флаг is_leader мог устареть: аренду проверяем в той же транзакции
+            lease = conn.execute("SELECT holder, expires FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if not lease or lease[0] != self.holder or lease[1] <= now:
+                return False
+            row = conn.execute("SELECT last_run FROM job_runs WHERE name = ?", (task_name,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO job_runs (name, last_run, holder, status) VALUES (?, ?, ?, ?)",
+                    (task_name, now, self.holder, "scheduled"),
+                )
+                return False
+            if now - row[0] < interval_sec:
+                return False
+            # last_run обновляется в момент запуска: новый лидер не повторит задачу, пока она идет
+            conn.execute(
+                "UPDATE job_runs SET last_run = ?, holder = ?, status = ?, runs = runs + 1 WHERE name = ?",
+                (now, self.holder, "running", task_name),
+            )
+            return True
+
+        try:
+            return self._transaction(claim)
+        except Exception as e:
+            logging.error(f"❌ Ошибка проверки расписания задачи {task_name}: {e}")
+            return False
+
+    async def should_run_async(self, task_name: str, interval_sec: float) -> bool:
+        if not self.is_leader:
+            return False
+        return await self._in_thread(self.should_run, task_name, interval_sec)
+
+    def record_run(self, task_name: str, status: str, duration: float):
+        try:
+            self._transaction(lambda conn: conn.execute(
+                "UPDATE job_runs SET status = ?, duration = ? WHERE name = ? AND holder = ?",
+                (status, duration, task_name, self.holder),
+            ))
+        except Exception as e:
+            logging.error(f"❌ Ошибка записи результата задачи {task_name}: {e}")
+
+    async def record_run_async(self, task_name: str, status: str, duration: float):
+        await self._in_thread(self.record_run, task_name, status, duration)
+
+    def status(self) -> dict:
+        """Текущий лидер и последние запуски задач"""
+        try:
+            with self._lock:
+                conn = self._connection()
+                lease = conn.execute(
+                    "SELECT holder, acquired, expires FROM leases WHERE name = ?", (self.name,)
+                ).fetchone()
+                runs = conn.execute(
+                    "SELECT name, last_run, holder, status, duration, runs FROM job_runs ORDER BY name"
+                ).fetchall()
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения состояния лидера: {e}")
+            lease, runs = None, []
+
+        jobs: List[dict] = [
+            {"name": name, "last_run": last_run, "holder": holder, "status": status,
+             "duration": duration, "runs": count}
+            for name, last_run, holder, status, duration, count in runs
+        ]
+        leader: Optional[dict] = None
+        if lease:
+            leader = {"holder": lease[0], "acquired": lease[1], "expires": lease[2],
+                      "expired": lease[2] <= time.time()}
+        return {"self": self.holder, "is_leader": self.is_leader, "leader": leader, "jobs": jobs}
+
+
+leader_lease = LeaderLease()
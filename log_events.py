@@ -0,0 +1,219 @@
+"""
+Структурированное логирование для горячих путей.
+
+События пишутся как "имя ключ=значение ...", причём строка собирается
+только если уровень включён и событие прошло выборку (sample) и
+ограничение частоты (every). Значения усекаются: длинные строки и большие
+списки/словари сводятся к нескольким элементам и счётчику остальных,
+поэтому в лог не попадают целиком user_tracks или списки результатов.
+
+setup_logging() переносит обработчики корневого логгера в фоновый поток
+(QueueHandler + QueueListener): запись в stdout/файл больше не выполняется
+в event loop. Счётчики записей, байт и времени в вызывающем потоке
+доступны через log_stats().
+
+    events = get_event_logger("music_bot")
+    events.debug("search_result", chat_id=chat_id, index=i, title=title)
+    events.info("track_deleted", user_id=user_id, remaining=len(tracks))
+    events.warning("cache_miss_storm", every=60, query=query)
+    events.debug("antispam_check", sample=0.01, user_id=user_id)
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = 10000  # Записей в очереди до фонового потока; при переполнении лишние отбрасываются
+LOG_VALUE_MAX_LEN = 200  # Максимальная длина одного значения в событии
+LOG_MAX_ITEMS = 5  # Сколько элементов списка/словаря показывать
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional["CountingQueueHandler"] = None
+_setup_lock = threading.Lock()
+_event_counters = {"emitted": 0, "sampled_out": 0, "rate_limited": 0}
+
+
+def short(value, max_len: int = LOG_VALUE_MAX_LEN) -> str:
+    """Короткое представление значения для лога"""
+    if isinstance(value, str):
+        text = value
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)[:LOG_MAX_ITEMS] if not isinstance(value, (list, tuple)) else value[:LOG_MAX_ITEMS]
+        text = "[" + ", ".join(short(item, max_len // 2) for item in items)
+        if len(value) > LOG_MAX_ITEMS:
+            text += f", ...+{len(value) - LOG_MAX_ITEMS}"
+        text += "]"
+    elif isinstance(value, dict):
+        parts = []
+        for index, (key, item) in enumerate(value.items()):
+            if index >= LOG_MAX_ITEMS:
+                parts.append(f"...+{len(value) - LOG_MAX_ITEMS}")
+                break
+            parts.append(f"{key}: {short(item, max_len // 2)}")
+        text = "{" + ", ".join(parts) + "}"
+    else:
+        text = str(value)
+    if len(text) > max_len:
+        text = f"{text[:max_len]}…(+{len(text) - max_len})"
+    return text
+
+
+class Event:
+    """Сообщение события; строка собирается при форматировании записи"""
+
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name: str, fields: dict):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self) -> str:
+        if not self.fields:
+            return self.name
+        parts = []
+        for key, value in self.fields.items():
+            text = short(value)
+            if not text or any(char in text for char in " =\"\n"):
+                text = '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+            parts.append(f"{key}={text}")
+        return f"{self.name} " + " ".join(parts)
+
+
+class EventLogger:
+    """Логгер структурированных событий с выборкой и ограничением частоты"""
+
+    def __init__(self, name: str):
+        self.logger = logging.getLogger(name)
+        self._last_emit: Dict[str, float] = {}
+        self._suppressed: Dict[str, int] = {}
+
+    def event(self, level: int, name: str, sample: Optional[float] = None, every: Optional[float] = None,
+              exc_info=None, **fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        if sample is not None and random.random() >= sample:
+            _event_counters["sampled_out"] += 1
+            return
+        if every is not None:
+            now = time.monotonic()
+            if now - self._last_emit.get(name, -every) < every:
+                self._suppressed[name] = self._suppressed.get(name, 0) + 1
+                _event_counters["rate_limited"] += 1
+                return
+            self._last_emit[name] = now
+            suppressed = self._suppressed.pop(name, 0)
+            if suppressed:
+                fields["suppressed"] = suppressed
+        if sample is not None:
+            fields["sample"] = sample
+        _event_counters["emitted"] += 1
+        self.logger.log(level, Event(name, fields), exc_info=exc_info)
+
+    def debug(self, name: str, **fields):
+        self.event(logging.DEBUG, name, **fields)
+
+    def info(self, name: str, **fields):
+        self.event(logging.INFO, name, **fields)
+
+    def warning(self, name: str, **fields):
+        self.event(logging.WARNING, name, **fields)
+
+    def error(self, name: str, **fields):
+        self.event(logging.ERROR, name, **fields)
+
+
+_event_loggers: Dict[str, EventLogger] = {}
+
+
+def get_event_logger(name: str) -> EventLogger:
+    logger = _event_loggers.get(name)
+    if logger is None:
+        logger = _event_loggers[name] = EventLogger(name)
+    return logger
+
+
+class CountingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который считает записи, байты и время в вызывающем потоке"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.records = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.caller_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        started = time.perf_counter()
+        super().emit(record)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.caller_seconds += elapsed
+
+    def prepare(self, record):
+        # Сообщение собирается здесь, в вызывающем потоке: аргументы могут измениться позже
+        record = super().prepare(record)
+        with self._lock:
+            self.records += 1
+            self.bytes += len(record.msg.encode("utf-8", "replace")) if isinstance(record.msg, str) else 0
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Переносит обработчики корневого логгера в фоновый поток (повторный вызов ничего не делает)"""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        root = logging.getLogger()
+        handlers = list(root.handlers)
+        if not handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+            handlers = [handler]
+        for handler in handlers:
+            root.removeHandler(handler)
+
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        _queue_handler = CountingQueueHandler(log_queue)
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает фоновый поток"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def log_stats() -> dict:
+    stats = dict(_event_counters)
+    if _queue_handler is not None:
+        stats.update({
+            "records": _queue_handler.records,
+            "bytes": _queue_handler.bytes,
+            "dropped": _queue_handler.dropped,
+            "caller_seconds": _queue_handler.caller_seconds,
+            "queued": _queue_handler.queue.qsize(),
+        })
+    return stats
@@ -0,0 +1,245 @@
+"""
+Метрики Prometheus для горячих путей бота.
+
+Гистограммы: задержка поиска по провайдерам, время скачивания, конвертации
+(ffmpeg) и выгрузки в Telegram, задержка event loop. Счётчики: попадания и
+промахи кэшей, отклоненные ограничением частоты обновления, ошибки
+Telegram API и retry_after. Значения, которые проще
+прочитать, чем поддерживать (глубина очередей, активные загрузки, размер
+файлового кэша), собираются в момент запроса /metrics через register_gauge().
+
+Эндпоинт /metrics отдаёт webhook_server.py; в режиме polling - отдельный
+HTTP-сервер на METRICS_PORT (start_metrics_server()). Без prometheus_client
+все метрики - заглушки, код бота работает без изменений.
+
+    with metrics.timer(metrics.SEARCH_SECONDS, provider="youtube"):
+        results = await youtube_client.search(query, limit)
+    metrics.cache_hit("search")
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST
+    from prometheus_client import generate_latest, start_http_server
+    from prometheus_client.core import GaugeMetricFamily
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+    logging.warning("🐻‍❄️ prometheus_client не установлен. Метрики /metrics будут недоступны.")
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # Порт /metrics в режиме polling (0 - не запускать)
+LOOP_LAG_INTERVAL = 1.0  # Как часто измеряется задержка event loop
+FILE_CACHE_SCAN_INTERVAL = 60  # Размер папки cache пересчитывается не чаще раза в минуту
+
+# Границы гистограмм: поиск - доли секунды, загрузка и выгрузка - до нескольких минут
+SEARCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+TRANSFER_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+# Методы Bot API, время которых считается временем выгрузки файла
+UPLOAD_METHODS = ("SendAudio", "SendDocument", "SendVoice", "SendVideo", "SendAnimation", "SendPhoto")
+
+
+class _NoopMetric:
+    """Заглушка метрики, когда prometheus_client не установлен"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(kind: str, name: str, documentation: str, labels: Tuple[str, ...] = (), **kwargs):
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    metric_class = {"histogram": Histogram, "counter": Counter, "gauge": Gauge}[kind]
+    return metric_class(name, documentation, labels, **kwargs)
+
+
+SEARCH_SECONDS = _metric("histogram", "musicbot_search_seconds", "Задержка поиска по провайдерам",
+                         ("provider", "result"), buckets=SEARCH_BUCKETS)
+DOWNLOAD_SECONDS = _metric("histogram", "musicbot_download_seconds", "Время скачивания трека без конвертации",
+                           ("mode", "result"), buckets=TRANSFER_BUCKETS)
+TRANSCODE_SECONDS = _metric("histogram", "musicbot_transcode_seconds", "Время конвертации в mp3 (ffmpeg)",
+                            ("quality",), buckets=TRANSFER_BUCKETS)
+UPLOAD_SECONDS = _metric("histogram", "musicbot_upload_seconds", "Время выгрузки файла в Telegram",
+                         ("method", "result"), buckets=TRANSFER_BUCKETS)
+CACHE_REQUESTS = _metric("counter", "musicbot_cache_requests_total", "Обращения к кэшам", ("cache", "result"))
+THROTTLED_UPDATES = _metric("counter", "musicbot_throttled_updates_total",
+                            "Обновления, отклоненные ограничением частоты", ("action",))
+DISK_EVICTIONS = _metric("counter", "musicbot_disk_evictions_total", "Файлы, вытесненные из cache квотой",
+                         ("owner",))
+DISK_EVICTED_BYTES = _metric("counter", "musicbot_disk_evicted_bytes_total", "Байты, освобожденные вытеснением",
+                             ("owner",))
+DISK_REJECTED_DOWNLOADS = _metric("counter", "musicbot_disk_rejected_downloads_total",
+                                  "Загрузки, отклоненные из-за нехватки места")
+STATIC_ASSET_SENDS = _metric("counter", "musicbot_static_asset_sends_total",
+                             "Отправки статичных картинок: по file_id или с выгрузкой файла", ("asset", "mode"))
+TELEGRAM_ERRORS = _metric("counter", "musicbot_telegram_errors_total", "Ошибки Telegram Bot API",
+                          ("method", "error"))
+TELEGRAM_RETRY_AFTER = _metric("counter", "musicbot_telegram_retry_after_total",
+                               "Ответы Telegram с retry_after (флуд-контроль)", ("method",))
+TELEGRAM_RETRY_AFTER_SECONDS = _metric("counter", "musicbot_telegram_retry_after_seconds_total",
+                                       "Суммарное время ожидания, запрошенное retry_after", ("method",))
+LOOP_LAG_SECONDS = _metric("histogram", "musicbot_event_loop_lag_seconds", "Задержка event loop",
+                           buckets=LAG_BUCKETS)
+LOOP_LAG_LAST = _metric("gauge", "musicbot_event_loop_lag_last_seconds",
+                        "Задержка event loop при последнем замере")
+
+_gauges: Dict[str, Tuple[str, Tuple[str, ...], Callable]] = {}
+
+
+def register_gauge(name: str, documentation: str, func: Callable, labels: Tuple[str, ...] = ()):
+    """
+    Регистрирует значение, которое читается при каждом запросе /metrics.
+    func возвращает число (без меток) или словарь {значения меток (tuple): число}.
+    """
+    _gauges[name] = (documentation, labels, func)
+
+
+def _collect_gauges() -> Iterable:
+    for name, (documentation, labels, func) in list(_gauges.items()):
+        try:
+            value = func()
+        except Exception as e:
+            logging.warning(f"⚠️ Метрика {name} не прочитана: {e}")
+            continue
+        family = GaugeMetricFamily(name, documentation, labels=list(labels))
+        if labels:
+            for label_values, item in value.items():
+                family.add_metric(list(label_values), item)
+        else:
+            family.add_metric([], value)
+        yield family
+
+
+class _GaugeCollector:
+    def collect(self):
+        return _collect_gauges()
+
+
+if PROMETHEUS_AVAILABLE:
+    REGISTRY.register(_GaugeCollector())
+
+
+@contextmanager
+def timer(histogram, **labels):
+    """
+    Замеряет время блока с меткой result: ok, error при исключении
+    или значение, записанное в блоке (outcome["result"] = "empty").
+    """
+    started = time.perf_counter()
+    outcome = {"result": "ok"}
+    try:
+        yield outcome
+    except BaseException:
+        outcome["result"] = "error"
+        raise
+    finally:
+        histogram.labels(**labels, result=outcome["result"]).observe(time.perf_counter() - started)
+
+
+def cache_hit(cache: str):
+    CACHE_REQUESTS.labels(cache=cache, result="hit").inc()
+
+
+def cache_miss(cache: str):
+    CACHE_REQUESTS.labels(cache=cache, result="miss").inc()
+
+
+_dir_size_cache: Dict[str, Tuple[float, int]] = {}
+
+
+def directory_bytes(path: str, max_age: float = FILE_CACHE_SCAN_INTERVAL) -> int:
+    """Размер файлов в папке; результат переиспользуется max_age секунд"""
+    cached = _dir_size_cache.get(path)
+    now = time.monotonic()
+    if cached and now - cached[0] < max_age:
+        return cached[1]
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    except OSError:
+        total = 0
+    _dir_size_cache[path] = (now, total)
+    return total
+
+
+async def monitor_event_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """Фоновая задача: насколько позже запланированного просыпается sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG_SECONDS.observe(lag)
+        LOOP_LAG_LAST.set(lag)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: ошибки и retry_after Telegram API, время выгрузки файлов"""
+
+    async def __call__(self, make_request, bot, method):
+        method_name = type(method).__name__
+        started = time.perf_counter()
+        result = "ok"
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            result = "retry_after"
+            TELEGRAM_RETRY_AFTER.labels(method=method_name).inc()
+            TELEGRAM_RETRY_AFTER_SECONDS.labels(method=method_name).inc(e.retry_after)
+            TELEGRAM_ERRORS.labels(method=method_name, error="TelegramRetryAfter").inc()
+            raise
+        except Exception as e:
+            # Ошибки API, а также сетевые ошибки и таймауты сессии
+            result = "error"
+            TELEGRAM_ERRORS.labels(method=method_name, error=type(e).__name__).inc()
+            raise
+        finally:
+            if method_name in UPLOAD_METHODS:
+                UPLOAD_SECONDS.labels(method=method_name, result=result).observe(time.perf_counter() - started)
+
+
+def generate_metrics() -> Tuple[bytes, str]:
+    """Тело и Content-Type ответа /metrics"""
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client is not installed\n", CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: Optional[int] = None) -> bool:
+    """Отдельный HTTP-сервер /metrics (для режима polling, где нет своего веб-сервера)"""
+    port = METRICS_PORT if port is None else port
+    if not PROMETHEUS_AVAILABLE or not port:
+        return False
+    try:
+        start_http_server(port)
+        logging.info(f"📈 Метрики Prometheus доступны на порту {port}")
+        return True
+    except Exception as e:
+        logging.error(f"❌ Не удалось запустить сервер метрик на порту {port}: {e}")
+        return False
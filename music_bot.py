@@ -33,6 +33,7 @@ from datetime import datetime, timedelta
 from collections import deque
 from asyncio import PriorityQueue
 from concurrent.futures import ThreadPoolExecutor
+from update_executor import update_executor, UpdateExecutorMiddleware
 
 # Загрузка переменных окружения
 try:
@@ -129,6 +130,8 @@ logging.basicConfig(
 )
 bot = Bot(token=API_TOKEN)
 dp = Dispatcher()
+# Обновления одного чата - по порядку, разных чатов - параллельно с общим лимитом
+dp.update.outer_middleware(UpdateExecutorMiddleware(update_executor))
 os.makedirs(CACHE_DIR, exist_ok=True)
 
 # === ФУНКЦИИ ДЛЯ ОПТИМИЗАЦИИ ЗАГРУЗОК ===
@@ -4247,7 +4250,7 @@ async def main():
         await bot.delete_webhook(drop_pending_updates=True)
         logging.info("✅ Webhook удален")
         
-        await dp.start_polling(bot, skip_updates=True)
+        await dp.start_polling(bot, skip_updates=True, handle_as_tasks=False)
         logging.info("✅ Polling запущен")
         
     except Exception as e:
@@ -4314,7 +4317,7 @@ async def main_worker():
         else:
             # Локальный запуск - используем polling
             logging.info("💻 Локальный запуск - используем polling")
-            await dp.start_polling(bot, skip_updates=True)
+            await dp.start_polling(bot, skip_updates=True, handle_as_tasks=False)
         
         logging.info("✅ Бот готов к работе в дочернем потоке")
         
@@ -31,14 +31,36 @@ except ImportError:
     YOOMONEY_AVAILABLE = False
     logging.warning("🐻‍❄️ Модуль YooMoney не найден. Платежи через YooMoney будут недоступны.")
 
-import re
 import urllib.parse
 from functools import partial
+from contextlib import contextmanager
 import aiohttp
 from datetime import datetime, timedelta
-from collections import deque
-from asyncio import PriorityQueue
 from concurrent.futures import ThreadPoolExecutor
+from http_pool import close_sessions
+from soundcloud_search import soundcloud_client
+from youtube_search import youtube_client
+from canonical import normalize_query, canonical_url, media_key
+from track_index import track_index
+from update_executor import update_executor, UpdateExecutorMiddleware
+from source_health import (
+    negative_cache, source_breakers, classify_error, YdlErrorCollector, ERROR_TRANSIENT,
+)
+from state_backend import state_backend, BackendDict, BackendFSMStorage, flush_mappings, close_state
+from download_worker import ydl_download_blocking, download_jobs, DOWNLOAD_WORKERS_ENABLED
+from leader_lease import leader_lease
+from log_events import setup_logging, get_event_logger, log_stats
+import metrics
+from metrics import TelegramMetricsMiddleware, register_gauge
+from tracing import tracer, TracingMiddleware, TracingRequestMiddleware
+from rate_limiter import rate_limiter, RateLimitMiddleware
+from user_context import UserContext, UserContextMiddleware, context_for, invalidate as invalidate_user_context
+from disk_quota import DiskQuota, OWNER_PREMIUM, OWNER_COLLECTION, OWNER_TEMP
+from file_refs import FileRefs, HOLDER_STORE, collection_holder
+from integrity_scanner import IntegrityScanner, check_audio_file
+from track_metadata import track_metadata, audio_kwargs, track_fields
+from static_assets import StaticAssets, StaticAssetsMiddleware
+from collection_keyboards import CollectionKeyboards
 
 # Загрузка переменных окружения
 try:
@@ -60,6 +82,9 @@ CACHE_DIR = "cache"
 COOKIES_FILE = os.path.join(os.path.dirname(__file__), "cookies.txt")
 TRACKS_FILE = os.path.join(os.path.dirname(__file__), "tracks.json")
 SEARCH_CACHE_FILE = os.path.join(os.path.dirname(__file__), "search_cache.json")
+DEFERRED_DELETES_FILE = os.path.join(os.path.dirname(__file__), "deferred_deletes.json")
+INTEGRITY_FILE = os.path.join(os.path.dirname(__file__), "integrity.json")
+STATIC_ASSETS_FILE = os.path.join(os.path.dirname(__file__), "static_assets.json")
 
 # === НАСТРОЙКИ SOUNDCLOUD ===
 SOUNDCLOUD_SEARCH_LIMIT = 10  # Количество результатов поиска на SoundCloud
@@ -129,11 +154,13 @@ PREMIUM_EXPIRY_WARNING = 86400  # 1 день в секундах (предупр
 ARTIST_FACTS_FILE = os.path.join(os.path.dirname(__file__), "artist_facts.json")
 PREMIUM_USERS_FILE = os.path.join(os.path.dirname(__file__), "premium_users.json")
 SEARCH_CACHE_TTL = 600
+SEARCH_CACHE_TRANSLITERATE = os.getenv("SEARCH_CACHE_TRANSLITERATE", "false").lower() == "true"  # Транслитерировать кириллицу в ключах кэша
+DOWNLOAD_STORE_LIMIT = 1000  # Сколько скачанных файлов помнить для повторного использования
 PAGE_SIZE = 10  # для постраничной навигации
 
 # === НАСТРОЙКИ ПРИОРИТЕТНОЙ ОЧЕРЕДИ ===
-PREMIUM_QUEUE = PriorityQueue()  # Приоритетная очередь для премиум пользователей
-REGULAR_QUEUE = deque()  # Обычная очередь для обычных пользователей
+PREMIUM_QUEUE = "downloads_premium"  # Приоритетная очередь для премиум пользователей (в state_backend)
+REGULAR_QUEUE = "downloads_regular"  # Обычная очередь для обычных пользователей (в state_backend)
 MAX_CONCURRENT_DOWNLOADS = 3  # Максимальное количество одновременных загрузок
 ACTIVE_DOWNLOADS = 0  # Счетчик активных загрузок
 
@@ -143,19 +170,32 @@ download_semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
 
 # === ОТСЛЕЖИВАНИЕ ФОНОВЫХ ЗАДАЧ ===
 task_last_run = {}  # Время последнего успешного запуска каждой задачи
+LEADER_POLL_INTERVAL = 60  # Как часто общие задачи проверяют, пора ли им запускаться
 
-# === НАСТРОЙКИ АНТИСПАМА ===
-ANTISPAM_DELAY = 1.0  # Задержка между запросами в секундах (1 сек)
-user_last_request = {}  # Словарь для отслеживания времени последних запросов пользователей
+# === НАПОМИНАНИЯ О ПРЕМИУМЕ ===
+premium_reminders_sent = BackendDict(state_backend, "premium_reminders")  # Время последнего напоминания пользователю
 
 logging.basicConfig(level=logging.INFO)
+setup_logging()  # Запись логов - в фоновом потоке, не в event loop
+events = get_event_logger("music_bot")
 bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+bot.session.middleware(TelegramMetricsMiddleware())  # Ошибки и retry_after Telegram API, время выгрузки файлов
+bot.session.middleware(TracingRequestMiddleware())  # Запросы к Telegram - спаны в трейсе обновления
+dp = Dispatcher(storage=BackendFSMStorage(state_backend))  # Состояния FSM - в общем хранилище
+dp.shutdown.register(close_sessions)  # Закрываем пулы HTTP-соединений при остановке
+dp.shutdown.register(close_state)  # Дожидаемся записей, отложенных в поток хранилища
+# Обновления одного чата - по порядку, разных чатов - параллельно с общим лимитом
+dp.update.outer_middleware(UpdateExecutorMiddleware(update_executor))
+dp.update.outer_middleware(TracingMiddleware())  # Трейс обновления - уже внутри полосы чата
+# Ограничение частоты - перед обработчиками сообщений и кнопок
+dp.message.middleware(RateLimitMiddleware(rate_limiter))
+dp.callback_query.middleware(RateLimitMiddleware(rate_limiter))
 os.makedirs(CACHE_DIR, exist_ok=True)
 
 # === УНИВЕРСАЛЬНАЯ СИСТЕМА УПРАВЛЕНИЯ ФОНОВЫМИ ЗАДАЧАМИ ===
 
-async def run_periodic_task(task_name: str, coro_func, interval_sec: int, max_exec_time_sec: int = 300):
+async def run_periodic_task(task_name: str, coro_func, interval_sec: int, max_exec_time_sec: int = 300,
+                            cluster_wide: bool = True):
     """
     Универсальная функция для запуска периодических задач с мониторингом и восстановлением.
     
@@ -164,17 +204,26 @@ async def run_periodic_task(task_name: str, coro_func, interval_sec: int, max_ex
         coro_func: Асинхронная функция для выполнения
         interval_sec: Интервал выполнения в секундах
         max_exec_time_sec: Максимальное время выполнения задачи (по умолчанию 5 минут)
+        cluster_wide: Задача общая для всех процессов - выполняет только лидер (leader_lease),
+            не чаще interval_sec на кластер. Иначе задача выполняется в каждом процессе.
     """
     global task_last_run
     
+    # Общие задачи проверяют расписание чаще, чтобы после смены лидера не ждать лишний интервал
+    sleep_sec = min(interval_sec, LEADER_POLL_INTERVAL) if cluster_wide else interval_sec
+    
     while True:
         try:
             # Ждем до следующего запуска
-            await asyncio.sleep(interval_sec)
+            await asyncio.sleep(sleep_sec)
+            
+            if cluster_wide and not await leader_lease.should_run_async(task_name, interval_sec):
+                continue
             
             # Запускаем задачу с ограничением времени
             start_time = time.time()
             logging.info(f"🚀 Запуск фоновой задачи: {task_name}")
+            status = "ok"
             
             try:
                 # Выполняем задачу с таймаутом
@@ -187,15 +236,20 @@ async def run_periodic_task(task_name: str, coro_func, interval_sec: int, max_ex
                 
             except asyncio.TimeoutError:
                 # Задача зависла
+                status = "timeout"
                 logging.error(f"⏰ Задача {task_name} превысила время выполнения ({max_exec_time_sec} сек) и будет перезапущена")
                 task_last_run[task_name] = time.time()  # Обновляем время для избежания бесконечного зависания
                 
             except Exception as task_error:
                 # Задача завершилась с ошибкой
                 import traceback
+                status = "error"
                 logging.error(f"❌ Задача {task_name} завершилась с ошибкой: {task_error}")
                 logging.error(f"📋 Traceback для {task_name}:\n{traceback.format_exc()}")
                 task_last_run[task_name] = time.time()  # Обновляем время для избежания бесконечных ошибок
+            
+            if cluster_wide:
+                await leader_lease.record_run_async(task_name, status, time.time() - start_time)
                 
         except Exception as e:
             # Ошибка в самой системе управления задачами
@@ -240,13 +294,10 @@ async def log_task_status():
 
 # === ОБЕРТКИ ДЛЯ ФОНОВЫХ ЗАДАЧ ===
 
-async def task_antispam_cleanup():
-    """Обертка для очистки антиспама"""
-    cleanup_old_antispam_records()
-
 async def task_file_cleanup():
-    """Обертка для очистки файлов"""
-    await cleanup_orphaned_files(batch_size=200)
+    """Обертка для сверки ссылок на файлы и очистки старых обложек"""
+    await cleanup_orphaned_files()
+    track_metadata.prune()
 
 async def task_premium_monitoring():
     """Обертка для мониторинга премиума"""
@@ -255,31 +306,33 @@ async def task_premium_monitoring():
     # Отправляем еженедельные напоминания
     await send_weekly_premium_reminders()
 
+async def task_save_track_index():
+    """Обертка для сохранения локального индекса треков"""
+    track_index.save()
+
+async def task_flush_state():
+    """Обертка для записи измененных на месте значений в общее хранилище"""
+    flush_mappings()
+
+async def task_disk_quota_rescan():
+    """Обертка для сверки квоты cache с диском и коллекциями"""
+    disk_quota.rescan(cache_file_owners())
+    disk_quota.enforce()
+
 async def task_cleanup_tasks():
-    """Обертка для задач очистки"""
-    await cleanup_orphaned_files(batch_size=200)
+    """Обертка для задач очистки (файлы без ссылок удаляет file_refs)"""
     # Проверяем целостность файлов премиум пользователей
     await check_premium_files_integrity()
 
 # === СТАРЫЕ ФУНКЦИИ ЗАПУСКА ФОНОВЫХ ЗАДАЧ (ЗАМЕНЯЮТСЯ) ===
 
-# Запускаем периодическую очистку антиспама
-async def start_antispam_cleanup():
-    """Запускает периодическую очистку антиспама"""
-    while True:
-        try:
-            await asyncio.sleep(3600)  # Каждый час
-            cleanup_old_antispam_records()
-        except Exception as e:
-            logging.error(f"❌ Ошибка в периодической очистке антиспама: {e}")
-
 # Запускаем периодическую очистку файлов
 async def start_file_cleanup():
     """Запускает периодическую очистку файлов"""
     while True:
         try:
             await asyncio.sleep(3600)  # Каждый час
-            await cleanup_orphaned_files(batch_size=200)
+            await cleanup_orphaned_files()
         except Exception as e:
             if CLEANUP_LOGGING:
                 logging.error(f"❌ Ошибка в периодической очистке файлов: {e}")
@@ -288,11 +341,28 @@ async def start_file_cleanup():
 def start_background_tasks():
     """Запускает фоновые задачи с использованием новой системы управления"""
     try:
+        # Аренда лидерства: общие задачи выполняет один процесс на кластер
+        asyncio.create_task(leader_lease.maintain())
+        # Задержка event loop для /metrics
+        asyncio.create_task(metrics.monitor_event_loop_lag())
+        
         # Запускаем все фоновые задачи через универсальную систему
-        asyncio.create_task(run_periodic_task("Очистка антиспама", task_antispam_cleanup, 3600))
-        asyncio.create_task(run_periodic_task("Очистка файлов", task_file_cleanup, 3600))
+        # Файлы удаляются по ссылкам; сверка с диском - редкая и в каждом процессе (ссылки у каждого свои)
+        asyncio.create_task(start_file_refs())
+        asyncio.create_task(run_periodic_task("Сверка ссылок на файлы", task_file_cleanup, 6 * 3600,
+                                              cluster_wide=False))
+        # Квота cache - у каждого процесса свой учет; первая сверка сразу при старте
+        asyncio.create_task(task_disk_quota_rescan())
+        asyncio.create_task(run_periodic_task("Сверка квоты cache", task_disk_quota_rescan, 600,
+                                              cluster_wide=False))
         asyncio.create_task(run_periodic_task("Мониторинг премиума", task_premium_monitoring, 3600))
         asyncio.create_task(run_periodic_task("Задачи очистки", task_cleanup_tasks, 3600))
+        # Индекс треков и локальный кэш состояния - свои у каждого процесса
+        asyncio.create_task(run_periodic_task("Сохранение индекса треков", task_save_track_index, 600,
+                                              cluster_wide=False))
+        if state_backend.shared:
+            asyncio.create_task(run_periodic_task("Синхронизация состояния", task_flush_state, 30,
+                                                  cluster_wide=False))
         
         # Запускаем мониторинг статуса задач
         asyncio.create_task(log_task_status())
@@ -416,78 +486,37 @@ def load_tracks_with_validation():
         logging.error(f"❌ Ошибка загрузки треков с валидацией: {e}")
         return load_json(TRACKS_FILE, {})
 
-def check_antispam(user_id: str) -> tuple[bool, float]:
-    """
-    Проверяет антиспам для пользователя.
-    Возвращает (разрешено, время до следующего разрешения).
-    """
-    try:
-        current_time = time.time()
-        last_request_time = user_last_request.get(str(user_id), 0)
-        
-        # Если это первый запрос или прошло достаточно времени
-        if current_time - last_request_time >= ANTISPAM_DELAY:
-            user_last_request[str(user_id)] = current_time
-            return True, 0.0
-        
-        # Вычисляем время до следующего разрешения
-        time_until_next = ANTISPAM_DELAY - (current_time - last_request_time)
-        return False, time_until_next
-        
-    except Exception as e:
-        logging.error(f"🌨️ Ошибка проверки антиспама для пользователя {user_id}: {e}")
-        # В случае ошибки разрешаем запрос
-        return True, 0.0
-
-def cleanup_old_antispam_records():
-    """Очищает старые записи антиспама для экономии памяти"""
-    try:
-        current_time = time.time()
-        # Удаляем записи старше 1 часа
-        cutoff_time = current_time - 3600
-        
-        users_to_remove = []
-        for user_id, last_time in user_last_request.items():
-            if last_time < cutoff_time:
-                users_to_remove.append(user_id)
-        
-        for user_id in users_to_remove:
-            del user_last_request[user_id]
-            
-        if users_to_remove:
-            logging.info(f"🧹 Очищено {len(users_to_remove)} старых записей антиспама")
-            
-    except Exception as e:
-        logging.error(f"🌨️ Ошибка очистки антиспама: {e}")
-
 def is_admin(user_id: str, username: str = None) -> bool:
-    """Проверяет, является ли пользователь администратором"""
+    """Проверяет, является ли пользователь администратором (в обновлении - один раз, см. UserContext)"""
+    context = context_for(user_id)
+    if context is not None:
+        return context.is_admin
+    return _lookup_admin(user_id, username)
+
+def _lookup_admin(user_id: str, username: str = None) -> bool:
+    """Проверка прав администратора без контекста обновления"""
     try:
         # Список администраторов (ID и username)
         admin_ids = ["123456789", "987654321"]  # Добавьте сюда ID администраторов
         admin_usernames = ["wtfguys4"]  # Добавьте сюда username администраторов (без символа @)
         
-        # Отладочная информация
-        logging.info(f"🔍 Проверка админских прав: user_id={user_id}, username={username}")
-        logging.info(f"🔍 Список админов ID: {admin_ids}")
-        logging.info(f"🔍 Список админов username: {admin_usernames}")
-        
         # Проверяем по ID
         if user_id and str(user_id) in admin_ids:
-            logging.info(f"✅ Пользователь {user_id} найден в списке админов по ID")
+            events.debug("admin_check", user_id=user_id, username=username, result=True, by="id")
             return True
             
         # Проверяем по username
         if username and username in admin_usernames:
-            logging.info(f"✅ Пользователь {username} найден в списке админов по username")
+            events.debug("admin_check", user_id=user_id, username=username, result=True, by="username")
             return True
             
-        logging.info(f"❌ Пользователь {user_id} ({username}) не найден в списке админов")
+        events.debug("admin_check", user_id=user_id, username=username, result=False)
         return False
     except Exception as e:
         logging.error(f"❌ Ошибка проверки админских прав: {e}")
         return False
 
+@tracer.traced("disk.save_json")
 def save_json(path, data):
     if not path:
         logging.error("❌ save_json: путь не указан")
@@ -508,32 +537,57 @@ def save_json(path, data):
         logging.error(f"❌ Ошибка сохранения {path}: {e}")
         return False
 
+# === file_id статичных картинок ===
+# bear.png выгружается один раз, дальше answer_photo/edit_media отправляют его по file_id
+static_asset_ids = BackendDict(state_backend, "static_assets")
+if not state_backend.persistent:
+    static_asset_ids.update(load_json(STATIC_ASSETS_FILE, {}) or {})
+static_assets = StaticAssets(static_asset_ids,
+                             save=None if state_backend.persistent else
+                             lambda: save_json(STATIC_ASSETS_FILE, dict(static_asset_ids)))
+bot.session.middleware(StaticAssetsMiddleware(static_assets))
+
 def is_premium_user(user_id: str, username: str = None) -> bool:
-    """Проверяет, является ли пользователь премиум"""
+    """Проверяет, является ли пользователь премиум (в обновлении - один раз, см. UserContext)"""
+    context = context_for(user_id)
+    if context is not None:
+        return context.is_premium
+    return _lookup_premium(user_id, username)
+
+def _lookup_premium(user_id: str, username: str = None) -> bool:
+    """Проверка премиума по premium_users.json без контекста обновления"""
     try:
         premium_data = load_json(PREMIUM_USERS_FILE, {"premium_users": [], "premium_usernames": []})
         
-        # Отладочная информация
-        logging.info(f"🔍 Проверка премиум статуса: user_id={user_id}, username={username}")
-        logging.info(f"🔍 Список премиум ID: {premium_data.get('premium_users', [])}")
-        logging.info(f"🔍 Список премиум username: {premium_data.get('premium_usernames', [])}")
-        
         # Проверяем по ID
         if user_id and str(user_id) in premium_data.get("premium_users", []):
-            logging.info(f"✅ Пользователь {user_id} найден в списке премиум по ID")
+            events.debug("premium_check", user_id=user_id, username=username, result=True, by="id")
             return True
             
         # Проверяем по username
         if username and username in premium_data.get("premium_usernames", []):
-            logging.info(f"✅ Пользователь {username} найден в списке премиум по username")
+            events.debug("premium_check", user_id=user_id, username=username, result=True, by="username")
             return True
             
-        logging.info(f"❌ Пользователь {user_id} ({username}) не найден в списке премиум")
+        events.debug("premium_check", user_id=user_id, username=username, result=False)
         return False
     except Exception as e:
         logging.error(f"❌ Ошибка проверки премиум статуса: {e}")
         return False
 
+async def _prefetch_user_state(user_id):
+    """Коллекция и ее версия читаются в потоке хранилища до обработчика"""
+    try:
+        await user_tracks.prefetch(user_id)
+        await collection_versions.prefetch(user_id)
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось заранее прочитать состояние пользователя {user_id}: {e}")
+
+# Премиум, права администратора и коллекция - один раз на обновление
+dp.update.outer_middleware(UserContextMiddleware(_lookup_premium, _lookup_admin,
+                                                 lambda user_id: user_tracks.get(user_id) or [],
+                                                 prefetch=_prefetch_user_state))
+
 def get_subscription_info(user_id: str) -> dict:
     """Получает информацию о подписке пользователя"""
     try:
@@ -643,6 +697,7 @@ def add_premium_user(user_id: str = None, username: str = None) -> bool:
             }
         
         save_json(PREMIUM_USERS_FILE, premium_data)
+        invalidate_user_context(user_id)
         logging.info(f"✅ Пользователь {user_id} ({username}) добавлен в премиум")
         return True
         
@@ -668,6 +723,7 @@ def remove_premium_user(user_id: str = None, username: str = None) -> bool:
             premium_data["subscriptions"].pop(str(user_id), None)
         
         save_json(PREMIUM_USERS_FILE, premium_data)
+        invalidate_user_context(user_id)
         logging.info(f"✅ Пользователь {user_id} ({username}) удален из премиум")
         return True
         
@@ -822,9 +878,23 @@ def generate_payment_code(user_id: str, username: str) -> str:
 
 
 
-# Загружаем треки с автоматической очисткой несуществующих файлов
-user_tracks = load_tracks_with_validation()
-search_cache = load_json(SEARCH_CACHE_FILE, {})
+# Коллекции и кэш поиска живут в state_backend. В памяти процесса они заполняются из
+# JSON-файлов; постоянное хранилище заполняется из них только при первом запуске
+user_tracks = BackendDict(state_backend, "user_tracks")
+search_cache = BackendDict(state_backend, "search_cache")
+user_recommendation_history = BackendDict(state_backend, "recommendation_history")
+collection_versions = BackendDict(state_backend, "collection_versions")  # Версии коллекций для готовых клавиатур
+collection_keyboards = CollectionKeyboards(collection_versions)
+if not state_backend.persistent or not len(user_tracks):
+    # Загружаем треки с автоматической очисткой несуществующих файлов
+    user_tracks.update(load_tracks_with_validation() or {})
+if not state_backend.persistent or not len(search_cache):
+    search_cache.update(load_json(SEARCH_CACHE_FILE, {}) or {})
+
+# Локальный индекс уже встречавшихся треков: сохраненный индекс + коллекции пользователей
+track_index.load()
+track_index.add_collections(user_tracks)
+logging.info(f"🗂️ Индекс треков загружен: {len(track_index.docs)} треков")
 
 
 artist_facts = load_json(ARTIST_FACTS_FILE, {"facts": {}})
@@ -840,11 +910,14 @@ def save_tracks():
             user_tracks = {}
         
         # Проверяем, что user_tracks является словарем
-        if not isinstance(user_tracks, dict):
+        if not isinstance(user_tracks, (dict, BackendDict)):
             logging.error(f"🌨️ save_tracks: user_tracks не является словарем: {type(user_tracks)}")
             return False
         
-        save_json(TRACKS_FILE, user_tracks)
+        if isinstance(user_tracks, BackendDict):
+            user_tracks.flush()
+        if not state_backend.persistent:
+            save_json(TRACKS_FILE, dict(user_tracks))
         logging.info("🐻‍❄️ Треки успешно сохранены")
         return True
         
@@ -995,8 +1068,8 @@ async def auto_cleanup_file(file_path: str, delay: float = None, is_collection_t
         if CLEANUP_LOGGING:
             logging.info(f"🧹 Запланирована автоматическая очистка файла {file_path} через {cleanup_delay} сек.")
         
-        # Запускаем асинхронную задачу очистки
-        asyncio.create_task(delayed_file_cleanup(file_path, cleanup_delay))
+        # Хранилище загрузок отпускает файл; удалится, когда его не держат коллекции и отправки
+        drop_download(file_path, cleanup_delay)
         return True
         
     except Exception as e:
@@ -1004,129 +1077,26 @@ async def auto_cleanup_file(file_path: str, delay: float = None, is_collection_t
             logging.error(f"🌨️ Ошибка планирования автоматической очистки файла {file_path}: {e}")
         return False
 
-async def delayed_file_cleanup(file_path: str, delay: float):
+async def cleanup_orphaned_files():
     """
-    Выполняет удаление файла с задержкой.
+    Сверка учета ссылок на файлы cache с коллекциями и хранилищем загрузок.
+    Обычно файл удаляется сразу, как только отпущена последняя ссылка
+    (file_refs); сверка ловит расхождения: файлы без ссылок ставятся в
+    очередь отложенного удаления, ссылки на пропавшие файлы снимаются.
     """
     try:
-        # Ждем указанное время
-        await asyncio.sleep(delay)
-        
-        # Проверяем, что файл все еще существует
-        if not os.path.exists(file_path):
-            if CLEANUP_LOGGING:
-                logging.info(f"🧹 Файл уже удален: {file_path}")
-            return
-        
-        # Получаем информацию о файле перед удалением
-        try:
-            file_size = os.path.getsize(file_path)
-            file_size_mb = file_size / (1024 * 1024)
-        except Exception:
-            file_size_mb = 0
-        
-        # Удаляем файл
-        os.remove(file_path)
-        
-        if CLEANUP_LOGGING:
-            logging.info(f"🧹 Файл автоматически удален: {file_path} ({file_size_mb:.2f} MB)")
-        
+        if not os.path.exists(CACHE_DIR):
+            return {}
+        return file_refs.reconcile(cache_file_holders(), schedule_orphans=AUTO_CLEANUP_ENABLED)
     except Exception as e:
         if CLEANUP_LOGGING:
-            logging.error(f"🌨️ Ошибка автоматической очистки файла {file_path}: {e}")
+            logging.error(f"❌ Ошибка сверки ссылок на файлы: {e}")
+        return {}
 
-async def cleanup_orphaned_files(batch_size: int = 200):
-    """
-    Асинхронно очищает "осиротевшие" файлы в папке cache, которые не привязаны к пользователям.
-    Запускается периодически для освобождения места на диске.
-    
-    Args:
-        batch_size: Максимальное количество файлов для обработки за один проход
-    """
-    try:
-        if not AUTO_CLEANUP_ENABLED:
-            return
-        
-        cache_dir = CACHE_DIR
-        if not os.path.exists(cache_dir):
-            return
-        
-        # Получаем список всех файлов в cache
-        cache_files = set()
-        for filename in os.listdir(cache_dir):
-            if filename.endswith('.mp3'):
-                cache_files.add(os.path.join(cache_dir, filename))
-        
-        if not cache_files:
-            return
-        
-        # Получаем список файлов, привязанных к пользователям
-        used_files = set()
-        global user_tracks
-        
-        if user_tracks:
-            for user_id, tracks in user_tracks.items():
-                if tracks:
-                    for track in tracks:
-                        if isinstance(track, dict):
-                            file_path = track.get('url', '').replace('file://', '')
-                        else:
-                            file_path = track
-                        
-                        if file_path and os.path.exists(file_path):
-                            used_files.add(file_path)
-        
-        # Находим осиротевшие файлы
-        orphaned_files = list(cache_files - used_files)
-        
-        if not orphaned_files:
-            return
-        
-        if CLEANUP_LOGGING:
-            logging.info(f"🧹 Найдено {len(orphaned_files)} осиротевших файлов для очистки")
-        
-        # Ограничиваем количество файлов для обработки за один проход
-        files_to_process = orphaned_files[:batch_size]
-        remaining_files = len(orphaned_files) - batch_size
-        
-        if remaining_files > 0:
-            if CLEANUP_LOGGING:
-                logging.info(f"🧹 Обрабатываем {len(files_to_process)} файлов за этот проход, осталось {remaining_files}")
-        
-        cleaned_count = 0
-        total_size_freed = 0
-        
-        for i, orphaned_file in enumerate(files_to_process):
-            try:
-                if os.path.exists(orphaned_file):
-                    file_size = os.path.getsize(orphaned_file)
-                    os.remove(orphaned_file)
-                    cleaned_count += 1
-                    total_size_freed += file_size
-                    
-                    if CLEANUP_LOGGING:
-                        logging.info(f"🧹 Удален осиротевший файл: {orphaned_file}")
-                        
-            except Exception as e:
-                if CLEANUP_LOGGING:
-                    logging.error(f"❌ Ошибка удаления осиротевшего файла {orphaned_file}: {e}")
-            
-            # Каждые 20 файлов делаем паузу для неблокирования event loop
-            if (i + 1) % 20 == 0:
-                await asyncio.sleep(0)
-                if CLEANUP_LOGGING:
-                    logging.info(f"🧹 Очистка: обработано {i + 1} из {len(files_to_process)} файлов")
-        
-        if CLEANUP_LOGGING and cleaned_count > 0:
-            total_size_mb = total_size_freed / (1024 * 1024)
-            logging.info(f"🧹 Очистка завершена: удалено {cleaned_count} файлов, освобождено {total_size_mb:.2f} MB")
-            
-            if remaining_files > 0:
-                logging.info(f"🧹 В следующем цикле будет обработано еще {remaining_files} файлов")
-        
-    except Exception as e:
-        if CLEANUP_LOGGING:
-            logging.error(f"❌ Ошибка очистки осиротевших файлов: {e}")
+async def start_file_refs():
+    """Восстанавливает ссылки на файлы после запуска и удаляет файлы из очереди по сроку"""
+    await cleanup_orphaned_files()
+    await file_refs.run()
 
 def is_file_in_collection(file_path: str) -> bool:
     """
@@ -1167,7 +1137,7 @@ def is_file_in_collection(file_path: str) -> bool:
 
 async def check_file_integrity(file_path: str) -> bool:
     """
-    Проверяет целостность MP3 файла.
+    Проверяет целостность аудиофайла: структуру всех MPEG-кадров (MP3) или атомов (M4A).
     
     Args:
         file_path: Путь к файлу для проверки
@@ -1178,28 +1148,11 @@ async def check_file_integrity(file_path: str) -> bool:
     try:
         if not os.path.exists(file_path):
             return False
-        
-        # Проверяем размер файла
-        file_size = os.path.getsize(file_path)
-        if file_size == 0:
-            return False
-        
-        # Проверяем, что файл можно открыть
-        try:
-            with open(file_path, 'rb') as f:
-                # Читаем первые 10 байт для проверки заголовка MP3
-                header = f.read(10)
-                if len(header) < 10:
-                    return False
-                
-                # Простая проверка на MP3 файл (ID3 или MPEG header)
-                if not (header.startswith(b'ID3') or header.startswith(b'\xff\xfb') or header.startswith(b'\xff\xf3')):
-                    return False
-                    
-        except Exception:
-            return False
-        
-        return True
+        loop = asyncio.get_running_loop()
+        ok, reason = await loop.run_in_executor(None, check_audio_file, file_path)
+        if not ok and CLEANUP_LOGGING:
+            logging.warning(f"🔧 Файл {file_path} поврежден: {reason}")
+        return ok
         
     except Exception as e:
         if CLEANUP_LOGGING:
@@ -1228,6 +1181,8 @@ async def auto_repair_damaged_file(file_path: str, user_id: str, original_url: s
         try:
             if os.path.exists(file_path):
                 os.remove(file_path)
+                disk_quota.forget(file_path)
+            integrity_scanner.forget(file_path)
         except Exception as e:
             if CLEANUP_LOGGING:
                 logging.error(f"🌨️ Ошибка удаления поврежденного файла {file_path}: {e}")
@@ -1439,6 +1394,7 @@ async def cleanup_expired_premium_user(user_id: str):
         
         # Очищаем коллекцию пользователя
         user_tracks[user_id] = []
+        collection_keyboards.bump(user_id)
         save_tracks()
         
         if deleted_count > 0:
@@ -1488,8 +1444,7 @@ async def send_weekly_premium_reminders():
                     continue
                 
                 # Проверяем, не отправляли ли мы напоминание недавно
-                last_reminder_key = f"last_premium_reminder_{user_id}"
-                last_reminder_time = user_last_request.get(last_reminder_key, 0)
+                last_reminder_time = premium_reminders_sent.get(user_id, 0)
                 
                 if current_time - last_reminder_time >= PREMIUM_NOTIFICATION_INTERVAL:
                     # Отправляем напоминание
@@ -1507,7 +1462,7 @@ async def send_weekly_premium_reminders():
                     
                     try:
                         await bot.send_message(user_id, reminder_message, parse_mode="Markdown")
-                        user_last_request[last_reminder_key] = current_time
+                        premium_reminders_sent[user_id] = current_time
                         logging.info(f"🐻‍❄️ Еженедельное напоминание о премиуме отправлено пользователю {user_id}")
                         
                         # Небольшая задержка между отправками
@@ -1527,7 +1482,7 @@ async def start_cleanup_tasks():
     while True:
         try:
             await asyncio.sleep(3600)  # Каждый час
-            await cleanup_orphaned_files(batch_size=200)
+            await cleanup_orphaned_files()
             
             # Проверяем целостность файлов премиум пользователей
             await check_premium_files_integrity()
@@ -1536,12 +1491,14 @@ async def start_cleanup_tasks():
             if CLEANUP_LOGGING:
                 logging.error(f"🌨️ Ошибка в периодической очистке: {e}")
 
-async def check_premium_files_integrity(batch_size: int = 200):
+async def check_premium_files_integrity():
     """
     Проверяет целостность файлов премиум пользователей и перезагружает поврежденные.
     
-    Args:
-        batch_size: Максимальное количество треков для обработки за один проход
+    Проход инкрементальный (integrity_scanner): читаются только новые, измененные
+    и давно не проверенные файлы, с места, где остановился предыдущий проход,
+    в пределах бюджета чтения. Повреждение, подтвержденное двумя проходами,
+    передается в auto_repair_damaged_file.
     """
     try:
         global user_tracks
@@ -1552,84 +1509,49 @@ async def check_premium_files_integrity(batch_size: int = 200):
         # Загружаем данные о премиум пользователях
         premium_data = load_json(PREMIUM_USERS_FILE, {"premium_users": [], "premium_usernames": []})
         premium_users = set(premium_data.get("premium_users", []))
-        premium_usernames = set(premium_data.get("premium_usernames", []))
-        
-        damaged_files = []
-        processed_tracks = 0
         
-        for user_id, tracks in user_tracks.items():
-            # Проверяем, является ли пользователь премиум
-            is_premium = (user_id in premium_users)
-            
-            if not is_premium:
+        # Путь -> (пользователь, ссылка для перезагрузки)
+        candidates = {}
+        for user_id, tracks in list(user_tracks.items()):
+            if user_id not in premium_users or not tracks:
                 continue
-            
-            if tracks:
-                for track in tracks:
-                    # Проверяем лимит на количество обрабатываемых треков
-                    if processed_tracks >= batch_size:
-                        if CLEANUP_LOGGING:
-                            logging.info(f"🔧 Достигнут лимит обработки ({batch_size} треков), остальные будут проверены в следующем цикле")
-                        break
-                    
-                    if isinstance(track, dict):
-                        file_path = track.get('url', '').replace('file://', '')
-                        original_url = track.get('original_url', '')  # Нужно будет добавить это поле
-                    else:
-                        file_path = track
-                        original_url = ''  # Для старых треков URL неизвестен
-                    
-                    if file_path and os.path.exists(file_path):
-                        # Проверяем целостность файла
-                        if not await check_file_integrity(file_path):
-                            damaged_files.append({
-                                'file_path': file_path,
-                                'user_id': user_id,
-                                'original_url': original_url
-                            })
-                    
-                    processed_tracks += 1
-                    
-                    # Каждые 20 треков делаем паузу для неблокирования event loop
-                    if processed_tracks % 20 == 0:
-                        await asyncio.sleep(0)
-                        if CLEANUP_LOGGING:
-                            logging.info(f"🔧 Проверка целостности: обработано {processed_tracks} треков")
-                
-                # Если достигли лимита, выходим из внешнего цикла
-                if processed_tracks >= batch_size:
-                    break
+            for track in tracks:
+                if isinstance(track, dict):
+                    file_path = track.get('url', '').replace('file://', '')
+                    original_url = track.get('original_url', '')
+                else:
+                    file_path = track
+                    original_url = ''  # Для старых треков URL неизвестен
+                if file_path:
+                    candidates[file_path] = (user_id, original_url)
+        
+        damaged_files = await integrity_scanner.scan(list(candidates))
         
         # Перезагружаем поврежденные файлы
-        if damaged_files:
-            if CLEANUP_LOGGING:
-                logging.info(f"🔧 Найдено {len(damaged_files)} поврежденных файлов премиум пользователей")
-            
-            for i, damaged_file in enumerate(damaged_files):
-                if damaged_file['original_url']:
-                    await auto_repair_damaged_file(
-                        damaged_file['file_path'],
-                        damaged_file['user_id'],
-                        damaged_file['original_url']
-                    )
-                else:
-                    if CLEANUP_LOGGING:
-                        logging.warning(f"🐻‍❄️ Не удается перезагрузить файл без URL: {damaged_file['file_path']}")
-                
-                # Каждые 10 файлов делаем паузу
-                if (i + 1) % 10 == 0:
-                    await asyncio.sleep(0)
-                    if CLEANUP_LOGGING:
-                        logging.info(f"🔧 Восстановление: обработано {i + 1} из {len(damaged_files)} файлов")
+        for i, file_path in enumerate(damaged_files):
+            user_id, original_url = candidates[file_path]
+            if original_url:
+                await auto_repair_damaged_file(file_path, user_id, original_url)
+            else:
+                if CLEANUP_LOGGING:
+                    logging.warning(f"🐻‍❄️ Не удается перезагрузить файл без URL: {file_path}")
+            
+            # Каждые 10 файлов делаем паузу
+            if (i + 1) % 10 == 0:
+                await asyncio.sleep(0)
         
         if CLEANUP_LOGGING:
-            logging.info(f"🔧 Проверка целостности завершена: обработано {processed_tracks} треков, найдено {len(damaged_files)} поврежденных файлов")
+            last_pass = integrity_scanner.last_pass
+            logging.info(f"🔧 Проверка целостности: просмотрено {last_pass.get('examined', 0)} из {len(candidates)} файлов, "
+                         f"прочитано {last_pass.get('read', 0)} ({last_pass.get('bytes', 0) / 1024 / 1024:.1f} MB), "
+                         f"подтверждено повреждений: {len(damaged_files)}")
         
     except Exception as e:
         if CLEANUP_LOGGING:
             logging.error(f"🌨️ Ошибка проверки целостности файлов премиум пользователей: {e}")
 
 # === Кэш поиска ===
+@tracer.traced("cache.search")
 def get_cached_search(query):
     try:
         if not query or not isinstance(query, str):
@@ -1641,11 +1563,12 @@ def get_cached_search(query):
             logging.warning("🐻‍❄️ get_cached_search: search_cache был None")
             return None
             
-        query_l = query.lower()
+        query_l = normalize_query(query, SEARCH_CACHE_TRANSLITERATE)
         if query_l in search_cache:
             data = search_cache[query_l]
             if isinstance(data, dict) and "time" in data and "results" in data:
                 if time.time() - data["time"] < SEARCH_CACHE_TTL:
+                    metrics.cache_hit("search")
                     return data["results"]
                 else:
                     # Удаляем устаревший кэш
@@ -1655,12 +1578,23 @@ def get_cached_search(query):
                 # Некорректная структура кэша
                 logging.warning(f"🐻‍❄️ Некорректная структура кэша для запроса: {query}")
                 del search_cache[query_l]
+        metrics.cache_miss("search")
         return None
         
     except Exception as e:
         logging.error(f"🌨️ Ошибка в get_cached_search: {e}")
         return None
 
+def trim_search_cache():
+    """Удаляет самые старые записи кэша поиска, если их больше 100"""
+    if state_backend.count(search_cache.namespace) <= 100:
+        return
+    sorted_cache = sorted(state_backend.items(search_cache.namespace), key=lambda x: x[1].get("time", 0))
+    items_to_remove = len(sorted_cache) - 80  # Оставляем 80 записей
+    for key, _ in sorted_cache[:items_to_remove]:
+        state_backend.delete(search_cache.namespace, key)
+    logging.info(f"🐻‍❄️ Очищен кэш поиска, удалено {items_to_remove} старых записей")
+
 def set_cached_search(query, results):
     global search_cache
     try:
@@ -1677,17 +1611,12 @@ def set_cached_search(query, results):
             logging.warning("🐻‍❄️ set_cached_search: search_cache был None, инициализируем")
             search_cache = {}
         
-        # Ограничиваем размер кэша (удаляем старые записи, если их больше 100)
-        if len(search_cache) > 100:
-            # Удаляем самые старые записи
-            sorted_cache = sorted(search_cache.items(), key=lambda x: x[1].get("time", 0))
-            items_to_remove = len(sorted_cache) - 80  # Оставляем 80 записей
-            for i in range(items_to_remove):
-                del search_cache[sorted_cache[i][0]]
-            logging.info(f"🐻‍❄️ Очищен кэш поиска, удалено {items_to_remove} старых записей")
-        
-        search_cache[query.lower()] = {"time": time.time(), "results": results}
-        save_json(SEARCH_CACHE_FILE, search_cache)
+        # Ограничиваем размер кэша - в потоке хранилища, не в event loop
+        state_backend.write_behind(trim_search_cache)
+        
+        search_cache[normalize_query(query, SEARCH_CACHE_TRANSLITERATE)] = {"time": time.time(), "results": results}
+        if not state_backend.persistent:
+            save_json(SEARCH_CACHE_FILE, dict(search_cache))
         logging.info(f"🐻‍❄️ Кэш обновлен для запроса: {query}")
         return True
         
@@ -1695,93 +1624,299 @@ def set_cached_search(query, results):
         logging.error(f"🌨️ Ошибка в set_cached_search: {e}")
         return False
 
+# === Поиск на YouTube ===
+def _youtube_search_blocking(query, limit=5, errors=None):
+    """Запасной поиск на YouTube через yt-dlp (блокирующий, выполняется в yt_executor)"""
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'ignoreerrors': True,
+        'extract_flat': True,
+        'timeout': 30,
+        'retries': 3,
+        'logger': YdlErrorCollector(errors),
+    }
+    if os.path.exists(COOKIES_FILE):
+        ydl_opts['cookiefile'] = COOKIES_FILE
+    
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(f"ytsearch{limit}:{query}", download=False)
+    
+    if not info:
+        return []
+    results = []
+    for entry in info.get("entries") or []:
+        if entry and entry.get('id'):
+            entry['source'] = 'yt'
+            results.append(entry)
+    return results
+
+@tracer.traced("search.youtube")
+async def search_youtube(query, limit=5):
+    """Поиск на YouTube: innertube через общий пул соединений, yt-dlp как запасной вариант"""
+    breaker = source_breakers["yt_search"]
+    if not breaker.allow():
+        logging.warning(f"🔴 Поиск YouTube временно отключен предохранителем, запрос: {query}")
+        return []
+    try:
+        with tracer.span("search.youtube_innertube"), metrics.timer(metrics.SEARCH_SECONDS, provider="youtube") as outcome:
+            results = await youtube_client.search(query, limit)
+            outcome["result"] = "unavailable" if results is None else ("ok" if results else "empty")
+        if results is None:
+            logging.info(f"🔍 innertube недоступен, поиск на YouTube через yt-dlp: {query}")
+            errors = []
+            loop = asyncio.get_running_loop()
+            with tracer.span("search.youtube_ytdlp"), metrics.timer(metrics.SEARCH_SECONDS, provider="youtube_ytdlp") as outcome:
+                results = await loop.run_in_executor(yt_executor, _youtube_search_blocking, query, limit, errors)
+                outcome["result"] = "ok" if results else ("error" if errors else "empty")
+            if not results and errors:
+                breaker.record_failure(classify_error(errors[-1]), errors[-1])
+                return []
+        breaker.record_success()
+        track_index.add_results(results)
+        return results or []
+    except asyncio.CancelledError:
+        breaker.release_probe()
+        raise
+    except Exception as e:
+        logging.error(f"❌ Ошибка поиска YouTube для запроса '{query}': {e}")
+        breaker.record_failure(classify_error(e), str(e))
+        return []
+
 # === Асинхронная обёртка для yt_dlp ===
-def _ydl_download_blocking(url, outtmpl, cookiefile, is_premium=False):
-    """Блокирующая функция для скачивания через yt-dlp"""
+# === Хранилище загрузок ===
+# Ключ - канонический идентификатор трека и качество, поэтому youtu.be/…, /shorts/… и
+# music.youtube.com/… одного видео скачиваются один раз
+CACHE_OUTTMPL = os.path.join(CACHE_DIR, '%(title)s.%(ext)s')
+download_store = {}  # ключ -> (filename, info)
+inflight_downloads = {}  # ключ -> asyncio.Task текущей загрузки
+active_downloads = 0  # Загрузки, которые уже выполняются (а не ждут семафор или место в cache)
+disk_quota = DiskQuota(CACHE_DIR)  # Байты cache по владельцам, вытеснение давно не игравших файлов
+# Ссылки на файлы cache: файл удаляется, когда его не держат ни хранилище загрузок, ни коллекции, ни отправки
+deferred_deletes = BackendDict(state_backend, "deferred_deletes")  # путь -> время удаления
+if not state_backend.persistent:
+    deferred_deletes.update(load_json(DEFERRED_DELETES_FILE, {}) or {})
+file_refs = FileRefs(CACHE_DIR, deferred_deletes, grace=AUTO_CLEANUP_DELAY, on_delete=disk_quota.forget,
+                     save=None if state_backend.persistent else
+                     lambda: save_json(DEFERRED_DELETES_FILE, dict(deferred_deletes)),
+                     # С общим хранилищем процессы видят, какие файлы держат остальные (без кэша чтения)
+                     holders=BackendDict(state_backend, "file_holders", cache_ttl=0) if state_backend.shared else None,
+                     processes=BackendDict(state_backend, "file_ref_processes", cache_ttl=0) if state_backend.shared else None,
+                     process=leader_lease.holder)
+# Проверка целостности коллекций: записи о проверенных файлах и курсор прохода
+integrity_records = BackendDict(state_backend, "integrity_records")
+integrity_state = BackendDict(state_backend, "integrity_state")
+if not state_backend.persistent:
+    _integrity_data = load_json(INTEGRITY_FILE, {}) or {}
+    integrity_records.update(_integrity_data.get("records", {}))
+    integrity_state.update(_integrity_data.get("state", {}))
+integrity_scanner = IntegrityScanner(
+    integrity_records, integrity_state,
+    save=None if state_backend.persistent else
+    lambda: save_json(INTEGRITY_FILE, {"records": dict(integrity_records), "state": dict(integrity_state)}))
+
+def cache_file_owners() -> dict:
+    """Путь -> класс владельца для файлов из коллекций (остальные файлы cache - временные)"""
+    premium_data = load_json(PREMIUM_USERS_FILE, {"premium_users": []})
+    premium_users = set(premium_data.get("premium_users", []))
+    owners = {}
+    for user_id, tracks in list(user_tracks.items()):
+        owner = OWNER_PREMIUM if user_id in premium_users else OWNER_COLLECTION
+        for track in tracks or []:
+            path = track.get('url', '').replace('file://', '') if isinstance(track, dict) else track
+            # Файл в нескольких коллекциях: премиум-владелец важнее
+            if path and owners.get(path) != OWNER_PREMIUM:
+                owners[path] = owner
+    return owners
+
+def cache_file_holders() -> dict:
+    """Путь -> постоянные держатели файла (коллекции и хранилище загрузок) для сверки file_refs"""
+    holders = {}
+    for user_id, tracks in list(user_tracks.items()):
+        for track in tracks or []:
+            path = track.get('url', '').replace('file://', '') if isinstance(track, dict) else track
+            if path:
+                holders.setdefault(path, []).append(collection_holder(user_id))
+    for filename, _ in list(download_store.values()):
+        holders.setdefault(filename, []).append(HOLDER_STORE)
+    return holders
+
+def note_collection_file(user_id, file_path):
+    """Файл попал в коллекцию: у премиум-пользователя он закреплен, у обычного - вытесняемый"""
+    file_refs.acquire(file_path, collection_holder(user_id))
+    disk_quota.set_owner(file_path, OWNER_PREMIUM if is_premium_user(str(user_id)) else OWNER_COLLECTION)
+
+def drop_download(file_path, delay=None):
+    """
+    Файл больше не нужен хранилищу загрузок: его записи убираются, и если
+    файл больше никто не держит, он удаляется через delay секунд (0 - сразу).
+    """
+    key = os.path.normpath(file_path)
+    released = False
+    for store_key, (filename, _) in list(download_store.items()):
+        if os.path.normpath(filename) == key:
+            del download_store[store_key]
+            file_refs.release(filename, HOLDER_STORE, delay)
+            released = True
+    if not released:
+        file_refs.release(file_path, None, delay)
+
+@contextmanager
+def sending_file(file_path):
+    """Файл отправляется: его не удаляют ни очистка, ни квота"""
+    with file_refs.held(file_path), disk_quota.pin(file_path):
+        yield
+
+def download_key(url, is_premium=False):
+    return f"{media_key(url)}:{'320' if is_premium else '192'}"
+
+def download_breaker(url):
+    """Предохранитель источника, с которого скачивается трек"""
+    return source_breakers["soundcloud" if media_key(url).startswith("sc:") else "yt_download"]
+
+@tracer.traced("download")
+async def _fetch_media_task(key, url, cookiefile, is_premium):
+    global active_downloads
+    breaker = download_breaker(url)
+    errors = []
     try:
-        # Проверяем входные параметры
-        if not url or not isinstance(url, str):
-            logging.error("🌨️ _ydl_download_blocking: некорректный URL")
-            return None
-            
-        if not outtmpl or not isinstance(outtmpl, str):
-            logging.error("🌨️ _ydl_download_blocking: некорректный шаблон имени файла")
-            return None
-        
-        # Базовые настройки
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': outtmpl,
-            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}],
-            'quiet': True,
-            'no_warnings': True,
-            'ignoreerrors': True,
-            'extract_flat': False,  # Для загрузки нужно False
-            'timeout': 300,  # Увеличиваем таймаут до 5 минут
-            'retries': 3,  # Количество попыток
-        }
-        
-        # Премиум настройки для качества 320 kbps
-        if is_premium:
-            ydl_opts['postprocessors'] = [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '320'}]
-            logging.info(f"💎 Премиум загрузка: качество 320 kbps для {url}")
-        else:
-            logging.info(f"📱 Обычная загрузка: качество 192 kbps для {url}")
-        
-        # Проверяем cookies файл
-        if cookiefile and os.path.exists(cookiefile):
+        if DOWNLOAD_WORKERS_ENABLED and await download_jobs.alive_workers_async():
+            # yt-dlp и ffmpeg - в процессах-воркерах, их число и ограничивает параллельность
+            mode = "worker"
+            started = time.perf_counter()
+            active_downloads += 1
             try:
-                ydl_opts['cookiefile'] = cookiefile
-                logging.info(f"🍪 Используем cookies файл: {cookiefile}")
-            except Exception as cookie_error:
-                logging.warning(f"🐻‍❄️ Ошибка с cookies файлом: {cookie_error}")
+                fn_info = await download_jobs.run(url, CACHE_OUTTMPL, cookiefile, is_premium, errors)
+            finally:
+                active_downloads -= 1
         else:
-            logging.info("🍪 Cookies файл не найден, используем поиск без авторизации")
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                # Получаем информацию о видео
-                info = ydl.extract_info(url, download=True)
-                
-                if not info:
-                    logging.error(f"🌨️ Не удалось получить информацию о видео: {url}")
-                    return None
-                
-                # Получаем имя файла
-                filename = ydl.prepare_filename(info)
-                if not filename:
-                    logging.error(f"🌨️ Не удалось подготовить имя файла для: {url}")
-                    return None
-                
-                # Преобразуем в .mp3
-                mp3_filename = os.path.splitext(filename)[0] + ".mp3"
-                
-                # Проверяем, что файл действительно создался
-                if not os.path.exists(mp3_filename):
-                    logging.error(f"🌨️ MP3 файл не был создан: {mp3_filename}")
-                    return None
-                
-                # Проверяем размер файла
+            # Используем Semaphore для ограничения одновременных загрузок
+            mode = "local"
+            async with download_semaphore:
+                # выполнить blocking ytdl в пуле потоков через ThreadPoolExecutor
+                loop = asyncio.get_running_loop()
+                started = time.perf_counter()
+                active_downloads += 1
                 try:
-                    file_size = os.path.getsize(mp3_filename)
-                    if file_size == 0:
-                        logging.error(f"🌨️ Созданный файл пустой: {mp3_filename}")
-                        return None
-                    quality_text = "320 kbps" if is_premium else "192 kbps"
-                    logging.info(f"🐻‍❄️ Файл создан успешно: {mp3_filename} ({file_size} байт, {quality_text})")
-                except Exception as size_error:
-                    logging.error(f"🌨️ Ошибка проверки размера файла: {size_error}")
-                    return None
-                
-                return mp3_filename, info
-                
-            except Exception as extract_error:
-                logging.error(f"🌨️ Ошибка извлечения информации: {extract_error}")
-                return None
-                
+                    fn_info = await loop.run_in_executor(yt_executor, ydl_download_blocking, url, CACHE_OUTTMPL, cookiefile, is_premium, errors)
+                finally:
+                    active_downloads -= 1
+        # Время конвертации воркер/yt-dlp возвращает в info, остальное - скачивание
+        elapsed = time.perf_counter() - started
+        transcode_seconds = (fn_info[1].get("transcode_seconds") or 0.0) if fn_info else 0.0
+        metrics.DOWNLOAD_SECONDS.labels(mode=mode, result="ok" if fn_info else "error").observe(elapsed - transcode_seconds)
+        if transcode_seconds:
+            metrics.TRANSCODE_SECONDS.labels(quality="320" if is_premium else "192").observe(transcode_seconds)
+            tracer.record("transcode", transcode_seconds, mode=mode)
+        if fn_info:
+            breaker.record_success()
+            # Метаданные и обложка - один раз при скачивании, дальше берутся готовыми
+            track_metadata.ingest(fn_info[0], fn_info[1], 320 if is_premium else 192)
+            # Сначала ссылка хранилища загрузок, затем учет в квоте (новый файл она не вытесняет)
+            previous = download_store.pop(key, None)
+            file_refs.acquire(fn_info[0], HOLDER_STORE)
+            disk_quota.add(fn_info[0])
+            if previous:
+                file_refs.release(previous[0], HOLDER_STORE)
+            download_store[key] = fn_info
+            while len(download_store) > DOWNLOAD_STORE_LIMIT:
+                evicted = download_store.pop(next(iter(download_store)))
+                file_refs.release(evicted[0], HOLDER_STORE)
+        else:
+            # Запоминаем неудачу, чтобы повторные запросы не платили полную цену загрузки
+            message = errors[-1] if errors else ""
+            error_class = classify_error(message) if message else ERROR_TRANSIENT
+            negative_cache.add(media_key(url), error_class, message)
+            breaker.record_failure(error_class, message)
+            logging.warning(f"🚫 Загрузка {media_key(url)} не удалась ({error_class}): {message}")
+        return fn_info
+    except asyncio.CancelledError:
+        # Результата нет - ни успех, ни отказ источника, но пробу half-open надо освободить
+        breaker.release_probe()
+        raise
     except Exception as e:
-        logging.error(f"🌨️ Критическая ошибка в _ydl_download_blocking: {e}")
-        return None
+        breaker.record_failure(classify_error(e), str(e))
+        raise
+    finally:
+        inflight_downloads.pop(key, None)
+
+async def fetch_media(url, cookiefile, is_premium=False):
+    """
+    Скачивает трек через yt-dlp не более одного раза на канонический ключ:
+    одновременные запросы ждут одну загрузку, повторные получают уже скачанный файл.
+    Возвращает (filename, info) или None.
+    """
+    download_url = canonical_url(url) or url
+    key = download_key(download_url, is_premium)
+    
+    stored = download_store.get(key)
+    if stored and os.path.exists(stored[0]):
+        disk_quota.touch(stored[0])
+        metrics.cache_hit("download")
+        logging.info(f"♻️ Используем уже скачанный файл для {key}: {stored[0]}")
+        return stored
+    metrics.cache_miss("download")
+    
+    task = inflight_downloads.get(key)
+    if task is None:
+        # Недавно уже не получилось скачать - сразу отказываем
+        failed = negative_cache.get(media_key(download_url))
+        if failed:
+            metrics.cache_hit("negative")
+            logging.info(f"🚫 {media_key(download_url)} в негативном кэше ({failed['class']}), пропускаем загрузку")
+            return None
+        metrics.cache_miss("negative")
+        breaker = download_breaker(download_url)
+        if not breaker.allow():
+            logging.warning(f"🔴 Загрузка {media_key(download_url)} отклонена предохранителем")
+            return None
+        # Под давлением на диск новые загрузки ждут, пока вытеснение освободит место
+        try:
+            has_space = await disk_quota.wait_for_space()
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        if not has_space:
+            breaker.release_probe()
+            logging.warning(f"💽 Загрузка {media_key(download_url)} отклонена: нет места в cache")
+            return None
+        task = inflight_downloads.get(key)
+        if task is not None:
+            # Пока ждали места, загрузку начал другой запрос - проба этого не понадобилась
+            breaker.release_probe()
+    if task is None:
+        task = asyncio.create_task(_fetch_media_task(key, download_url, cookiefile, is_premium))
+        inflight_downloads[key] = task
+    else:
+        metrics.cache_hit("download_inflight")
+        logging.info(f"⏳ Загрузка {key} уже выполняется, ждем ее результат")
+    # shield: таймаут одного ожидающего не отменяет загрузку для остальных
+    return await asyncio.shield(task)
+
+# === Метрики, читаемые при запросе /metrics ===
+def _queue_depths():
+    depths = {
+        ("download_premium",): state_backend.queue_size(PREMIUM_QUEUE),
+        ("download_regular",): state_backend.queue_size(REGULAR_QUEUE),
+        ("updates",): update_executor.pending,
+    }
+    if DOWNLOAD_WORKERS_ENABLED:
+        depths[("download_jobs",)] = download_jobs.stats()["queued"]
+    return depths
+
+register_gauge("musicbot_queue_depth", "Глубина очередей по классам", _queue_depths, ("queue",))
+register_gauge("musicbot_active_downloads", "Загрузки, выполняемые сейчас", lambda: active_downloads)
+register_gauge("musicbot_file_cache_bytes", "Размер файлового кэша (папка cache)",
+               lambda: metrics.directory_bytes(CACHE_DIR))
+register_gauge("musicbot_search_cache_entries", "Записей в кэше поиска", lambda: len(search_cache))
+register_gauge("musicbot_disk_quota_used_bytes", "Байты cache по классам владельцев",
+               lambda: {(owner,): size for owner, size in disk_quota.bytes_by_owner.items()}, ("owner",))
+register_gauge("musicbot_disk_quota_bytes", "Квота на папку cache", lambda: disk_quota.quota_bytes)
+register_gauge("musicbot_disk_free_bytes", "Свободное место на диске с cache", lambda: disk_quota.free_disk_bytes() or 0)
+register_gauge("musicbot_disk_pressure", "1 - новые загрузки приостановлены из-за нехватки места",
+               lambda: int(disk_quota.under_pressure()))
 
 async def download_track_from_url(user_id, url):
     """
@@ -1803,14 +1938,10 @@ async def download_track_from_url(user_id, url):
         is_soundcloud = 'soundcloud.com' in url.lower()
         source_text = "SoundCloud" if is_soundcloud else "YouTube"
         
-        outtmpl = os.path.join(CACHE_DIR, '%(title)s.%(ext)s')
+        url = canonical_url(url) or url
         logging.info(f"🎵 Начинаю загрузку трека с {source_text} для пользователя {user_id}: {url}")
         
-        # Используем Semaphore для ограничения одновременных загрузок
-        async with download_semaphore:
-            # выполнить blocking ytdl в пуле потоков через ThreadPoolExecutor
-            loop = asyncio.get_running_loop()
-            fn_info = await loop.run_in_executor(yt_executor, _ydl_download_blocking, url, outtmpl, COOKIES_FILE)
+        fn_info = await fetch_media(url, COOKIES_FILE)
             
         if not fn_info:
             logging.error(f"🌨️ Не удалось получить информацию о треке с {source_text}: {url}")
@@ -1840,17 +1971,16 @@ async def download_track_from_url(user_id, url):
             "original_url": url,  # Сохраняем оригинальную ссылку для возможности перезагрузки
             "size_mb": round(size_mb, 2),
             "needs_migration": False,
-            "source": "sc" if is_soundcloud else "yt"  # Добавляем информацию об источнике
+            "source": "sc" if is_soundcloud else "yt",  # Добавляем информацию об источнике
+            **track_fields(track_metadata.lookup(filename)),  # Длительность, исполнитель, обложка
         }
         
-        # Инициализируем список треков для пользователя, если его нет
-        if str(user_id) not in user_tracks:
-            user_tracks[str(user_id)] = []
-        elif user_tracks[str(user_id)] is None:
-            user_tracks[str(user_id)] = []
-            
-        user_tracks[str(user_id)].append(track_info)
+        # Добавляем трек атомарно: одновременное добавление в другом процессе не потеряется
+        user_tracks.mutate(str(user_id), lambda tracks: (tracks or []) + [track_info])
+        collection_keyboards.bump(user_id)
         save_tracks()
+        track_index.add_collection_track(track_info)
+        note_collection_file(user_id, filename)
         
         logging.info(f"🎵 Трек с {source_text} успешно добавлен в коллекцию пользователя {user_id}: {filename} ({size_mb:.2f}MB)")
         return filename
@@ -1875,30 +2005,27 @@ async def download_track_from_url_for_genre(user_id, url):
             logging.warning("🐻‍❄️ download_track_from_url_for_genre: user_tracks был None, инициализируем")
             user_tracks = {}
         
-        outtmpl = os.path.join(CACHE_DIR, '%(title)s.%(ext)s')
-        
         # Проверяем премиум статус пользователя
         is_premium = is_premium_user(str(user_id))
         quality_text = "320 kbps" if is_premium else "192 kbps"
         
         logging.info(f"💾 Начинаю загрузку трека по жанру для пользователя {user_id}: {url} (качество: {quality_text})")
         
+        # youtu.be/…, /shorts/… и music.youtube.com/… - к каноническому виду, от него зависят и cookies
+        url = canonical_url(url) or url
+        
         # Проверяем, что URL валидный (поддерживаем YouTube и SoundCloud)
         if not url or ('youtube.com' not in url and 'soundcloud.com' not in url):
             logging.error(f"🌨️ Неверный URL для загрузки: {url}")
             return None
         
-        # Используем Semaphore для ограничения одновременных загрузок
-        async with download_semaphore:
-            # выполнить blocking ytdl в пуле потоков через ThreadPoolExecutor
-            try:
-                loop = asyncio.get_running_loop()
-                # Для SoundCloud cookies не нужны, для YouTube используем cookies
-                cookies_file = COOKIES_FILE if 'youtube.com' in url and os.path.exists(COOKIES_FILE) else None
-                fn_info = await loop.run_in_executor(yt_executor, _ydl_download_blocking, url, outtmpl, cookies_file, is_premium)
-            except Exception as ytdl_error:
-                logging.error(f"🌨️ Ошибка yt-dlp для {url}: {ytdl_error}")
-                return None
+        try:
+            # Для SoundCloud cookies не нужны, для YouTube используем cookies
+            cookies_file = COOKIES_FILE if 'youtube.com' in url and os.path.exists(COOKIES_FILE) else None
+            fn_info = await fetch_media(url, cookies_file, is_premium)
+        except Exception as ytdl_error:
+            logging.error(f"🌨️ Ошибка yt-dlp для {url}: {ytdl_error}")
+            return None
             
         if not fn_info:
             logging.error(f"🌨️ Не удалось получить информацию о треке: {url}")
@@ -1994,12 +2121,6 @@ async def back_to_main_menu(callback: types.CallbackQuery):
     """Возвращает пользователя в главное меню"""
     user_id = str(callback.from_user.id)
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     logging.info(f"🔙 Пользователь {user_id} возвращается в главное меню")
     
     try:
@@ -2042,12 +2163,6 @@ async def show_premium_menu(callback: types.CallbackQuery):
     user_id = str(callback.from_user.id)
     username = callback.from_user.username
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     if not is_premium_user(user_id, username):
         # Отправляем изображение мишки с сообщением об ограниченном доступе
         try:
@@ -2088,12 +2203,6 @@ async def show_genres(callback: types.CallbackQuery):
     user_id = str(callback.from_user.id)
     username = callback.from_user.username
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     # Проверяем премиум статус
     if not is_premium_user(user_id, username):
         # Отправляем изображение мишки с сообщением об ограниченном доступе
@@ -2156,12 +2265,6 @@ async def show_artist_search(callback: types.CallbackQuery, state: FSMContext):
     user_id = str(callback.from_user.id)
     username = callback.from_user.username
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     # Проверяем премиум статус
     if not is_premium_user(user_id, username):
         # Отправляем изображение мишки с сообщением об ограниченном доступе
@@ -2207,15 +2310,6 @@ async def show_buy_premium_info(callback: types.CallbackQuery):
     # Добавляем логирование для отладки
     logging.info(f"🔍 Нажата кнопка 'Купить премиум' пользователем {user_id} ({username})")
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        logging.warning(f"⏳ Антиспам блокирует пользователя {user_id}")
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
-    logging.info(f"✅ Антиспам проверка пройдена для пользователя {user_id}")
-    
     # Проверяем, не является ли пользователь уже премиум
     logging.info(f"🔍 Проверяем премиум статус для пользователя {user_id}")
     is_premium = is_premium_user(user_id, username)
@@ -2305,12 +2399,6 @@ async def pay_premium_yoomoney(callback: types.CallbackQuery):
     user_id = str(callback.from_user.id)
     username = callback.from_user.username
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     # Добавляем логирование для отладки
     logging.info(f"🐻‍❄️ Нажата кнопка 'Оплатить через YooMoney' пользователем {user_id} ({username})")
     
@@ -2394,12 +2482,6 @@ async def pay_premium_direct(callback: types.CallbackQuery):
     user_id = str(callback.from_user.id)
     username = callback.from_user.username
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     # Добавляем логирование для отладки
     logging.info(f"🐻‍❄️ Нажата кнопка '🧊 Оплатить 1 USDT' пользователем {user_id} ({username})")
     
@@ -2483,14 +2565,6 @@ async def pay_premium_direct(callback: types.CallbackQuery):
 
 @dp.callback_query(F.data == "back_to_premium")
 async def back_to_premium_menu(callback: types.CallbackQuery):
-    user_id = str(callback.from_user.id)
-    
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.message.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     try:
         await callback.message.edit_media(
             media=types.InputMediaPhoto(
@@ -2534,14 +2608,6 @@ async def back_to_premium_menu(callback: types.CallbackQuery):
 @dp.callback_query(F.data == "back_to_buy_premium")
 async def back_to_buy_premium_callback(callback: types.CallbackQuery):
     """Возврат к разделу 'Купить премиум' из оплаты YooMoney"""
-    user_id = str(callback.from_user.id)
-    
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     try:
         await callback.message.edit_media(
             media=types.InputMediaPhoto(
@@ -2590,14 +2656,6 @@ async def back_to_buy_premium_callback(callback: types.CallbackQuery):
 @dp.callback_query(F.data == "back_to_main_from_buy_premium")
 async def back_to_main_from_buy_premium_callback(callback: types.CallbackQuery):
     """Возврат в главное меню из inline клавиатуры оплаты"""
-    user_id = str(callback.from_user.id)
-    
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     try:
         await callback.message.edit_media(
             media=types.InputMediaPhoto(
@@ -2704,14 +2762,6 @@ async def remove_premium_command(message: types.Message):
 # === Поиск ===
 @dp.callback_query(F.data == "find_track")
 async def ask_track_name(callback: types.CallbackQuery, state: FSMContext):
-    user_id = str(callback.from_user.id)
-    
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     # Отправляем изображение мишки с запросом названия трека
     try:
         await callback.message.edit_media(
@@ -2732,14 +2782,6 @@ async def ask_track_name(callback: types.CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data == "back_to_main")
 async def back_from_track_search_handler(callback: types.CallbackQuery, state: FSMContext):
     """Возврат из поиска трека в главное меню"""
-    user_id = str(callback.from_user.id)
-    
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     await state.clear()
     # Отправляем изображение мишки без текста, только с меню
     try:
@@ -2773,58 +2815,32 @@ async def search_music(message: types.Message, state: FSMContext):
         await message.answer("❄️ Пожалуйста, введите название песни или ссылку.", reply_markup=main_menu)
         return
 
-    yt_url_pattern = r"(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+"
-    if re.match(yt_url_pattern, query):
+    # Ссылки на трек (youtu.be, music.youtube.com, /shorts/, SoundCloud) приводим к каноническому виду
+    media_url = canonical_url(query)
+    if media_url:
         # асинхронно скачиваем в background (не блокируем основной цикл)
-        asyncio.create_task(download_track_from_url(message.from_user.id, query))
+        asyncio.create_task(download_track_from_url(message.from_user.id, media_url))
         return await message.answer("❄️ Запущена загрузка трека. Он появится в «Моя музыка» когда будет готов.", reply_markup=main_menu)
 
     search_msg = await message.answer("🔍 Поиск..")
 
+    await search_cache.prefetch(normalize_query(query, SEARCH_CACHE_TRANSLITERATE))
     cached = get_cached_search(query)
     if cached:
         # Удаляем сообщение "Поиск.." если используем кэш
         await search_msg.delete()
         return await send_search_results(message.chat.id, cached)
+    
+    # Отвечаем из локального индекса, если в нем достаточно уверенных совпадений
+    local_results = track_index.search(query, limit=5)
+    if local_results:
+        await search_msg.delete()
+        logging.info(f"🗂️ Локальный индекс: {len(local_results)} треков для '{query}'")
+        set_cached_search(query, local_results)
+        return await send_search_results(message.chat.id, local_results)
     try:
-        # Выполняем поиск на YouTube и SoundCloud параллельно
-        async def search_youtube(q):
-            try:
-                def search_block(q):
-                    try:
-                        ydl_opts = {
-                            'format': 'bestaudio/best',
-                            'noplaylist': True,
-                            'quiet': True,
-                            'no_warnings': True,
-                            'ignoreerrors': True,
-                            'extract_flat': True
-                        }
-                        
-                        # Проверяем существование cookies файла
-                        if os.path.exists(COOKIES_FILE):
-                            ydl_opts['cookiefile'] = COOKIES_FILE
-                            logging.info(f"🍪 Используем cookies файл: {COOKIES_FILE}")
-                        else:
-                            logging.warning("⚠️ Cookies файл не найден, поиск может быть ограничен")
-                        
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            result = ydl.extract_info(f"ytsearch5:{q}", download=False)
-                            if not result:
-                                logging.warning(f"⚠️ Пустой результат поиска YouTube для запроса: '{q}'")
-                                return None
-                            return result
-                    except Exception as search_error:
-                        logging.error(f"❌ Ошибка в search_block YouTube для запроса '{q}': {search_error}")
-                        return None
-                
-                return await asyncio.to_thread(search_block, q)
-            except Exception as e:
-                logging.error(f"❌ Ошибка поиска YouTube: {e}")
-                return None
-        
         # Запускаем поиск на обеих платформах параллельно
-        youtube_task = asyncio.create_task(search_youtube(query))
+        youtube_task = asyncio.create_task(search_youtube(query, 5))
         soundcloud_task = asyncio.create_task(search_soundcloud(query))
         
         # Ждем результаты от обеих платформ
@@ -2837,19 +2853,17 @@ async def search_music(message: types.Message, state: FSMContext):
         if isinstance(youtube_info, Exception):
             logging.error(f"❌ Ошибка поиска YouTube: {youtube_info}")
         elif youtube_info:
-            results = youtube_info.get("entries", [])
-            if results:
-                # Фильтруем невалидные результаты и треки длиннее 10 минут
-                for result in results:
-                    if result and result.get('id') and result.get('title'):
-                        # Проверяем длительность трека
-                        duration = result.get('duration', 0)
-                        if duration and duration > 600:  # 600 секунд = 10 минут
-                            logging.info(f"⏱️ Пропускаем YouTube трек '{result.get('title')}' - длительность {duration} сек (> 10 мин)")
-                            continue
-                        # Добавляем источник
-                        result['source'] = 'yt'
-                        youtube_results.append(result)
+            # Фильтруем невалидные результаты и треки длиннее 10 минут
+            for result in youtube_info:
+                if result and result.get('id') and result.get('title'):
+                    # Проверяем длительность трека
+                    duration = result.get('duration', 0)
+                    if duration and duration > 600:  # 600 секунд = 10 минут
+                        logging.info(f"⏱️ Пропускаем YouTube трек '{result.get('title')}' - длительность {duration} сек (> 10 мин)")
+                        continue
+                    # Добавляем источник
+                    result['source'] = 'yt'
+                    youtube_results.append(result)
         
         # Обрабатываем результаты SoundCloud
         soundcloud_processed = []
@@ -2927,7 +2941,7 @@ async def search_by_artist_input(message: types.Message, state: FSMContext):
 
     try:
                 # Ищем треки исполнителя
-        results = await asyncio.to_thread(search_artist_tracks, artist_name, 10)
+        results = await search_artist_tracks(artist_name, 10)
         
         if not results:
             try:
@@ -3052,12 +3066,12 @@ async def search_by_artist_input(message: types.Message, state: FSMContext):
 
                     # Отправляем аудиофайл
                     try:
-                        await message.answer_audio(
-                            types.FSInputFile(filename),
-                            title=track.get('title', 'Без названия'),
-                            performer=artist_name,
-                            duration=track.get('duration', 0)
-                        )
+                        with sending_file(filename):
+                            await message.answer_audio(
+                                types.FSInputFile(filename),
+                                **audio_kwargs(track_metadata.lookup(filename), title=track.get('title', 'Без названия'),
+                                               performer=artist_name, duration=track.get('duration', 0))
+                            )
                         logging.info(f"✅ Аудиофайл отправлен: {track.get('title', 'Без названия')}")
                         
                         # Планируем автоматическую очистку файла после отправки
@@ -3068,9 +3082,10 @@ async def search_by_artist_input(message: types.Message, state: FSMContext):
                         logging.error(f"❌ Ошибка отправки аудиофайла {track.get('title', 'Без названия')}: {audio_error}")
                         # Если не удалось отправить как аудио, отправляем как документ
                         try:
-                            await message.answer_document(
-                                types.FSInputFile(filename)
-                            )
+                            with sending_file(filename):
+                                await message.answer_document(
+                                    types.FSInputFile(filename)
+                                )
                             logging.info(f"✅ Файл отправлен как документ: {track.get('title', 'Без названия')}")
                             
                             # Планируем автоматическую очистку файла после отправки
@@ -3165,9 +3180,7 @@ async def search_by_artist_input(message: types.Message, state: FSMContext):
 
 async def send_search_results(chat_id, results):
     try:
-        logging.info(f"🔍 send_search_results: начало обработки для чата {chat_id}")
-        logging.info(f"🔍 send_search_results: получены результаты: {results}")
-        logging.info(f"🔍 send_search_results: тип результатов: {type(results)}")
+        events.debug("search_results_start", chat_id=chat_id, results=results)
         
         # Проверяем входные параметры
         if not results or not isinstance(results, list):
@@ -3175,37 +3188,27 @@ async def send_search_results(chat_id, results):
             await bot.send_message(chat_id, "❌ Ошибка отображения результатов поиска.", reply_markup=main_menu)
             return
         
-        logging.info(f"🔍 send_search_results: результаты прошли проверку, начинаем фильтрацию")
-        
         # Фильтруем валидные результаты
         valid_results = []
         for i, video in enumerate(results[:5]):  # Берем только первые 5 результатов
-            logging.info(f"🔍 send_search_results: обработка видео {i+1}: {video}")
-            
             # Проверяем, является ли это результатом SoundCloud
             if video and isinstance(video, dict) and video.get('source') == 'sc':
                 # SoundCloud результат
                 if video.get('url') and video.get('title'):
                     valid_results.append(video)
-                    logging.info(f"🔍 send_search_results: SoundCloud трек {i+1} добавлен в валидные")
                 else:
-                    logging.warning(f"⚠️ send_search_results: SoundCloud трек {i+1} не прошел валидацию: {video}")
+                    events.warning("search_result_invalid", chat_id=chat_id, index=i + 1, result=video)
             elif video and isinstance(video, dict) and video.get('id') and video.get('title'):
                 # YouTube результат
                 valid_results.append(video)
-                logging.info(f"🔍 send_search_results: YouTube видео {i+1} добавлено в валидные")
             else:
-                logging.warning(f"⚠️ send_search_results: результат {i+1} не прошел валидацию: {video}")
-        
-        logging.info(f"🔍 send_search_results: найдено валидных результатов: {len(valid_results)}")
+                events.warning("search_result_invalid", chat_id=chat_id, index=i + 1, result=video)
         
         if not valid_results:
             logging.warning(f"⚠️ send_search_results: нет валидных результатов для чата {chat_id}")
             await bot.send_message(chat_id, "❌ Не найдено подходящих треков для скачивания.", reply_markup=main_menu)
             return
         
-        logging.info(f"🔍 send_search_results: начинаем создание клавиатуры")
-        
         # Создаем клавиатуру
         keyboard = []
         for i, video in enumerate(valid_results):
@@ -3220,8 +3223,6 @@ async def send_search_results(chat_id, results):
                 logging.warning(f"⚠️ send_search_results: ошибка форматирования длительности: {dur_error}")
                 duration_text = "??:??"
             
-            logging.info(f"🔍 send_search_results: создание кнопки {i+1}: title='{title}', duration={duration}, duration_text='{duration_text}', source='{source}'")
-            
             # Формируем текст кнопки с названием и длительностью
             if duration and duration > 0:
                 button_text = f"{title[:45]}... ⏱ {duration_text}" if len(title) > 45 else f"{title} ⏱ {duration_text}"
@@ -3232,7 +3233,7 @@ async def send_search_results(chat_id, results):
             if source == 'sc':
                 button_text += " 🎵"
             
-            logging.info(f"🔍 send_search_results: текст кнопки {i+1}: '{button_text}'")
+            events.debug("search_result_button", chat_id=chat_id, index=i + 1, source=source, text=button_text)
             
             # Создаем callback_data в зависимости от источника
             if source == 'sc':
@@ -3256,8 +3257,6 @@ async def send_search_results(chat_id, results):
         # Добавляем кнопку "назад" для возврата в главное меню
         keyboard.append([InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_main")])
         
-        logging.info(f"🔍 send_search_results: клавиатура создана, отправляем сообщение")
-        
         # Отправляем результаты с минимальным текстом (Telegram не позволяет пустые сообщения)
         await bot.send_message(
             chat_id, 
@@ -3265,12 +3264,11 @@ async def send_search_results(chat_id, results):
             reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
         )
         
-        logging.info(f"✅ Результаты поиска успешно отправлены в чат {chat_id}: {len(valid_results)} треков")
+        events.info("search_results_sent", chat_id=chat_id, count=len(valid_results),
+                    sources=[video.get("source", "yt") for video in valid_results])
         
     except Exception as e:
-        logging.error(f"❌ Ошибка в send_search_results для чата {chat_id}: {e}")
-        logging.error(f"❌ Детали ошибки: results={results}, type={type(results)}")
-        logging.error(f"❌ Полный traceback ошибки:", exc_info=True)
+        events.error("search_results_failed", chat_id=chat_id, error=e, results=results, exc_info=True)
         try:
             await bot.send_message(chat_id, "❌ Произошла ошибка при отображении результатов поиска.", reply_markup=main_menu)
         except Exception as send_error:
@@ -3280,16 +3278,10 @@ async def send_search_results(chat_id, results):
 
 # === Callback: скачивание выбранного из поиска ===
 @dp.callback_query(F.data.startswith("dl:"))
-async def download_track(callback: types.CallbackQuery):
+async def download_track(callback: types.CallbackQuery, user_context: UserContext):
     try:
         user_id = str(callback.from_user.id)
         
-        # Проверяем антиспам
-        is_allowed, time_until = check_antispam(user_id)
-        if not is_allowed:
-            await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-            return
-        
         video_id = callback.data.split(":")[1]
         
         # Проверяем валидность video_id
@@ -3300,7 +3292,7 @@ async def download_track(callback: types.CallbackQuery):
         url = f"https://www.youtube.com/watch?v={video_id}"
         
         # Проверяем премиум статус пользователя
-        is_premium = is_premium_user(user_id, callback.from_user.username)
+        is_premium = user_context.is_premium
         
         # Добавляем задачу в соответствующую очередь
         priority = 0 if is_premium else 1  # Премиум пользователи имеют приоритет 0 (выше)
@@ -3318,17 +3310,11 @@ async def download_track(callback: types.CallbackQuery):
 
 # === Callback: скачивание SoundCloud трека из общего поиска ===
 @dp.callback_query(F.data.startswith("dl_sc:"))
-async def download_soundcloud_from_search(callback: types.CallbackQuery):
+async def download_soundcloud_from_search(callback: types.CallbackQuery, user_context: UserContext):
     """Скачивает SoundCloud трек из общего поиска (как YouTube)"""
     try:
         user_id = str(callback.from_user.id)
         
-        # Проверяем антиспам
-        is_allowed, time_until = check_antispam(user_id)
-        if not is_allowed:
-            await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-            return
-        
         # Извлекаем URL после "dl_sc:" и декодируем его
         encoded_url = callback.data[6:]  # Убираем "dl_sc:" в начале
         
@@ -3342,7 +3328,7 @@ async def download_soundcloud_from_search(callback: types.CallbackQuery):
         logging.info(f"🎵 Пользователь {user_id} скачивает SoundCloud трек из поиска: {url}")
         
         # Проверяем премиум статус пользователя
-        is_premium = is_premium_user(user_id, callback.from_user.username)
+        is_premium = user_context.is_premium
         
         # Добавляем задачу в соответствующую очередь
         priority = 0 if is_premium else 1  # Премиум пользователи имеют приоритет 0 (выше)
@@ -3481,18 +3467,22 @@ def build_tracks_keyboard(tracks, page=0, owner_for_buttons=None):
             [InlineKeyboardButton(text="⬅ Назад", callback_data="back_to_main")]
         ])
 
+def tracks_page_keyboard(user_id, tracks, page=0):
+    """Клавиатура страницы своей коллекции: готовая, если коллекция не менялась"""
+    tracks = tracks if isinstance(tracks, list) else []
+    total_pages = (len(tracks) + PAGE_SIZE - 1) // PAGE_SIZE
+    # Та же страница, что отрисует build_tracks_keyboard (некорректная - первая)
+    shown = page if 0 <= page < max(total_pages, 1) else 0
+    fingerprint = collection_keyboards.fingerprint(tracks, shown * PAGE_SIZE, (shown + 1) * PAGE_SIZE)
+    return collection_keyboards.page(user_id, page, partial(build_tracks_keyboard, tracks, page=page),
+                                     fingerprint=fingerprint)
+
 # === Моя музыка (показ первой страницы) ===
 @dp.callback_query(F.data == "my_music")
 async def my_music(callback: types.CallbackQuery):
     global user_tracks
     user_id = str(callback.from_user.id)
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     # Проверяем, что user_tracks не None
     if user_tracks is None:
         user_tracks = {}
@@ -3522,7 +3512,7 @@ async def my_music(callback: types.CallbackQuery):
         return
         
     try:
-        kb = build_tracks_keyboard(tracks, page=0, owner_for_buttons=None)
+        kb = tracks_page_keyboard(user_id, tracks, page=0)
         # Отправляем изображение мишки с информацией о треках
         try:
             await callback.message.edit_media(
@@ -3546,12 +3536,6 @@ async def music_page_cb(callback: types.CallbackQuery):
     try:
         user_id = str(callback.from_user.id)
         
-        # Проверяем антиспам
-        is_allowed, time_until = check_antispam(user_id)
-        if not is_allowed:
-            await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-            return
-        
         page = int(callback.data.split(":")[1])
         
         # Проверяем, что user_tracks не None
@@ -3579,7 +3563,7 @@ async def music_page_cb(callback: types.CallbackQuery):
             logging.warning(f"⚠️ Некорректная страница {page} для пользователя {user_id}, перенаправляем на страницу 0")
             page = 0
         
-        kb = build_tracks_keyboard(tracks, page=page, owner_for_buttons=None)
+        kb = tracks_page_keyboard(user_id, tracks, page=page)
         # Обновляем изображение мишки с новой страницей треков
         try:
             await callback.message.edit_media(
@@ -3606,12 +3590,6 @@ async def for_you_recommendations(callback: types.CallbackQuery):
     """Показывает рекомендуемые треки для пользователя"""
     user_id = str(callback.from_user.id)
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     try:
         # Отправляем сообщение "Пожалуйста, подождите..."
         await callback.message.edit_media(
@@ -3715,12 +3693,12 @@ async def for_you_recommendations(callback: types.CallbackQuery):
 
                     # Отправляем аудиофайл
                     try:
-                        await callback.message.answer_audio(
-                            types.FSInputFile(filename),
-                            title=track.get('title', 'Без названия'),
-                            performer="SoundCloud",
-                            duration=track.get('duration', 0)
-                        )
+                        with sending_file(filename):
+                            await callback.message.answer_audio(
+                                types.FSInputFile(filename),
+                                **audio_kwargs(track_metadata.lookup(filename), title=track.get('title', 'Без названия'),
+                                               performer="SoundCloud", duration=track.get('duration', 0))
+                            )
                         logging.info(f"✅ Рекомендуемый аудиофайл отправлен: {track.get('title', 'Без названия')}")
                         
                         # Планируем автоматическую очистку файла после отправки
@@ -3730,9 +3708,10 @@ async def for_you_recommendations(callback: types.CallbackQuery):
                         logging.error(f"❌ Ошибка отправки аудиофайла {track.get('title', 'Без названия')}: {audio_error}")
                         # Если не удалось отправить как аудио, отправляем как документ
                         try:
-                            await callback.message.answer_document(
-                                types.FSInputFile(filename)
-                            )
+                            with sending_file(filename):
+                                await callback.message.answer_document(
+                                    types.FSInputFile(filename)
+                                )
                             logging.info(f"✅ Рекомендуемый файл отправлен как документ: {track.get('title', 'Без названия')}")
                             
                             # Планируем автоматическую очистку файла после отправки
@@ -3786,17 +3765,11 @@ async def for_you_recommendations(callback: types.CallbackQuery):
 
 # === Callback: play / play_shared ===
 @dp.callback_query(F.data.startswith("play:"))
-async def play_track(callback: types.CallbackQuery):
+async def play_track(callback: types.CallbackQuery, user_context: UserContext):
     global user_tracks
     try:
         user_id = str(callback.from_user.id)
         
-        # Проверяем антиспам
-        is_allowed, time_until = check_antispam(user_id)
-        if not is_allowed:
-            await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-            return
-        
         idx = int(callback.data.split(":")[1])
         
         # Проверяем, что user_tracks не None
@@ -3834,13 +3807,15 @@ async def play_track(callback: types.CallbackQuery):
             
             # Проверяем премиум статус пользователя
             user_id_str = str(user_id)
-            is_premium = is_premium_user(user_id_str, callback.from_user.username)
+            is_premium = user_context.is_premium
             
             if is_premium:
                 # Премиум: проверяем существование файла и отправляем
                 if os.path.exists(file_path):
                     try:
-                        await callback.message.answer_audio(types.FSInputFile(file_path), title=title)
+                        disk_quota.touch(file_path)
+                        with sending_file(file_path):
+                            await callback.message.answer_audio(types.FSInputFile(file_path), **audio_kwargs(track, title=title))
                         logging.info(f"✅ Трек воспроизведен: {title} для премиум пользователя {user_id}")
                         
                         # Планируем автоматическую очистку файла после отправки
@@ -3868,12 +3843,15 @@ async def play_track(callback: types.CallbackQuery):
                         if download_result:
                             # Трек успешно загружен, отправляем пользователю
                             try:
-                                await callback.message.answer_audio(types.FSInputFile(download_result), title=title)
+                                with sending_file(download_result):
+                                    await callback.message.answer_audio(
+                                        types.FSInputFile(download_result),
+                                        **audio_kwargs(track_metadata.lookup(download_result) or track, title=title))
                                 logging.info(f"✅ Трек отправлен бесплатному пользователю: {title}")
                                 
                                 # Сразу удаляем файл для бесплатного пользователя
                                 try:
-                                    os.remove(download_result)
+                                    drop_download(download_result, 0)
                                     logging.info(f"🧹 Файл сразу удален для бесплатного пользователя: {download_result}")
                                 except Exception as cleanup_error:
                                     logging.error(f"❌ Ошибка при удалении файла {download_result}: {cleanup_error}")
@@ -3918,17 +3896,11 @@ async def play_track(callback: types.CallbackQuery):
 
 # === Callback: download all (self) ===
 @dp.callback_query(F.data == "download_all")
-async def download_all_tracks(callback: types.CallbackQuery):
+async def download_all_tracks(callback: types.CallbackQuery, user_context: UserContext):
     global user_tracks
     try:
         user_id = str(callback.from_user.id)
         
-        # Проверяем антиспам
-        is_allowed, time_until = check_antispam(user_id)
-        if not is_allowed:
-            await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-            return
-        
         # Проверяем, что user_tracks не None
         if user_tracks is None:
             user_tracks = {}
@@ -3979,13 +3951,16 @@ async def download_all_tracks(callback: types.CallbackQuery):
                 
                 # Проверяем премиум статус пользователя
                 user_id_str = str(callback.from_user.id)
-                is_premium = is_premium_user(user_id_str, callback.from_user.username)
+                is_premium = user_context.is_premium
                 
                 if is_premium:
                     # Премиум: проверяем существование файла и отправляем
                     if os.path.exists(file_path):
                         try:
-                            await callback.message.answer_audio(types.FSInputFile(file_path), title=title)
+                            with sending_file(file_path):
+                                await callback.message.answer_audio(
+                                    types.FSInputFile(file_path),
+                                    **audio_kwargs(track if isinstance(track, dict) else None, title=title))
                             success_count += 1
                             logging.info(f"💎 Файл отправлен для премиум пользователя: {file_path}")
                             await asyncio.sleep(0.4)
@@ -4007,12 +3982,16 @@ async def download_all_tracks(callback: types.CallbackQuery):
                             if download_result:
                                 # Трек успешно загружен, отправляем пользователю
                                 try:
-                                    await callback.message.answer_audio(types.FSInputFile(download_result), title=title)
+                                    with sending_file(download_result):
+                                        await callback.message.answer_audio(
+                                            types.FSInputFile(download_result),
+                                            **audio_kwargs(track_metadata.lookup(download_result)
+                                                           or (track if isinstance(track, dict) else None), title=title))
                                     success_count += 1
                                     
                                     # Сразу удаляем файл для бесплатного пользователя
                                     try:
-                                        os.remove(download_result)
+                                        drop_download(download_result, 0)
                                         logging.info(f"🧹 Файл сразу удален для бесплатного пользователя: {download_result}")
                                     except Exception as cleanup_error:
                                         logging.error(f"❌ Ошибка при удалении файла {download_result}: {cleanup_error}")
@@ -4053,16 +4032,7 @@ async def delete_track(callback: types.CallbackQuery):
     try:
         user_id = str(callback.from_user.id)
         
-        logging.info(f"🔍 === НАЧАЛО УДАЛЕНИЯ ТРЕКА ===")
-        logging.info(f"🔍 Пользователь: {user_id}")
-        logging.info(f"🔍 Индекс трека: {callback.data}")
-        logging.info(f"🔍 Глобальный user_tracks до удаления: {user_tracks}")
-        
-        # Проверяем антиспам
-        is_allowed, time_until = check_antispam(user_id)
-        if not is_allowed:
-            await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-            return
+        events.debug("track_delete_start", user_id=user_id, data=callback.data)
         
         idx = int(callback.data.split(":")[1])
         
@@ -4095,29 +4065,26 @@ async def delete_track(callback: types.CallbackQuery):
             file_path = track
             title = os.path.basename(track)
         
-        # Удаляем файл с диска, если он существует
-        if file_path and os.path.exists(file_path):
+        # Коллекция отпускает файл: с диска он удаляется, если его больше никто не держит
+        if file_path:
             try:
-                os.remove(file_path)
-                logging.info(f"✅ Удален файл: {file_path}")
+                file_refs.release(file_path, collection_holder(user_id), 0)
             except Exception as e:
                 logging.error(f"❌ Ошибка удаления файла {file_path}: {e}")
                 # Не прерываем удаление трека из списка, даже если файл не удалился
         
-        # Удаляем трек из списка (независимо от того, удалился ли файл)
-        tracks.pop(idx)
-        # Обновляем глобальный user_tracks
-        user_tracks[user_id] = tracks
-        save_tracks()
-        logging.info(f"✅ Трек удален из списка: {title}")
-        logging.info(f"🔍 После удаления: всего треков у пользователя {user_id}: {len(tracks)}")
-        logging.info(f"🔍 Обновленный user_tracks для пользователя {user_id}: {user_tracks.get(user_id, [])}")
-        logging.info(f"🔍 Глобальный user_tracks после обновления: {user_tracks}")
-        
-        # Проверяем, что изменения сохранились
-        if save_tracks():
-            logging.info(f"✅ Треки успешно сохранены в файл")
-        else:
+        # Удаляем трек из списка (независимо от того, удалился ли файл). Список читается
+        # заново в той же атомарной операции: трек, добавленный тем временем, не пропадет
+        def without_track(current):
+            current = list(current or [])
+            if track in current:
+                current.remove(track)
+            return current
+        tracks = user_tracks.mutate(user_id, without_track)
+        collection_keyboards.bump(user_id)
+        saved = save_tracks()
+        events.info("track_deleted", user_id=user_id, index=idx, title=title, remaining=len(tracks), saved=saved)
+        if not saved:
             logging.error(f"❌ Ошибка сохранения треков в файл")
         
         # Обновляем интерфейс
@@ -4148,7 +4115,7 @@ async def delete_track(callback: types.CallbackQuery):
             
             try:
                 logging.info(f"🔍 Создаем клавиатуру для страницы {current_page+1}, треков: {len(tracks)}")
-                kb = build_tracks_keyboard(tracks, page=current_page, owner_for_buttons=None)
+                kb = tracks_page_keyboard(user_id, tracks, page=current_page)
                 
                 # Проверяем, что клавиатура создана корректно
                 if not kb:
@@ -4157,7 +4124,7 @@ async def delete_track(callback: types.CallbackQuery):
                     if current_page > 0:
                         current_page = current_page - 1
                         logging.info(f"🔍 Переходим на предыдущую страницу: {current_page+1}")
-                        kb = build_tracks_keyboard(tracks, page=current_page, owner_for_buttons=None)
+                        kb = tracks_page_keyboard(user_id, tracks, page=current_page)
                 
                 # Обновляем изображение мишки с новой страницей треков
                 try:
@@ -4177,10 +4144,6 @@ async def delete_track(callback: types.CallbackQuery):
         
         await callback.answer("✅ Трек удален.")
         
-        logging.info(f"🔍 === КОНЕЦ УДАЛЕНИЯ ТРЕКА ===")
-        logging.info(f"🔍 Финальный user_tracks: {user_tracks}")
-        logging.info(f"🔍 Треки пользователя {user_id}: {user_tracks.get(user_id, [])}")
-        
     except ValueError as e:
         logging.error(f"❌ Ошибка парсинга индекса трека: {e}")
         await callback.answer("❌ Ошибка индекса трека.", show_alert=True)
@@ -4616,7 +4579,47 @@ def get_genres():
         ]
     }
 
-def search_genre_tracks(genre_queries, limit=20):
+# Слова в названии, по которым отсеиваем сборники, нарезки, обзоры и т.п.
+GENRE_EXCLUDED_WORDS = (
+    'mix', 'compilation', 'collection', 'best of', 'greatest hits', 'remix', 'cover',
+    'karaoke', 'instrumental',
+    'live', 'concert', 'performance',  # Избегаем живых выступлений
+    # Исключаем обзоры, интервью, документалки
+    'review', 'interview', 'documentary', 'analysis', 'reaction', 'commentary',
+    'podcast', 'news', 'behind the scenes', 'making of', 'studio session',
+)
+# В названии должно быть хотя бы одно музыкальное ключевое слово
+GENRE_MUSIC_KEYWORDS = (
+    'music', 'song', 'track', 'audio', 'beat', 'melody',
+    'rap', 'hip hop', 'pop', 'rock', 'jazz', 'blues',
+    'electronic', 'folk', 'country', 'reggae', 'alternative'
+)
+# Названия, которые выглядят как обзоры
+GENRE_REVIEW_PATTERNS = (
+    'vs ', 'versus', 'comparison', 'review', 'analysis',
+    'breakdown', 'explanation', 'tutorial', 'guide',
+    'how to', 'what is', 'why ', 'when ', 'where ',
+    'interview', 'podcast', 'news', 'update', 'announcement'
+)
+
+def is_valid_genre_track(result):
+    """Проверяет, что результат поиска похож на музыкальный трек, а не на сборник или обзор"""
+    if not result:
+        return False
+    
+    title = (result.get('title') or '').lower()
+    duration = result.get('duration', 0)
+    
+    return bool(
+        duration and 60 < duration < 600 and  # От 1 до 10 минут
+        result.get('id') and  # Убеждаемся, что есть ID видео
+        len(title) < 100 and  # Длинные названия обычно у обзоров
+        not any(word in title for word in GENRE_EXCLUDED_WORDS) and
+        any(keyword in title for keyword in GENRE_MUSIC_KEYWORDS) and
+        not any(pattern in title for pattern in GENRE_REVIEW_PATTERNS)
+    )
+
+async def search_genre_tracks(genre_queries, limit=20):
     """Ищет треки по жанру используя случайные поисковые запросы для разнообразия"""
     all_results = []
     
@@ -4651,144 +4654,51 @@ def search_genre_tracks(genre_queries, limit=20):
         
         for query in selected_queries:
             try:
-                # Пробуем разные стратегии поиска (более направленные на музыку)
+                # Пробуем разные стратегии поиска (более направленные на музыку): (запрос, количество)
                 search_strategies = [
-                    f"ytsearch3:{query} official audio",  # Ищем официальные аудио
-                    f"ytsearch3:{query} music",  # Ищем с ключевым словом "music"
-                    f"ytsearch3:{query}",  # Ищем 3 результата
-                    f"ytsearch5:{query}",  # Ищем 5 результатов
+                    (f"{query} official audio", 3),  # Ищем официальные аудио
+                    (f"{query} music", 3),  # Ищем с ключевым словом "music"
+                    (query, 3),  # Ищем 3 результата
+                    (query, 5),  # Ищем 5 результатов
                 ]
                 
                 # Если запрос сложный, добавляем упрощенные версии
                 if " - " in query:
                     artist, song = query.split(" - ", 1)
                     search_strategies.extend([
-                        f"ytsearch3:{artist} {song}",
-                        f"ytsearch3:{artist}",
-                        f"ytsearch3:{song}"
+                        (f"{artist} {song}", 3),
+                        (artist, 3),
+                        (song, 3)
                     ])
                 
                 query_success = False
                 
-                for strategy in search_strategies:
-                    if query_success:
-                        break
-                        
+                for strategy, strategy_limit in search_strategies:
                     try:
-                        # Выполняем поиск для каждого конкретного трека
-                        ydl_opts = {
-                            'format': 'bestaudio/best',
-                            'noplaylist': True,
-                            'quiet': True,
-                            'cookiefile': COOKIES_FILE if os.path.exists(COOKIES_FILE) else None,
-                            'extract_flat': True,  # Добавляем для более быстрого поиска
-                            'no_warnings': True,
-                            'ignoreerrors': True,  # Игнорируем ошибки для отдельных запросов
-                            'timeout': 30,  # Увеличиваем таймаут
-                            'retries': 3,  # Количество попыток
-                        }
+                        results = await search_youtube(strategy, strategy_limit)
                         
-                        # Проверяем cookies
-                        if os.path.exists(COOKIES_FILE):
-                            logging.info(f"🍪 Используем cookies файл: {COOKIES_FILE}")
-                        else:
-                            logging.warning("⚠️ Cookies файл не найден, поиск может быть ограничен")
+                        if not results:
+                            logging.warning(f"⚠️ Нет результатов для запроса '{query}' (стратегия: {strategy})")
+                            continue
                         
-                        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                            try:
-                                # Пробуем текущую стратегию
-                                info = ydl.extract_info(strategy, download=False)
-                                
-                                if not info:
-                                    logging.warning(f"⚠️ Пустой результат поиска для '{query}' (стратегия: {strategy})")
-                                    continue
-                                    
-                                results = info.get("entries", [])
-                                
-                                if results:
-                                    # Фильтруем результаты, чтобы избежать сборников и нарезок
-                                    valid_results = []
-                                    for result in results:
-                                        if not result:
-                                            continue
-                                            
-                                        title = result.get('title', '').lower()
-                                        duration = result.get('duration', 0)
-                                        video_id = result.get('id')
-                                        
-                                        # Улучшенная фильтрация для поиска только музыкальных треков
-                                        if (duration and duration > 60 and  # Трек должен быть длиннее 1 минуты
-                                            duration < 600 and  # И не слишком длинный (не более 10 минут)
-                                            video_id and  # Убеждаемся, что есть ID видео
-                                            # Исключаем сборники, нарезки, обзоры
-                                            'mix' not in title and 
-                                            'compilation' not in title and
-                                            'collection' not in title and
-                                            'best of' not in title and
-                                            'greatest hits' not in title and
-                                            'remix' not in title and
-                                            'cover' not in title and
-                                            'karaoke' not in title and
-                                            'instrumental' not in title and
-                                            'live' not in title and  # Избегаем живых выступлений
-                                            'concert' not in title and
-                                            'performance' not in title and
-                                            # Исключаем обзоры, интервью, документалки
-                                            'review' not in title and
-                                            'interview' not in title and
-                                            'documentary' not in title and
-                                            'analysis' not in title and
-                                            'reaction' not in title and
-                                            'commentary' not in title and
-                                            'podcast' not in title and
-                                            'news' not in title and
-                                            'behind the scenes' not in title and
-                                            'making of' not in title and
-                                            'studio session' not in title and
-                                            # Исключаем клипы с длинными названиями (обычно это обзоры)
-                                            len(title) < 100 and
-                                            # Проверяем, что в названии есть музыкальные ключевые слова
-                                            any(keyword in title for keyword in [
-                                                'music', 'song', 'track', 'audio', 'beat', 'melody',
-                                                'rap', 'hip hop', 'pop', 'rock', 'jazz', 'blues',
-                                                'electronic', 'folk', 'country', 'reggae', 'alternative'
-                                            ]) and
-                                            # Дополнительная проверка: исключаем названия, которые выглядят как обзоры
-                                            not any(pattern in title for pattern in [
-                                                'vs ', 'versus', 'comparison', 'review', 'analysis',
-                                                'breakdown', 'explanation', 'tutorial', 'guide',
-                                                'how to', 'what is', 'why ', 'when ', 'where ',
-                                                'interview', 'podcast', 'news', 'update', 'announcement'
-                                            ])):
-                                            
-                                            valid_results.append(result)
-                                    
-                                    # Добавляем случайное количество результатов (1-5) для большего разнообразия
-                                    if valid_results:
-                                        # Исправляем ошибку randrange - проверяем минимальное количество
-                                        min_count = min(2, len(valid_results))
-                                        max_count = min(5, len(valid_results))
-                                        
-                                        if min_count <= max_count:
-                                            num_to_add = random.randint(min_count, max_count)
-                                            selected_results = random.sample(valid_results, num_to_add)
-                                            all_results.extend(selected_results)
-                                            logging.info(f"✅ Добавлено {num_to_add} треков из запроса '{query}' (стратегия: {strategy})")
-                                            query_success = True
-                                            break
-                                        else:
-                                            logging.warning(f"⚠️ Недостаточно результатов для выбора: {len(valid_results)}")
-                                    else:
-                                        logging.warning(f"⚠️ Нет валидных результатов для '{query}' (стратегия: {strategy})")
-                                else:
-                                    logging.warning(f"⚠️ Нет результатов для запроса '{query}' (стратегия: {strategy})")
-                                    
-                            except Exception as search_error:
-                                logging.error(f"❌ Ошибка поиска для запроса '{query}' (стратегия: {strategy}): {search_error}")
-                                continue
-                                
-                    except Exception as e:
-                        logging.error(f"❌ Ошибка создания yt-dlp для запроса '{query}' (стратегия: {strategy}): {e}")
+                        # Фильтруем результаты, чтобы избежать сборников и нарезок
+                        valid_results = [result for result in results if is_valid_genre_track(result)]
+                        
+                        if not valid_results:
+                            logging.warning(f"⚠️ Нет валидных результатов для '{query}' (стратегия: {strategy})")
+                            continue
+                        
+                        # Добавляем случайное количество результатов (2-5) для большего разнообразия
+                        min_count = min(2, len(valid_results))
+                        max_count = min(5, len(valid_results))
+                        num_to_add = random.randint(min_count, max_count)
+                        all_results.extend(random.sample(valid_results, num_to_add))
+                        logging.info(f"✅ Добавлено {num_to_add} треков из запроса '{query}' (стратегия: {strategy})")
+                        query_success = True
+                        break
+                        
+                    except Exception as search_error:
+                        logging.error(f"❌ Ошибка поиска для запроса '{query}' (стратегия: {strategy}): {search_error}")
                         continue
                 
                 if not query_success:
@@ -4819,87 +4729,65 @@ def search_genre_tracks(genre_queries, limit=20):
         logging.error(f"❌ Критическая ошибка поиска по жанру: {e}")
         return []
 
-def search_artist_tracks(artist_name, limit=10):
+async def search_artist_tracks(artist_name, limit=10):
     """Ищет треки конкретного исполнителя на SoundCloud"""
     try:
         logging.info(f"👤 Поиск треков исполнителя на SoundCloud: {artist_name}")
         
-        # Формируем поисковый запрос с префиксом scsearch для SoundCloud
         # Запрашиваем больше треков, чтобы после фильтрации осталось нужное количество
-        search_query = f"scsearch{limit * 3}:{artist_name}"
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'noplaylist': True,
-            'quiet': True,
-            'extract_flat': True,
-            'no_warnings': True,
-            'ignoreerrors': True,
-            'timeout': 30,
-            'retries': 3,
-        }
+        results = await search_soundcloud(artist_name, limit * 3)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Ищем треки исполнителя на SoundCloud
-            info = ydl.extract_info(search_query, download=False)
-            
-            if not info:
-                logging.warning(f"⚠️ Пустой результат поиска для исполнителя '{artist_name}' на SoundCloud")
-                return []
+        if not results:
+            logging.warning(f"⚠️ Нет результатов для исполнителя '{artist_name}' на SoundCloud")
+            return []
+        
+        logging.info(f"🔍 Найдено {len(results)} треков для исполнителя {artist_name} на SoundCloud")
+        
+        # Фильтруем результаты
+        valid_results = []
+        for result in results:
+            if not result:
+                continue
                 
-            results = info.get("entries", [])
-            
-            if not results:
-                logging.warning(f"⚠️ Нет результатов для исполнителя '{artist_name}' на SoundCloud")
-                return []
-            
-            logging.info(f"🔍 Найдено {len(results)} треков для исполнителя {artist_name} на SoundCloud")
-            
-            # Фильтруем результаты
-            valid_results = []
-            for result in results:
-                if not result:
-                    continue
-                    
-                title = result.get('title', '').lower()
-                duration = result.get('duration', 0)
-                url = result.get('url', '')
+            title = result.get('title', '').lower()
+            duration = result.get('duration', 0)
+            url = result.get('url', '')
+            
+            # Проверяем, что это подходящий трек
+            if (duration and duration > 60 and  # Трек должен быть длиннее 1 минуты
+                duration < 900 and  # И не слишком длинный (не более 15 минут)
+                'mix' not in title and 
+                'compilation' not in title and
+                'collection' not in title and
+                'best of' not in title and
+                'greatest hits' not in title and
+                'karaoke' not in title and
+                'instrumental' not in title and
+                'live' not in title and  # Избегаем живые выступления
+                'concert' not in title and
+                'performance' not in title and
+                url and 'soundcloud.com' in url):  # Убеждаемся, что это SoundCloud
                 
-                # Проверяем, что это подходящий трек
-                if (duration and duration > 60 and  # Трек должен быть длиннее 1 минуты
-                    duration < 900 and  # И не слишком длинный (не более 15 минут)
-                    'mix' not in title and 
-                    'compilation' not in title and
-                    'collection' not in title and
-                    'best of' not in title and
-                    'greatest hits' not in title and
-                    'karaoke' not in title and
-                    'instrumental' not in title and
-                    'live' not in title and  # Избегаем живые выступления
-                    'concert' not in title and
-                    'performance' not in title and
-                    url and 'soundcloud.com' in url):  # Убеждаемся, что это SoundCloud
-                    
-                    valid_results.append(result)
-            
-            logging.info(f"✅ После фильтрации осталось {len(valid_results)} подходящих треков")
-            
-            # Убираем дубликаты по URL
-            unique_results = []
-            seen_urls = set()
-            
-            for result in valid_results:
-                if result and result.get('url') and result['url'] not in seen_urls:
-                    unique_results.append(result)
-                    seen_urls.add(result['url'])
-            
-            logging.info(f"✅ Найдено {len(unique_results)} уникальных треков исполнителя {artist_name} на SoundCloud")
-            
-            # Перемешиваем результаты для разнообразия
-            random.shuffle(unique_results)
-            
-            # Возвращаем нужное количество треков
-            return unique_results[:limit]
+                valid_results.append(result)
+        
+        logging.info(f"✅ После фильтрации осталось {len(valid_results)} подходящих треков")
+        
+        # Убираем дубликаты по URL
+        unique_results = []
+        seen_urls = set()
+        
+        for result in valid_results:
+            if result and result.get('url') and result['url'] not in seen_urls:
+                unique_results.append(result)
+                seen_urls.add(result['url'])
+        
+        logging.info(f"✅ Найдено {len(unique_results)} уникальных треков исполнителя {artist_name} на SoundCloud")
+        
+        # Перемешиваем результаты для разнообразия
+        random.shuffle(unique_results)
+        
+        # Возвращаем нужное количество треков
+        return unique_results[:limit]
             
     except Exception as e:
         logging.error(f"❌ Ошибка поиска треков исполнителя {artist_name} на SoundCloud: {e}")
@@ -4965,7 +4853,7 @@ async def handle_genre_selection(callback: types.CallbackQuery):
         
         # Ищем треки по жанру
         try:
-            results = await asyncio.to_thread(search_genre_tracks, genre_queries, random_limit)
+            results = await search_genre_tracks(genre_queries, random_limit)
             
         except Exception as search_error:
             logging.error(f"❌ Ошибка поиска по жанру {genre_name}: {search_error}")
@@ -5067,21 +4955,22 @@ async def handle_genre_selection(callback: types.CallbackQuery):
                     
                     # Отправляем аудиофайл для прослушивания
                     try:
-                        await callback.message.answer_audio(
-                            types.FSInputFile(filename),
-                            title=track.get('title', 'Без названия'),
-                            performer=f"Жанр: {genre_name}",
-                            duration=track.get('duration', 0)
-                        )
+                        with sending_file(filename):
+                            await callback.message.answer_audio(
+                                types.FSInputFile(filename),
+                                **audio_kwargs(track_metadata.lookup(filename), title=track.get('title', 'Без названия'),
+                                               performer=f"Жанр: {genre_name}", duration=track.get('duration', 0))
+                            )
                         logging.info(f"✅ Аудиофайл отправлен: {track.get('title', 'Без названия')}")
                     except Exception as audio_error:
                         logging.error(f"❌ Ошибка отправки аудиофайла {track.get('title', 'Без названия')}: {audio_error}")
                         # Если не удалось отправить как аудио, отправляем как документ
                         try:
-                            await callback.message.answer_document(
-                                types.FSInputFile(filename),
-                                caption=f"🎵 **{track.get('title', 'Без названия')}**\n🎭 Жанр: {genre_name}"
-                            )
+                            with sending_file(filename):
+                                await callback.message.answer_document(
+                                    types.FSInputFile(filename),
+                                    caption=f"🎵 **{track.get('title', 'Без названия')}**\n🎭 Жанр: {genre_name}"
+                                )
                             logging.info(f"✅ Файл отправлен как документ: {track.get('title', 'Без названия')}")
                         except Exception as doc_error:
                             logging.error(f"❌ Ошибка отправки документа {track.get('title', 'Без названия')}: {doc_error}")
@@ -5336,7 +5225,7 @@ async def search_artist_retry_callback(callback: types.CallbackQuery, state: FSM
     
     try:
         # Ищем треки исполнителя
-        results = await asyncio.to_thread(search_artist_tracks, artist_name, 10)
+        results = await search_artist_tracks(artist_name, 10)
         
         if not results:
             await search_msg.edit_text(
@@ -5425,20 +5314,21 @@ async def search_artist_retry_callback(callback: types.CallbackQuery, state: FSM
                     
                     # Отправляем аудиофайл
                     try:
-                        await callback.message.answer_audio(
-                            types.FSInputFile(filename),
-                            title=track.get('title', 'Без названия'),
-                            performer=artist_name,
-                            duration=track.get('duration', 0)
-                        )
+                        with sending_file(filename):
+                            await callback.message.answer_audio(
+                                types.FSInputFile(filename),
+                                **audio_kwargs(track_metadata.lookup(filename), title=track.get('title', 'Без названия'),
+                                               performer=artist_name, duration=track.get('duration', 0))
+                            )
                         logging.info(f"✅ Аудиофайл отправлен: {track.get('title', 'Без названия')}")
                     except Exception as audio_error:
                         logging.error(f"❌ Ошибка отправки аудиофайла {track.get('title', 'Без названия')}: {audio_error}")
                         # Если не удалось отправить как аудио, отправляем как документ
                         try:
-                            await callback.message.answer_document(
-                                types.FSInputFile(filename)
-                            )
+                            with sending_file(filename):
+                                await callback.message.answer_document(
+                                    types.FSInputFile(filename)
+                                )
                             logging.info(f"✅ Файл отправлен как документ: {track.get('title', 'Без названия')}")
                         except Exception as doc_error:
                             logging.error(f"❌ Ошибка отправки документа {track.get('title', 'Без названия')}: {doc_error}")
@@ -5562,6 +5452,9 @@ async def main():
         if not API_TOKEN:
             logging.warning("⚠️ Используется токен по умолчанию, проверьте настройки")
         
+        # В режиме polling своего веб-сервера нет - /metrics на отдельном порту
+        metrics.start_metrics_server()
+        
         # Запускаем фоновые задачи
         try:
             start_background_tasks()
@@ -5573,7 +5466,9 @@ async def main():
         await bot.delete_webhook(drop_pending_updates=True)
         logging.info("✅ Webhook удален")
         
-        await dp.start_polling(bot, skip_updates=True)
+        # Обработка уходит в полосы update_executor, поэтому polling читает обновления
+        # последовательно: при переполнении очередей он сам притормаживает
+        await dp.start_polling(bot, skip_updates=True, handle_as_tasks=False)
         logging.info("✅ Polling запущен")
         
     except Exception as e:
@@ -5588,12 +5483,6 @@ async def check_yoomoney_payment_callback(callback: types.CallbackQuery):
     user_id = callback.data.split("_")[-1]
     username = callback.from_user.username
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     logging.info(f"🔍 Проверка оплаты YooMoney для пользователя {user_id}")
     
     try:
@@ -5962,6 +5851,11 @@ async def user_stats_command(message: types.Message):
     response += "• /cleanup_now - запустить очистку сейчас\n"
     response += "• /premium_stats - статистика премиум пользователей\n"
     response += "• /premium_monitor - мониторинг премиума\n"
+    response += "• /index_stats - статистика локального индекса треков\n"
+    response += "• /sources - состояние источников и предохранителей\n"
+    response += "• /lanes - очереди обработки обновлений по чатам\n"
+    response += "• /leader - лидер фоновых задач и их последние запуски\n"
+    response += "• /perf - перцентили этапов обработки и самые медленные обновления\n"
     
     await message.answer(response)
 
@@ -5995,6 +5889,11 @@ async def check_me_command(message: types.Message):
         response += "• /cleanup_now - запустить очистку сейчас\n"
         response += "• /premium_stats - статистика премиум пользователей\n"
         response += "• /premium_monitor - мониторинг премиума\n"
+        response += "• /index_stats - статистика индекса треков\n"
+        response += "• /sources - состояние источников\n"
+        response += "• /lanes - очереди обработки обновлений\n"
+        response += "• /leader - лидер фоновых задач\n"
+        response += "• /perf - производительность обработки\n"
     else:
         response += "❌ Вы не администратор\n"
         response += "Обратитесь к администратору для получения прав\n"
@@ -6072,6 +5971,27 @@ async def cleanup_status_command(message: types.Message):
                 cache_info += f"• ⏱ Задержка очистки: {AUTO_CLEANUP_DELAY} сек\n"
                 cache_info += f"• 📝 Логирование: {'✅ Включено' if CLEANUP_LOGGING else '❌ Отключено'}\n\n"
                 
+                quota = disk_quota.stats()
+                mb = 1024 * 1024
+                cache_info += "📏 **Квота cache:**\n"
+                cache_info += f"• Занято: {quota['total_bytes'] / mb:.1f} из {quota['quota_bytes'] / mb:.0f} MB ({quota['files']} файлов)\n"
+                cache_info += (f"• По владельцам: премиум {quota['bytes_by_owner'].get(OWNER_PREMIUM, 0) / mb:.1f} MB, "
+                               f"коллекции {quota['bytes_by_owner'].get(OWNER_COLLECTION, 0) / mb:.1f} MB, "
+                               f"временные {quota['bytes_by_owner'].get(OWNER_TEMP, 0) / mb:.1f} MB\n")
+                if quota['free_disk_bytes'] is not None:
+                    cache_info += f"• Свободно на диске: {quota['free_disk_bytes'] / mb:.0f} MB\n"
+                cache_info += f"• Вытеснено: {quota['evicted_files']} файлов ({quota['evicted_bytes'] / mb:.1f} MB)\n"
+                cache_info += f"• Отклонено загрузок: {quota['rejected_downloads']}\n"
+                cache_info += f"• Давление на диск: {'⚠️ да, загрузки приостановлены' if quota['under_pressure'] else '✅ нет'}\n\n"
+                integrity = integrity_scanner.stats()
+                cache_info += "🔧 **Проверка целостности:**\n"
+                cache_info += (f"• Файлов с записями: {integrity['files']}, подозрительных: "
+                               f"{integrity['statuses'].get('suspect', 0)}, поврежденных: {integrity['statuses'].get('damaged', 0)}\n\n")
+                refs = file_refs.stats()
+                cache_info += "🔗 **Ссылки на файлы:**\n"
+                cache_info += f"• Файлов со ссылками: {refs['referenced_files']}, отправляются сейчас: {refs['sending']}\n"
+                cache_info += f"• В очереди на удаление: {refs['pending_deletes']}, удалено: {refs['deleted_files']}\n\n"
+                
                 if total_files > 0:
                     cache_info += "📋 **Последние 10 файлов:**\n"
                     for i, filename in enumerate(files[:10], 1):
@@ -6147,7 +6067,7 @@ async def cleanup_now_command(message: types.Message):
         await message.answer("🧹 Запускаю очистку файлов...")
         
         # Запускаем очистку
-        cleanup_orphaned_files()
+        await cleanup_orphaned_files()
         
         await message.answer("✅ Очистка завершена! Проверьте статус командой /cleanup_status")
         logging.info(f"🧹 Администратор {user_id} ({username}) запустил немедленную очистку")
@@ -6258,6 +6178,176 @@ async def premium_monitor_command(message: types.Message):
     except Exception as e:
         await message.answer(f"❌ Ошибка при запуске мониторинга: {e}")
 
+@dp.message(Command("index_stats"))
+async def index_stats_command(message: types.Message):
+    """Команда для просмотра статистики локального индекса треков"""
+    user_id = str(message.from_user.id)
+    username = message.from_user.username
+    
+    if not is_admin(user_id, username):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    try:
+        stats = track_index.stats()
+        response = "🗂️ Локальный индекс треков:\n\n"
+        response += f"• 🎵 Треков в индексе: {stats['docs']} (максимум {track_index.max_docs})\n"
+        response += f"• 🔤 Термов: {stats['terms']}\n"
+        response += f"• 🔍 Поисков через индекс: {stats['lookups']}\n"
+        response += f"• ✅ Локальных попаданий: {stats['hits']} ({stats['hit_rate'] * 100:.1f}%)\n"
+        await message.answer(response)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при получении статистики индекса: {e}")
+
+@dp.message(Command("sources"))
+async def sources_status_command(message: types.Message):
+    """Команда для просмотра состояния источников (предохранители и негативный кэш)"""
+    user_id = str(message.from_user.id)
+    username = message.from_user.username
+    
+    if not is_admin(user_id, username):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    try:
+        state_icons = {"closed": "🟢", "half_open": "🟡", "open": "🔴"}
+        response = "🔌 Состояние источников:\n\n"
+        for breaker in source_breakers.values():
+            status = breaker.status()
+            response += f"{state_icons.get(status['state'], '⚪')} {status['name']}: {status['state']}\n"
+            response += f"   • ошибок подряд: {status['failures']}, отклонено: {status['rejected']}\n"
+            if status['state'] == "open":
+                response += f"   • проба через: {status['retry_in']:.0f} сек\n"
+            if status['last_error']:
+                response += f"   • последняя ошибка ({status['last_error_class']}): {status['last_error'][:100]}\n"
+        
+        counts = negative_cache.stats()
+        response += "\n🚫 Негативный кэш:\n"
+        response += f"• недоступно: {counts.get('unavailable', 0)}\n"
+        response += f"• троттлинг: {counts.get('throttled', 0)}\n"
+        response += f"• временные ошибки: {counts.get('transient', 0)}\n"
+        response += f"• сэкономлено загрузок: {negative_cache.hits}\n"
+        await message.answer(response)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при получении состояния источников: {e}")
+
+@dp.message(Command("lanes"))
+async def lanes_status_command(message: types.Message):
+    """Команда для просмотра очередей обработки обновлений по чатам"""
+    user_id = str(message.from_user.id)
+    username = message.from_user.username
+    
+    if not is_admin(user_id, username):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    try:
+        stats = update_executor.stats(top=5)
+        response = "🛣️ Обработка обновлений:\n\n"
+        response += f"• Активных полос (чатов): {stats['lanes']}\n"
+        response += f"• В очередях: {stats['pending']} из {stats['max_pending']}\n"
+        response += f"• Выполняется: {stats['running']} из {stats['max_concurrency']}\n"
+        response += f"• Обработано: {stats['processed']}\n"
+        response += f"• Ожиданий из-за переполнения: {stats['backpressure_waits']}\n"
+        premium_queued = await state_backend.run_async(state_backend.queue_size, PREMIUM_QUEUE)
+        regular_queued = await state_backend.run_async(state_backend.queue_size, REGULAR_QUEUE)
+        response += f"• Очередь загрузок ({state_backend.name}): премиум {premium_queued}, обычная {regular_queued}\n"
+        if DOWNLOAD_WORKERS_ENABLED:
+            jobs = await download_jobs.stats_async()
+            response += (f"• Воркеры загрузок: {jobs['workers']}, задач в очереди {jobs['queued']}, "
+                         f"выполняется {jobs['running']}\n")
+        limits = rate_limiter.stats()
+        throttled = ", ".join(f"{action} {count}" for action, count in sorted(limits['throttled'].items()))
+        response += f"• Ограничение частоты: {limits['users']} пользователей, отклонено: {throttled or 'нет'}\n"
+        
+        if stats['deepest'] and stats['deepest'][0]['depth']:
+            response += "\n📥 Самые длинные очереди:\n"
+            for lane in stats['deepest']:
+                if lane['depth']:
+                    response += f"• чат {lane['key']}: {lane['depth']} (макс. {lane['max_depth']})\n"
+        
+        if stats['slowest']:
+            response += "\n🐢 Самые медленные обработчики:\n"
+            for lane in stats['slowest']:
+                response += (f"• чат {lane['key']}: {lane['avg_latency'] * 1000:.0f} мс в среднем, "
+                             f"макс. {lane['max_latency'] * 1000:.0f} мс, ожидание {lane['avg_wait'] * 1000:.0f} мс\n")
+        
+        await message.answer(response)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при получении статистики очередей: {e}")
+
+@dp.message(Command("leader"))
+async def leader_status_command(message: types.Message):
+    """Команда для просмотра лидера фоновых задач и их последних запусков"""
+    user_id = str(message.from_user.id)
+    username = message.from_user.username
+    
+    if not is_admin(user_id, username):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    try:
+        status = await asyncio.get_running_loop().run_in_executor(None, leader_lease.status)
+        now = time.time()
+        response = "👑 Фоновые задачи:\n\n"
+        response += f"• Этот процесс: {status['self']} ({'лидер' if status['is_leader'] else 'не лидер'})\n"
+        leader = status['leader']
+        if leader:
+            state = "истекла" if leader['expired'] else f"еще {leader['expires'] - now:.0f} сек"
+            response += f"• Лидер: {leader['holder']} (с {datetime.fromtimestamp(leader['acquired']).strftime('%d.%m %H:%M:%S')}, аренда {state})\n"
+        else:
+            response += "• Лидер: нет\n"
+        
+        if status['jobs']:
+            response += "\n🕒 Последние запуски:\n"
+            for job in status['jobs']:
+                ago = int(now - job['last_run'])
+                duration = f", {job['duration']:.1f} сек" if job['duration'] is not None else ""
+                response += (f"• {job['name']}: {ago // 60} мин назад, {job['status']}{duration}, "
+                             f"запусков {job['runs']}, {job['holder']}\n")
+        await message.answer(response)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при получении состояния лидера: {e}")
+
+@dp.message(Command("perf"))
+async def perf_command(message: types.Message):
+    """Команда для просмотра перцентилей спанов и самых медленных обновлений"""
+    user_id = str(message.from_user.id)
+    username = message.from_user.username
+    
+    if not is_admin(user_id, username):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    try:
+        report = tracer.percentiles()
+        response = f"⏱️ Производительность (трейсов в буфере: {len(tracer.traces)}):\n\n"
+        if not report:
+            response += "• Пока нет данных\n"
+        # Самые тяжелые по p95 сверху; сообщение Telegram ограничено 4096 символами
+        for name, item in sorted(report.items(), key=lambda kv: kv[1]['p95'], reverse=True)[:20]:
+            response += (f"• {name}: p50 {item['p50'] * 1000:.0f} / p95 {item['p95'] * 1000:.0f} / "
+                         f"p99 {item['p99'] * 1000:.0f} мс (n={item['count']})\n")
+        
+        slowest = tracer.slowest(5)
+        if slowest:
+            response += "\n🐢 Самые медленные обновления:\n"
+            for trace in slowest:
+                root = trace.root
+                chat = root.attrs.get('chat_id', '-')
+                parts = sorted(trace.spans, key=lambda span: span.duration, reverse=True)[:3]
+                breakdown = ", ".join(f"{span.name} {span.duration * 1000:.0f} мс" for span in parts)
+                started = datetime.fromtimestamp(root.start_ns / 1e9).strftime('%H:%M:%S')
+                response += (f"• {started} {root.name}, чат {chat}: {root.duration * 1000:.0f} мс"
+                             f"{' (' + breakdown + ')' if breakdown else ''}\n")
+        
+        logs = log_stats()
+        if "records" in logs:
+            response += f"\n📝 Логи: записей {logs['records']}, отброшено {logs['dropped']}, в очереди {logs['queued']}\n"
+        await message.answer(response)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при получении статистики производительности: {e}")
+
 # === ФУНКЦИИ ПРИОРИТЕТНОЙ ОЧЕРЕДИ ===
 async def add_to_download_queue(user_id: str, url: str, is_premium: bool = False, priority: int = 0):
     """Добавляет задачу в соответствующую очередь загрузки"""
@@ -6281,11 +6371,11 @@ async def add_to_download_queue(user_id: str, url: str, is_premium: bool = False
         
         if is_premium:
             # Премиум пользователи идут в приоритетную очередь
-            await PREMIUM_QUEUE.put((priority, task_info))
+            await state_backend.run_async(state_backend.queue_push, PREMIUM_QUEUE, task_info, priority)
             logging.info(f"💎 Задача добавлена в премиум очередь для пользователя {user_id}")
         else:
             # Обычные пользователи идут в обычную очередь
-            REGULAR_QUEUE.append(task_info)
+            await state_backend.run_async(state_backend.queue_push, REGULAR_QUEUE, task_info)
             logging.info(f"📱 Задача добавлена в обычную очередь для пользователя {user_id}")
         
         # Запускаем обработчик очереди, если он еще не запущен
@@ -6308,9 +6398,9 @@ async def process_download_queue():
                 continue
             
             # Сначала обрабатываем премиум очередь
-            if not PREMIUM_QUEUE.empty():
+            task_info = await state_backend.run_async(state_backend.queue_pop, PREMIUM_QUEUE)
+            if task_info is not None:
                 try:
-                    priority, task_info = await PREMIUM_QUEUE.get()
                     
                     # Проверяем валидность задачи
                     if not task_info or not isinstance(task_info, dict):
@@ -6334,9 +6424,9 @@ async def process_download_queue():
                     continue
             
             # Если премиум очередь пуста, обрабатываем обычную
-            if REGULAR_QUEUE:
+            task_info = await state_backend.run_async(state_backend.queue_pop, REGULAR_QUEUE)
+            if task_info is not None:
                 try:
-                    task_info = REGULAR_QUEUE.popleft()
                     
                     # Проверяем валидность задачи
                     if not task_info or not isinstance(task_info, dict):
@@ -6414,15 +6504,12 @@ async def download_track_from_url_with_priority(user_id: str, url: str, is_premi
             logging.warning("⚠️ download_track_from_url_with_priority: user_tracks был None, инициализируем")
             user_tracks = {}
         
-        outtmpl = os.path.join(CACHE_DIR, '%(title)s.%(ext)s')
+        url = canonical_url(url) or url
         quality_text = "320 kbps" if is_premium else "192 kbps"
         logging.info(f"💾 Начинаю загрузку трека для пользователя {user_id}: {url} (качество: {quality_text})")
         
-        # Используем Semaphore для ограничения одновременных загрузок
-        async with download_semaphore:
-            # Выполняем загрузку с соответствующим качеством через ThreadPoolExecutor
-            loop = asyncio.get_running_loop()
-            fn_info = await loop.run_in_executor(yt_executor, _ydl_download_blocking, url, outtmpl, COOKIES_FILE, is_premium)
+        # Выполняем загрузку с соответствующим качеством (одна загрузка на трек)
+        fn_info = await fetch_media(url, COOKIES_FILE, is_premium)
         if not fn_info:
             logging.error(f"❌ Не удалось получить информацию о треке: {url}")
             return None
@@ -6451,17 +6538,16 @@ async def download_track_from_url_with_priority(user_id: str, url: str, is_premi
                 "url": f"file://{filename}",
                 "original_url": url,  # Сохраняем оригинальную ссылку для возможности перезагрузки
                 "size_mb": round(size_mb, 2),
-                "needs_migration": False
+                "needs_migration": False,
+                **track_fields(track_metadata.lookup(filename)),  # Длительность, исполнитель, обложка
             }
             
-            # Инициализируем список треков для пользователя, если его нет
-            if str(user_id) not in user_tracks:
-                user_tracks[str(user_id)] = []
-            elif user_tracks[str(user_id)] is None:
-                user_tracks[str(user_id)] = []
-                
-            user_tracks[str(user_id)].append(track_info)
+            # Добавляем трек атомарно: одновременное добавление в другом процессе не потеряется
+            user_tracks.mutate(str(user_id), lambda tracks: (tracks or []) + [track_info])
+            collection_keyboards.bump(user_id)
             save_tracks()
+            track_index.add_collection_track(track_info)
+            note_collection_file(user_id, filename)
             
             logging.info(f"✅ Трек успешно добавлен в коллекцию пользователя {user_id}: {filename} ({size_mb:.2f}MB, {quality_text})")
         else:
@@ -6525,16 +6611,14 @@ async def add_genre_tracks_to_collection(callback: types.CallbackQuery):
                         "url": f"file://{file_path}",
                         "original_url": "",  # Для треков по жанрам/исполнителям/альбомам URL неизвестен
                         "size_mb": round(file_size_mb, 2),
-                        "needs_migration": False
+                        "needs_migration": False,
+                        **track_fields(track_metadata.lookup(file_path)),  # Длительность, исполнитель, обложка
                     }
                     
-                    # Добавляем трек в коллекцию пользователя
-                    if str(user_id) not in user_tracks:
-                        user_tracks[str(user_id)] = []
-                    elif user_tracks[str(user_id)] is None:
-                        user_tracks[str(user_id)] = []
-                    
-                    user_tracks[str(user_id)].append(track_info)
+                    # Добавляем трек атомарно: одновременное добавление в другом процессе не потеряется
+                    user_tracks.mutate(str(user_id), lambda tracks: (tracks or []) + [track_info])
+                    collection_keyboards.bump(user_id)
+                    note_collection_file(user_id, file_path)
                     added_count += 1
                     total_size += file_size_mb
                     
@@ -6630,16 +6714,14 @@ async def add_artist_tracks_to_collection(callback: types.CallbackQuery):
                         "url": f"file://{file_path}",
                         "original_url": "",  # Для треков по исполнителям URL неизвестен
                         "size_mb": round(file_size_mb, 2),
-                        "needs_migration": False
+                        "needs_migration": False,
+                        **track_fields(track_metadata.lookup(file_path)),  # Длительность, исполнитель, обложка
                     }
                     
-                    # Добавляем трек в коллекцию пользователя
-                    if str(user_id) not in user_tracks:
-                        user_tracks[str(user_id)] = []
-                    elif user_tracks[str(user_id)] is None:
-                        user_tracks[str(user_id)] = []
-                    
-                    user_tracks[str(user_id)].append(track_info)
+                    # Добавляем трек атомарно: одновременное добавление в другом процессе не потеряется
+                    user_tracks.mutate(str(user_id), lambda tracks: (tracks or []) + [track_info])
+                    collection_keyboards.bump(user_id)
+                    note_collection_file(user_id, file_path)
                     added_count += 1
                     total_size += file_size_mb
                     
@@ -6684,14 +6766,6 @@ async def add_artist_tracks_to_collection(callback: types.CallbackQuery):
 @dp.callback_query(F.data == "soundcloud_search")
 async def soundcloud_search_menu(callback: types.CallbackQuery):
     """Показывает меню поиска на SoundCloud"""
-    user_id = str(callback.from_user.id)
-    
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     try:
         await callback.message.edit_media(
             media=types.InputMediaPhoto(
@@ -6738,14 +6812,6 @@ async def soundcloud_search_menu(callback: types.CallbackQuery):
 @dp.callback_query(F.data == "soundcloud_try_search")
 async def soundcloud_try_search_callback(callback: types.CallbackQuery):
     """Показывает меню поиска на SoundCloud"""
-    user_id = str(callback.from_user.id)
-    
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     try:
         await callback.message.edit_media(
             media=types.InputMediaPhoto(
@@ -6804,12 +6870,6 @@ async def quick_soundcloud_search(callback: types.CallbackQuery):
     try:
         user_id = str(callback.from_user.id)
         
-        # Проверяем антиспам
-        is_allowed, time_until = check_antispam(user_id)
-        if not is_allowed:
-            await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-            return
-        
         # Извлекаем поисковый запрос
         query = callback.data.split(":", 1)[1]
         
@@ -6854,12 +6914,6 @@ async def custom_soundcloud_search(callback: types.CallbackQuery, state: FSMCont
     """Переводит пользователя в состояние ввода поискового запроса"""
     user_id = str(callback.from_user.id)
     
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     try:
         # Переводим пользователя в состояние ввода запроса
         await state.set_state(SearchStates.waiting_for_soundcloud_query)
@@ -6895,14 +6949,6 @@ async def custom_soundcloud_search(callback: types.CallbackQuery, state: FSMCont
 @dp.callback_query(F.data == "search_soundcloud_again")
 async def search_soundcloud_again_callback(callback: types.CallbackQuery):
     """Повторный поиск на SoundCloud"""
-    user_id = str(callback.from_user.id)
-    
-    # Проверяем антиспам
-    is_allowed, time_until = check_antispam(user_id)
-    if not is_allowed:
-        await callback.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом", show_alert=True)
-        return
-    
     try:
         await callback.message.edit_media(
             media=types.InputMediaPhoto(
@@ -7117,12 +7163,6 @@ async def handle_soundcloud_query_input(message: types.Message, state: FSMContex
         user_id = str(message.from_user.id)
         query = message.text.strip()
         
-        # Проверяем антиспам
-        is_allowed, time_until = check_antispam(user_id)
-        if not is_allowed:
-            await message.answer(f"⏳ Подождите {time_until:.1f} сек. перед следующим запросом")
-            return
-        
         if not query or len(query) < 2:
             await message.answer(
                 "❌ **Слишком короткий запрос**\n\n"
@@ -7191,12 +7231,9 @@ async def handle_soundcloud_query_input(message: types.Message, state: FSMContex
 async def get_recommended_tracks(user_id):
     """Получает рекомендуемые треки для пользователя на основе его коллекции или популярных треков"""
     try:
-        global user_tracks, user_recommendation_history
+        global user_tracks
         
         # Инициализируем историю рекомендаций для пользователя
-        if 'user_recommendation_history' not in globals():
-            user_recommendation_history = {}
-        
         if user_id not in user_recommendation_history:
             user_recommendation_history[user_id] = {
                 'shown_tracks': set(),  # Уже показанные треки
@@ -7369,55 +7406,98 @@ async def get_recommended_tracks(user_id):
         logging.error(f"❌ Ошибка получения рекомендаций для пользователя {user_id}: {e}")
         return []
 
-async def search_soundcloud(query):
-    """Поиск на SoundCloud через yt-dlp"""
+def _soundcloud_search_blocking(query, limit=SOUNDCLOUD_SEARCH_LIMIT, errors=None):
+    """Запасной поиск на SoundCloud через yt-dlp (блокирующий, выполняется в yt_executor)"""
+    # Формируем поисковый запрос с префиксом scsearch
+    search_query = f"scsearch{limit}:{query}"
+    
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': True,  # Извлекаем только метаданные, без скачивания
+        'ignoreerrors': True,
+        'timeout': 30,
+        'retries': 3,
+        'logger': YdlErrorCollector(errors),
+    }
+    
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(search_query, download=False)
+    
+    results = []
+    if info and 'entries' in info:
+        for entry in info['entries']:
+            if entry and isinstance(entry, dict):
+                title = entry.get('title', 'Без названия')
+                url = entry.get('url', '')
+                duration = entry.get('duration', 0)
+                
+                if url and title:
+                    results.append({
+                        'title': title,
+                        'url': url,
+                        'duration': duration,
+                        'source': 'sc',  # Используем 'sc' для SoundCloud
+                    })
+    return results
+
+@tracer.traced("search.soundcloud")
+async def search_soundcloud(query, limit=SOUNDCLOUD_SEARCH_LIMIT):
+    """Поиск на SoundCloud: кэш -> api-v2 -> yt-dlp как запасной вариант"""
+    breaker = None  # Задается, когда предохранитель пропустил запрос
     try:
-        logging.info(f"🔍 Поиск на SoundCloud: {query}")
+        # Ключ кэша с префиксом SoundCloud (лимит добавляем, если он нестандартный)
+        if limit == SOUNDCLOUD_SEARCH_LIMIT:
+            cache_key = f"{SOUNDCLOUD_CACHE_PREFIX}:{query}"
+        else:
+            cache_key = f"{SOUNDCLOUD_CACHE_PREFIX}{limit}:{query}"
         
-        # Формируем поисковый запрос с префиксом scsearch
-        search_query = f"scsearch{SOUNDCLOUD_SEARCH_LIMIT}:{query}"
-        
-        # Используем yt-dlp для поиска
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,  # Извлекаем только метаданные, без скачивания
-            'ignoreerrors': True,
-            'no_warnings': True,
-            'timeout': 30,
-            'retries': 3,
-        }
+        await search_cache.prefetch(normalize_query(cache_key, SEARCH_CACHE_TRANSLITERATE))
+        cached = get_cached_search(cache_key)
+        if cached is not None:
+            logging.info(f"🔍 SoundCloud из кэша: {query}")
+            return cached
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(search_query, download=False)
-            
-        if info and 'entries' in info:
-            results = []
-            for entry in info['entries']:
-                if entry and isinstance(entry, dict):
-                    title = entry.get('title', 'Без названия')
-                    url = entry.get('url', '')
-                    duration = entry.get('duration', 0)
-                    
-                    if url and title:
-                        results.append({
-                            'title': title,
-                            'url': url,
-                            'duration': duration,
-                            'source': 'sc',  # Используем 'sc' для SoundCloud
-                        })
-            
+        breaker = source_breakers["soundcloud"]
+        if not breaker.allow():
+            logging.warning(f"🔴 SoundCloud временно отключен предохранителем, запрос: {query}")
+            return []
+        
+        logging.info(f"🔍 Поиск на SoundCloud: {query}")
+        with tracer.span("search.soundcloud_api"), metrics.timer(metrics.SEARCH_SECONDS, provider="soundcloud") as outcome:
+            results = await soundcloud_client.search_tracks(query, limit)
+            outcome["result"] = "unavailable" if results is None else ("ok" if results else "empty")
+        
+        if results is None:
+            # api-v2 недоступен - откатываемся на yt-dlp в пуле потоков
+            logging.info(f"🔍 api-v2 недоступен, поиск на SoundCloud через yt-dlp: {query}")
+            errors = []
+            loop = asyncio.get_running_loop()
+            try:
+                with tracer.span("search.soundcloud_ytdlp"), metrics.timer(metrics.SEARCH_SECONDS, provider="soundcloud_ytdlp") as outcome:
+                    results = await loop.run_in_executor(yt_executor, _soundcloud_search_blocking, query, limit, errors)
+                    outcome["result"] = "ok" if results else ("error" if errors else "empty")
+            except Exception as fallback_error:
+                errors.append(str(fallback_error))
+                results = []
+            if not results and errors:
+                breaker.record_failure(classify_error(errors[-1]), errors[-1])
+                return []
+        breaker.record_success()
+        
+        if results:
             logging.info(f"🔍 Найдено {len(results)} треков на SoundCloud для запроса: {query}")
-            
-            # Сохраняем результаты в кэш с префиксом SoundCloud
-            cache_key = f"{SOUNDCLOUD_CACHE_PREFIX}:{query}"
             set_cached_search(cache_key, results)
-            
+            track_index.add_results(results)
             return results
         
         logging.warning(f"🔍 Ничего не найдено на SoundCloud: {query}")
         return []
+    except asyncio.CancelledError:
+        if breaker is not None:
+            breaker.release_probe()
+        raise
     except Exception as e:
         logging.error(f"❌ Ошибка поиска на SoundCloud: {e}")
         return []
@@ -7440,12 +7520,11 @@ async def send_audio_file(message, file_path, auto_cleanup=True, user_id=None):
         
         # Отправляем аудиофайл
         try:
-            await message.answer_audio(
-                types.FSInputFile(file_path),
-                title=os.path.basename(file_path).replace('.mp3', ''),
-                performer="SoundCloud",
-                duration=0  # Длительность будет определена автоматически
-            )
+            with sending_file(file_path):
+                await message.answer_audio(
+                    types.FSInputFile(file_path),
+                    **audio_kwargs(track_metadata.lookup(file_path), title=os.path.basename(file_path).replace('.mp3', ''))
+                )
             logging.info(f"✅ Аудиофайл отправлен: {file_path}")
             
             # Планируем автоматическую очистку файла после отправки
@@ -7459,9 +7538,10 @@ async def send_audio_file(message, file_path, auto_cleanup=True, user_id=None):
             
             # Если не удалось отправить как аудио, отправляем как документ
             try:
-                await message.answer_document(
-                    types.FSInputFile(file_path)
-                )
+                with sending_file(file_path):
+                    await message.answer_document(
+                        types.FSInputFile(file_path)
+                    )
                 logging.info(f"✅ Файл отправлен как документ: {file_path}")
                 
                 # Планируем автоматическую очистку файла после отправки
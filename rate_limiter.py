@@ -0,0 +1,193 @@
+"""
+Ограничение частоты запросов пользователей (token bucket) для aiogram.
+
+У каждого пользователя одно ведро: RATE_LIMIT_BURST жетонов, пополняется
+на RATE_LIMIT_REFILL жетонов в секунду. Действие списывает столько жетонов,
+сколько стоит его класс: навигация по меню дешевле поиска, поиск дешевле
+скачивания. Класс определяется по callback_data и состоянию FSM.
+
+Ведра лежат в OrderedDict в порядке последнего обращения (LRU): при каждом
+запросе с начала снимаются ведра, которые за время простоя уже заполнились
+бы целиком, - это O(1) на запрос без периодического полного обхода.
+Ведра живут в памяти процесса: при нескольких процессах бота лимит
+действует в каждом из них отдельно.
+
+Подключается как middleware обработчиков, чтобы не тратить жетоны на
+обновления, которые никто не обрабатывает:
+    dp.message.middleware(RateLimitMiddleware(rate_limiter))
+    dp.callback_query.middleware(RateLimitMiddleware(rate_limiter))
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+import metrics
+
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", 5))  # Емкость ведра - сколько действий подряд можно без паузы
+RATE_LIMIT_REFILL = float(os.getenv("RATE_LIMIT_REFILL", 1.0))  # Жетонов в секунду
+RATE_LIMIT_MAX_USERS = 100000  # Больше ведер не храним - самые давние снимаются
+
+ACTION_NAVIGATION = "navigation"
+ACTION_SEARCH = "search"
+ACTION_DOWNLOAD = "download"
+ACTION_FREE = "free"
+
+# Стоимость действий в жетонах
+ACTION_COSTS = {
+    ACTION_NAVIGATION: 1.0,
+    ACTION_SEARCH: 2.0,
+    ACTION_DOWNLOAD: 3.0,
+    ACTION_FREE: 0.0,
+}
+
+# Префиксы callback_data -> класс действия; остальные кнопки - навигация
+CALLBACK_ACTIONS = (
+    ("dl:", ACTION_DOWNLOAD),
+    ("dl_sc:", ACTION_DOWNLOAD),
+    ("sc:", ACTION_DOWNLOAD),
+    ("play:", ACTION_DOWNLOAD),
+    ("download_all", ACTION_DOWNLOAD),
+    ("add_genre_to_collection:", ACTION_DOWNLOAD),
+    ("add_artist_to_collection:", ACTION_DOWNLOAD),
+    ("genre:", ACTION_SEARCH),
+    ("sc_search:", ACTION_SEARCH),
+    ("search_artist_retry:", ACTION_SEARCH),
+    ("for_you", ACTION_SEARCH),
+)
+
+# Текст в этих состояниях FSM - поисковый запрос
+SEARCH_STATE_PREFIX = "SearchStates:"
+
+
+def classify(event, data: Dict[str, Any]) -> str:
+    """Класс действия для обновления"""
+    if isinstance(event, CallbackQuery):
+        callback_data = event.data or ""
+        for prefix, action in CALLBACK_ACTIONS:
+            if callback_data.startswith(prefix):
+                return action
+        return ACTION_NAVIGATION
+    if isinstance(event, Message):
+        # Платеж уже списан - его обработку не задерживаем
+        if event.successful_payment:
+            return ACTION_FREE
+        raw_state = data.get("raw_state") or ""
+        if raw_state.startswith(SEARCH_STATE_PREFIX):
+            return ACTION_SEARCH
+        if (event.text or "").startswith("/sc "):
+            return ACTION_SEARCH
+    return ACTION_NAVIGATION
+
+
+class RateLimiter:
+    """Ведра жетонов пользователей с вытеснением простаивающих (LRU)"""
+
+    def __init__(self, burst: float = RATE_LIMIT_BURST, refill: float = RATE_LIMIT_REFILL,
+                 costs: Optional[Dict[str, float]] = None, max_users: int = RATE_LIMIT_MAX_USERS):
+        self.burst = burst
+        self.refill = refill
+        self.costs = dict(ACTION_COSTS if costs is None else costs)
+        self.max_users = max_users
+        # Через столько секунд простоя ведро снова полное - хранить его незачем
+        self.idle_expiry = burst / refill if refill > 0 else float("inf")
+        # user_id -> [жетоны, время обновления, отказов подряд]
+        self.buckets: "OrderedDict[str, list]" = OrderedDict()
+        self.allowed: Dict[str, int] = {}
+        self.throttled: Dict[str, int] = {}
+
+    def _expire(self, now: float):
+        buckets = self.buckets
+        while buckets:
+            bucket = next(iter(buckets.values()))
+            if now - bucket[1] < self.idle_expiry and len(buckets) <= self.max_users:
+                break
+            buckets.popitem(last=False)
+
+    def acquire(self, user_id: str, action: str = ACTION_NAVIGATION) -> Tuple[bool, float]:
+        """
+        Списывает стоимость action. Возвращает (разрешено, секунд до момента,
+        когда действие станет доступно).
+        """
+        cost = min(self.costs.get(action, self.costs[ACTION_NAVIGATION]), self.burst)
+        now = time.monotonic()
+        self._expire(now)
+
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = [self.burst, now, 0]
+        else:
+            self.buckets.move_to_end(user_id)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.refill)
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            bucket[2] = 0
+            self.allowed[action] = self.allowed.get(action, 0) + 1
+            return True, 0.0
+
+        bucket[2] += 1
+        self.throttled[action] = self.throttled.get(action, 0) + 1
+        wait = (cost - bucket[0]) / self.refill if self.refill > 0 else float("inf")
+        return False, wait
+
+    def tokens(self, user_id: str) -> float:
+        """Жетонов у пользователя сейчас (без списания)"""
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            return self.burst
+        return min(self.burst, bucket[0] + (time.monotonic() - bucket[1]) * self.refill)
+
+    def throttle_streak(self, user_id: str) -> int:
+        """Сколько запросов пользователя подряд отклонено"""
+        bucket = self.buckets.get(user_id)
+        return bucket[2] if bucket else 0
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.buckets),
+            "allowed": dict(self.allowed),
+            "throttled": dict(self.throttled),
+        }
+
+
+rate_limiter = RateLimiter()
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Middleware обработчиков сообщений и callback-запросов: обновление сверх
+    лимита не доходит до обработчика, пользователь получает подсказку.
+    """
+
+    def __init__(self, limiter: RateLimiter = rate_limiter):
+        self.limiter = limiter
+
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        user_id = str(user.id)
+        action = classify(event, data)
+        allowed, wait = self.limiter.acquire(user_id, action)
+        if allowed:
+            return await handler(event, data)
+
+        metrics.THROTTLED_UPDATES.labels(action=action).inc()
+        text = f"⏳ Подождите {wait:.1f} сек. перед следующим запросом"
+        try:
+            if isinstance(event, CallbackQuery):
+                # На callback отвечаем всегда, иначе у кнопки останется индикатор загрузки
+                await event.answer(text, show_alert=True)
+            elif isinstance(event, Message) and self.limiter.throttle_streak(user_id) == 1:
+                # На серию сообщений подряд отвечаем один раз
+                await event.answer(text)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось предупредить пользователя {user_id} об ограничении: {e}")
+        return None
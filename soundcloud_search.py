@@ -0,0 +1,176 @@
+"""
+Асинхронный поиск треков на SoundCloud через api-v2.
+
+client_id извлекается из JS-бандлов soundcloud.com один раз и кэшируется
+(в памяти и в файле), все запросы идут через общий пул соединений http_pool.
+Если api-v2 недоступен, search_tracks возвращает None и вызывающий код
+откатывается на yt-dlp (scsearch).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import List, Optional
+
+import aiohttp
+
+from http_pool import get_session
+
+SOUNDCLOUD_API_URL = "https://api-v2.soundcloud.com"
+SOUNDCLOUD_HOME_URL = "https://soundcloud.com/"
+SOUNDCLOUD_CLIENT_ID_FILE = os.path.join(os.path.dirname(__file__), "soundcloud_client_id.json")
+SOUNDCLOUD_CLIENT_ID_TTL = 6 * 3600  # client_id меняется редко, перепроверяем раз в 6 часов
+SOUNDCLOUD_API_TIMEOUT = 10  # Таймаут запроса к api-v2 (сек)
+
+_SCRIPT_SRC_RE = re.compile(r'<script[^>]+src="(https://a-v2\.sndcdn\.com/assets/[^"]+\.js)"')
+_CLIENT_ID_RE = re.compile(r'client_id\s*[:=]\s*"?([0-9a-zA-Z]{32})"?')
+
+
+class SoundCloudSearchClient:
+    """Клиент поиска SoundCloud с кэшированием client_id"""
+
+    def __init__(self, client_id_file: str = SOUNDCLOUD_CLIENT_ID_FILE,
+                 client_id_ttl: int = SOUNDCLOUD_CLIENT_ID_TTL):
+        self.client_id_file = client_id_file
+        self.client_id_ttl = client_id_ttl
+        self._client_id = os.getenv("SOUNDCLOUD_CLIENT_ID")
+        self._client_id_time = time.time() if self._client_id else 0
+        self._pinned = bool(self._client_id)  # client_id из окружения не перезапрашиваем
+        self._lock = None
+        self._load_client_id()
+
+    def _load_client_id(self):
+        """Загружает сохранённый client_id из файла"""
+        if self._client_id:
+            return
+        try:
+            if os.path.exists(self.client_id_file):
+                with open(self.client_id_file, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict) and data.get("client_id"):
+                    self._client_id = data["client_id"]
+                    self._client_id_time = float(data.get("time", 0))
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось загрузить client_id SoundCloud: {e}")
+
+    def _save_client_id(self):
+        try:
+            with open(self.client_id_file, "w", encoding="utf-8") as f:
+                json.dump({"client_id": self._client_id, "time": self._client_id_time}, f)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось сохранить client_id SoundCloud: {e}")
+
+    def invalidate_client_id(self):
+        """Сбрасывает client_id (например, после ответа 401/403)"""
+        if self._pinned:
+            return
+        self._client_id = None
+        self._client_id_time = 0
+
+    async def get_client_id(self) -> Optional[str]:
+        """Возвращает действующий client_id, при необходимости извлекает новый"""
+        if self._client_id and (self._pinned or time.time() - self._client_id_time < self.client_id_ttl):
+            return self._client_id
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # Одновременные запросы ждут одного извлечения client_id
+        async with self._lock:
+            if self._client_id and time.time() - self._client_id_time < self.client_id_ttl:
+                return self._client_id
+
+            client_id = await self._discover_client_id()
+            if client_id:
+                self._client_id = client_id
+                self._client_id_time = time.time()
+                self._save_client_id()
+                logging.info("🔑 Получен новый client_id SoundCloud")
+            return self._client_id
+
+    async def _discover_client_id(self) -> Optional[str]:
+        """Ищет client_id в JS-бандлах главной страницы soundcloud.com"""
+        try:
+            session = get_session("soundcloud", timeout=SOUNDCLOUD_API_TIMEOUT)
+            async with session.get(SOUNDCLOUD_HOME_URL) as resp:
+                if resp.status != 200:
+                    logging.warning(f"⚠️ soundcloud.com вернул статус {resp.status}")
+                    return None
+                html = await resp.text()
+
+            # client_id обычно лежит в одном из последних бандлов
+            for script_url in reversed(_SCRIPT_SRC_RE.findall(html)):
+                async with session.get(script_url) as resp:
+                    if resp.status != 200:
+                        continue
+                    script = await resp.text()
+                match = _CLIENT_ID_RE.search(script)
+                if match:
+                    return match.group(1)
+
+            logging.warning("⚠️ client_id SoundCloud не найден в JS-бандлах")
+            return None
+        except Exception as e:
+            logging.error(f"❌ Ошибка получения client_id SoundCloud: {e}")
+            return None
+
+    async def search_tracks(self, query: str, limit: int = 10) -> Optional[List[dict]]:
+        """
+        Ищет треки через api-v2.
+        Возвращает список {'title', 'url', 'duration', 'source'} или None, если API недоступен.
+        """
+        for attempt in range(2):
+            client_id = await self.get_client_id()
+            if not client_id:
+                return None
+
+            params = {"q": query, "client_id": client_id, "limit": limit, "offset": 0}
+            try:
+                session = get_session("soundcloud", timeout=SOUNDCLOUD_API_TIMEOUT)
+                async with session.get(f"{SOUNDCLOUD_API_URL}/search/tracks", params=params) as resp:
+                    if resp.status in (401, 403) and attempt == 0:
+                        # client_id протух - извлекаем новый и повторяем один раз
+                        logging.warning(f"⚠️ api-v2 отклонил client_id (статус {resp.status}), обновляем")
+                        self.invalidate_client_id()
+                        continue
+                    if resp.status != 200:
+                        logging.warning(f"⚠️ api-v2 SoundCloud вернул статус {resp.status} для запроса: {query}")
+                        return None
+                    data = await resp.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"⚠️ Ошибка запроса к api-v2 SoundCloud: {e}")
+                return None
+            except Exception as e:
+                logging.error(f"❌ Ошибка поиска через api-v2 SoundCloud: {e}")
+                return None
+
+            return self._parse_tracks(data, limit)
+        return None
+
+    @staticmethod
+    def _parse_tracks(data, limit: int) -> List[dict]:
+        results = []
+        for item in (data or {}).get("collection", []):
+            if not isinstance(item, dict) or item.get("kind") != "track":
+                continue
+            title = item.get("title")
+            url = item.get("permalink_url")
+            if not title or not url:
+                continue
+            duration_ms = item.get("full_duration") or item.get("duration") or 0
+            results.append({
+                "title": title,
+                "url": url,
+                "duration": int(duration_ms // 1000),
+                "uploader": (item.get("user") or {}).get("username", ""),
+                "source": "sc",
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+
+soundcloud_client = SoundCloudSearchClient()
@@ -0,0 +1,241 @@
+"""
+Здоровье внешних источников: негативный кэш и предохранители (circuit breaker).
+
+Негативный кэш помнит ссылки/ID, которые недавно не удалось скачать, с TTL
+в зависимости от класса ошибки:
+    unavailable - видео удалено, приватное, заблокировано в регионе (долго)
+    throttled   - 429, "подтвердите, что вы не бот", 403 (несколько минут)
+    transient   - таймауты, обрывы соединения и прочее (около минуты)
+
+У каждого провайдера (поиск YouTube, загрузка YouTube, SoundCloud) свой
+предохранитель: после серии ошибок он размыкается и сразу отказывает,
+а по истечении паузы пропускает одну пробную операцию (half-open).
+Ошибки класса unavailable относятся к конкретному треку и предохранитель
+не размыкают.
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+ERROR_UNAVAILABLE = "unavailable"
+ERROR_THROTTLED = "throttled"
+ERROR_TRANSIENT = "transient"
+
+NEGATIVE_CACHE_TTL = {
+    ERROR_UNAVAILABLE: 6 * 3600,
+    ERROR_THROTTLED: 10 * 60,
+    ERROR_TRANSIENT: 60,
+}
+NEGATIVE_CACHE_MAX_SIZE = 5000
+
+_UNAVAILABLE_MARKERS = (
+    "video unavailable", "private video", "this video is private", "has been removed",
+    "not available in your country", "not made this video available in your country",
+    "geo restricted", "geo-restricted", "blocked it in your country", "copyright",
+    "members-only", "join this channel", "confirm your age", "age-restricted",
+    "does not exist", "account associated with this video has been terminated",
+    "unsupported url",
+)
+_THROTTLED_MARKERS = (
+    "too many requests", "rate limit", "rate-limit", "not a bot",
+    "sign in to confirm", "forbidden", "quota",
+)
+# Код HTTP только в виде статуса ("HTTP Error 404", "status code: 429", "403 Client Error"):
+# голые "404"/"429" встречаются в ID видео, ссылках и названиях треков
+_HTTP_STATUS_RE = re.compile(
+    r"\b(?:http error|status(?: code)?|error code|response code)\s*:?\s*(\d{3})\b"
+    r"|\b(\d{3})\s+(?:client error|not found|forbidden|too many requests|gone)\b"
+)
+_UNAVAILABLE_STATUSES = {"404", "410"}
+_THROTTLED_STATUSES = {"403", "429"}
+
+
+def classify_error(message) -> str:
+    """Определяет класс ошибки по тексту сообщения yt-dlp / HTTP-клиента"""
+    text = str(message or "").lower()
+    statuses = {code for match in _HTTP_STATUS_RE.finditer(text) for code in match.groups() if code}
+    if statuses & _UNAVAILABLE_STATUSES or any(marker in text for marker in _UNAVAILABLE_MARKERS):
+        return ERROR_UNAVAILABLE
+    if statuses & _THROTTLED_STATUSES or any(marker in text for marker in _THROTTLED_MARKERS):
+        return ERROR_THROTTLED
+    return ERROR_TRANSIENT
+
+
+class YdlErrorCollector:
+    """Логгер для yt-dlp: собирает сообщения об ошибках, которые при ignoreerrors иначе теряются"""
+
+    def __init__(self, errors: Optional[List[str]] = None):
+        self.errors = errors if errors is not None else []
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        self.errors.append(str(msg))
+
+
+class NegativeCache:
+    """Кэш заведомо неудачных ссылок с TTL по классу ошибки"""
+
+    def __init__(self, max_size: int = NEGATIVE_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+            if entry["expires"] <= time.time():
+                del self._entries[key]
+                return None
+            self.hits += 1
+            return entry
+
+    def add(self, key: str, error_class: str, message: str = ""):
+        ttl = NEGATIVE_CACHE_TTL.get(error_class, NEGATIVE_CACHE_TTL[ERROR_TRANSIENT])
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                "class": error_class,
+                "message": (message or "")[:200],
+                "expires": time.time() + ttl,
+            }
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        now = time.time()
+        counts = {ERROR_UNAVAILABLE: 0, ERROR_THROTTLED: 0, ERROR_TRANSIENT: 0}
+        with self._lock:
+            for entry in self._entries.values():
+                if entry["expires"] > now:
+                    counts[entry["class"]] = counts.get(entry["class"], 0) + 1
+        return counts
+
+
+class CircuitBreaker:
+    """Предохранитель провайдера: closed -> open -> half_open -> closed"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 max_reset_timeout: float = 600.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.probe_started = 0.0
+        self.last_error = ""
+        self.last_error_class = ""
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Можно ли сейчас обращаться к провайдеру"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                # Пауза истекла - пропускаем одну пробную операцию
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+                logging.info(f"🟡 Предохранитель {self.name}: пробная операция")
+            if self.state == self.HALF_OPEN:
+                # Если проба "потерялась" (результат не записан), разрешаем новую
+                probe_lost = time.time() - self.probe_started > self.max_reset_timeout
+                if not self.probe_in_flight or probe_lost:
+                    self.probe_in_flight = True
+                    self.probe_started = time.time()
+                    return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info(f"🟢 Предохранитель {self.name} замкнут, источник восстановился")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+            self.reset_timeout = self.base_reset_timeout
+
+    def record_failure(self, error_class: str = ERROR_TRANSIENT, message: str = ""):
+        with self._lock:
+            self.last_error = (message or "")[:200]
+            self.last_error_class = error_class
+            if error_class == ERROR_UNAVAILABLE:
+                # Проблема конкретного трека, а не провайдера
+                if self.state == self.HALF_OPEN:
+                    self.probe_in_flight = False
+                return
+
+            if self.state == self.HALF_OPEN:
+                # Проба не удалась - размыкаем снова с удвоенной паузой
+                self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+                self._open()
+                return
+
+            self.failures += 1
+            # Троттлинг размыкает сразу: повторные запросы только продлят блокировку
+            if self.failures >= self.failure_threshold or error_class == ERROR_THROTTLED:
+                self._open()
+
+    def release_probe(self):
+        """Операция отменена, не дав результата: пробу может выполнить следующий запрос"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.probe_in_flight = False
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self.probe_in_flight = False
+        logging.warning(f"🔴 Предохранитель {self.name} разомкнут на {self.reset_timeout:.0f} сек "
+                        f"({self.last_error_class}: {self.last_error})")
+
+    def status(self) -> dict:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.time() - self.opened_at))
+            return {
+                "name": self.name,
+                "state": self.state,
+                "failures": self.failures,
+                "retry_in": retry_in,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+                "last_error_class": self.last_error_class,
+            }
+
+
+negative_cache = NegativeCache()
+source_breakers = {
+    "yt_search": CircuitBreaker("yt_search"),
+    "yt_download": CircuitBreaker("yt_download"),
+    "soundcloud": CircuitBreaker("soundcloud"),
+}
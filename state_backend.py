@@ -0,0 +1,689 @@
+"""
+Хранилище общего состояния бота: коллекции, кэш поиска, антиспам, очереди
+загрузок, история рекомендаций и состояния FSM.
+
+Реализации:
+    memory - словари в памяти процесса (по умолчанию, поведение как раньше)
+    sqlite - один файл БД (WAL), общий для нескольких процессов на одной машине
+    redis  - Redis-протокол (redis-server, KeyDB, fakeredis в тестах)
+
+Выбор через переменные окружения:
+    STATE_BACKEND=memory|sqlite|redis
+    STATE_DB_FILE=state.db
+    REDIS_URL=redis://localhost:6379/0
+
+Значения сериализуются в JSON (множества поддерживаются). BackendDict
+предоставляет пространство имён как обычный словарь; значения, которые
+код меняет на месте (user_tracks[uid].append(...)), записываются обратно
+при flush() или при следующем обращении после STATE_CACHE_TTL, если они
+действительно изменились. Запись обратно - атомарная операция update():
+если другой процесс успел изменить значение, локальные изменения
+накладываются на его версию (добавления в список, ключи словаря), а не
+затирают её. Изменения, которые нельзя потерять, делаются сразу через
+BackendDict.mutate(key, func).
+
+Запросы к SQLite и Redis выполняются в одном потоке хранилища, а не в
+event loop: записи BackendDict уходят туда без ожидания (по порядку, так
+что следующее чтение их уже видит), FSM и очереди ждут их через
+run_async(), а prefetch() заранее читает ключи обновления в кэш, чтобы
+обработчик брал их из памяти.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_DB_FILE = os.getenv("STATE_DB_FILE", os.path.join(os.path.dirname(__file__), "state.db"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STATE_REDIS_PREFIX = os.getenv("STATE_REDIS_PREFIX", "musicbot:")
+STATE_CACHE_TTL = 5.0  # Сколько секунд BackendDict доверяет прочитанному значению
+
+_MISSING = object()
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": list(value)}
+    raise TypeError(f"Объект типа {type(value).__name__} не сериализуется в JSON")
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and "__set__" in obj:
+        return set(obj["__set__"])
+    return obj
+
+
+def dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_json_default)
+
+
+def loads(text):
+    return json.loads(text, object_hook=_json_object_hook)
+
+
+class StateBackend:
+    """Интерфейс хранилища: пространства имён ключ-значение и очереди с приоритетом"""
+
+    name = "base"
+    persistent = False  # Данные переживают перезапуск без JSON-файлов
+    shared = False  # Данные видны другим процессам
+    blocking = False  # Запросы ходят в БД или сеть - выполняются в потоке хранилища
+    _executor: Optional[ThreadPoolExecutor] = None
+    _io_thread: Optional[int] = None
+
+    # --- Поток хранилища ---
+
+    def _start_io_thread(self):
+        # Один поток: запросы процесса выполняются строго в порядке отправки
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"state-{self.name}",
+                                            initializer=self._bind_io_thread)
+
+    def _bind_io_thread(self):
+        self._io_thread = threading.get_ident()
+
+    def submit(self, func, *args) -> Future:
+        """Ставит вызов в поток хранилища (для хранилища в памяти - выполняет сразу)"""
+        if not self.blocking or self._executor is None or threading.get_ident() == self._io_thread:
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._executor.submit(func, *args)
+
+    def call(self, func, *args):
+        """Синхронный вызов после всех поставленных ранее записей"""
+        return self.submit(func, *args).result()
+
+    async def run_async(self, func, *args):
+        """Вызов в потоке хранилища без блокировки event loop"""
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def write_behind(self, func, *args):
+        """Запись без ожидания; ошибка попадает в лог"""
+        self.submit(func, *args).add_done_callback(self._write_done)
+
+    @staticmethod
+    def _write_done(future: Future):
+        if future.exception() is not None:
+            logging.error(f"❌ Ошибка записи в хранилище состояния: {future.exception()}")
+
+    async def drain(self):
+        """Ждет, пока поток хранилища выполнит все поставленные записи"""
+        await self.run_async(lambda: None)
+
+    # --- Данные ---
+
+    def get(self, namespace: str, key: str, default=None):
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, value):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def update(self, namespace: str, key: str, func: Callable[[Any], Any], default=None):
+        """Атомарно заменяет значение на func(текущее или default); возвращает новое значение"""
+        raise NotImplementedError
+
+    def keys(self, namespace: str) -> List[str]:
+        raise NotImplementedError
+
+    def items(self, namespace: str) -> List[Tuple[str, Any]]:
+        raise NotImplementedError
+
+    def count(self, namespace: str) -> int:
+        return len(self.keys(namespace))
+
+    def clear(self, namespace: str):
+        for key in self.keys(namespace):
+            self.delete(namespace, key)
+
+    def queue_push(self, name: str, item, priority: int = 0):
+        """Добавляет элемент в очередь; меньший priority извлекается раньше, при равном - FIFO"""
+        raise NotImplementedError
+
+    def queue_pop(self, name: str):
+        """Извлекает следующий элемент очереди или None"""
+        raise NotImplementedError
+
+    def queue_size(self, name: str) -> int:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """Состояние в памяти процесса; значения хранятся как есть, без сериализации"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._queues: Dict[str, list] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key, default=None):
+        return self._data.get(namespace, {}).get(key, default)
+
+    def set(self, namespace, key, value):
+        self._data.setdefault(namespace, {})[key] = value
+
+    def delete(self, namespace, key):
+        self._data.get(namespace, {}).pop(key, None)
+
+    def update(self, namespace, key, func, default=None):
+        with self._lock:
+            data = self._data.setdefault(namespace, {})
+            value = func(data.get(key, default))
+            data[key] = value
+            return value
+
+    def keys(self, namespace):
+        return list(self._data.get(namespace, {}))
+
+    def items(self, namespace):
+        return list(self._data.get(namespace, {}).items())
+
+    def count(self, namespace):
+        return len(self._data.get(namespace, {}))
+
+    def clear(self, namespace):
+        self._data.pop(namespace, None)
+
+    def queue_push(self, name, item, priority=0):
+        with self._lock:
+            heapq.heappush(self._queues.setdefault(name, []), (priority, next(self._counter), item))
+
+    def queue_pop(self, name):
+        with self._lock:
+            queue = self._queues.get(name)
+            if not queue:
+                return None
+            return heapq.heappop(queue)[2]
+
+    def queue_size(self, name):
+        return len(self._queues.get(name, ()))
+
+
+class SQLiteBackend(StateBackend):
+    """Состояние в файле SQLite (WAL), доступном нескольким процессам"""
+
+    name = "sqlite"
+    persistent = True
+    shared = True
+    blocking = True
+
+    def __init__(self, path: str = STATE_DB_FILE):
+        self.path = path
+        self._start_io_thread()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, payload TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS queue_order ON queue (name, priority, id)")
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, namespace, key, default=None):
+        rows = self._execute("SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+        return loads(rows[0][0]) if rows else default
+
+    def set(self, namespace, key, value):
+        self._execute(
+            "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+            (namespace, key, dumps(value)),
+        )
+
+    def delete(self, namespace, key):
+        self._execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def update(self, namespace, key, func, default=None):
+        with self._lock:
+            # Чтение и запись под блокировкой записи БД: другой процесс не вклинится между ними
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                value = func(loads(row[0]) if row else default)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                    (namespace, key, dumps(value)),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return value
+
+    def keys(self, namespace):
+        return [row[0] for row in self._execute("SELECT key FROM kv WHERE namespace = ?", (namespace,))]
+
+    def items(self, namespace):
+        rows = self._execute("SELECT key, value FROM kv WHERE namespace = ?", (namespace,))
+        return [(key, loads(value)) for key, value in rows]
+
+    def count(self, namespace):
+        return self._execute("SELECT COUNT(*) FROM kv WHERE namespace = ?", (namespace,))[0][0]
+
+    def clear(self, namespace):
+        self._execute("DELETE FROM kv WHERE namespace = ?", (namespace,))
+
+    def queue_push(self, name, item, priority=0):
+        self._execute(
+            "INSERT INTO queue (name, priority, payload) VALUES (?, ?, ?)",
+            (name, priority, dumps(item)),
+        )
+
+    def queue_pop(self, name):
+        with self._lock:
+            # BEGIN IMMEDIATE сразу берет блокировку записи: другой процесс не заберет ту же задачу
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, payload FROM queue WHERE name = ? ORDER BY priority, id LIMIT 1", (name,)
+                ).fetchone()
+                if row:
+                    self._conn.execute("DELETE FROM queue WHERE id = ?", (row[0],))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return loads(row[1]) if row else None
+
+    def queue_size(self, name):
+        return self._execute("SELECT COUNT(*) FROM queue WHERE name = ?", (name,))[0][0]
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+
+
+class RedisBackend(StateBackend):
+    """Состояние в Redis: пространство имён - hash, очередь - sorted set"""
+
+    name = "redis"
+    persistent = True
+    shared = True
+    blocking = True
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = STATE_REDIS_PREFIX, client=None):
+        # client можно передать явно, например fakeredis.FakeRedis() в тестах
+        if client is None:
+            if not REDIS_AVAILABLE:
+                raise RuntimeError("пакет redis не установлен")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.client.ping()
+        self._start_io_thread()
+
+    def _hash(self, namespace: str) -> str:
+        return f"{self.prefix}{namespace}"
+
+    def _queue(self, name: str) -> str:
+        return f"{self.prefix}queue:{name}"
+
+    @staticmethod
+    def _str(value) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def get(self, namespace, key, default=None):
+        value = self.client.hget(self._hash(namespace), key)
+        return loads(value) if value is not None else default
+
+    def set(self, namespace, key, value):
+        self.client.hset(self._hash(namespace), key, dumps(value))
+
+    def delete(self, namespace, key):
+        self.client.hdel(self._hash(namespace), key)
+
+    def update(self, namespace, key, func, default=None):
+        name = self._hash(namespace)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    # WATCH/MULTI: если hash изменили между чтением и записью, EXEC не выполнится
+                    pipe.watch(name)
+                    current = pipe.hget(name, key)
+                    value = func(loads(current) if current is not None else default)
+                    pipe.multi()
+                    pipe.hset(name, key, dumps(value))
+                    pipe.execute()
+                    return value
+                except redis.WatchError:
+                    continue
+
+    def keys(self, namespace):
+        return [self._str(key) for key in self.client.hkeys(self._hash(namespace))]
+
+    def items(self, namespace):
+        return [(self._str(key), loads(value)) for key, value in self.client.hgetall(self._hash(namespace)).items()]
+
+    def count(self, namespace):
+        return self.client.hlen(self._hash(namespace))
+
+    def clear(self, namespace):
+        self.client.delete(self._hash(namespace))
+
+    def queue_push(self, name, item, priority=0):
+        # Порядковый номер в начале элемента сохраняет FIFO при равном приоритете
+        seq = self.client.incr(f"{self.prefix}queue_seq")
+        self.client.zadd(self._queue(name), {f"{seq:020d}:{dumps(item)}": priority})
+
+    def queue_pop(self, name):
+        popped = self.client.zpopmin(self._queue(name))
+        if not popped:
+            return None
+        member = self._str(popped[0][0])
+        return loads(member.split(":", 1)[1])
+
+    def queue_size(self, name):
+        return self.client.zcard(self._queue(name))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+_MISSING_JSON = None  # Ключа еще нет в хранилище (значения в нем - JSON, поэтому None)
+
+
+def _merge(base, local, stored, name: str = ""):
+    """
+    Накладывает изменения local относительно base (прочитанного значения) на
+    stored - значение, которое сейчас в хранилище и могло быть изменено другим
+    процессом.
+    """
+    if stored == base:
+        return local
+    if isinstance(base, list) and isinstance(local, list) and isinstance(stored, list):
+        if local[:len(base)] == base:
+            # Только добавления в конец - добавляем их к чужой версии
+            return stored + [item for item in local[len(base):] if item not in stored]
+    if isinstance(base, dict) and isinstance(local, dict) and isinstance(stored, dict):
+        merged = dict(stored)
+        for field in set(base) | set(local):
+            if field not in local:
+                merged.pop(field, None)
+            elif field not in base or local[field] != base[field]:
+                merged[field] = local[field]
+        return merged
+    logging.warning(f"⚠️ Конфликт записи {name}: значение изменено другим процессом, сохраняем локальное")
+    return local
+
+
+class BackendDict(MutableMapping):
+    """Пространство имён хранилища в виде словаря"""
+
+    def __init__(self, backend: StateBackend, namespace: str, cache_ttl: float = STATE_CACHE_TTL):
+        self.backend = backend
+        self.namespace = namespace
+        self.cache_ttl = cache_ttl
+        # ключ -> (значение или _MISSING, JSON на момент чтения, время чтения); только для общих хранилищ
+        self._cache: Dict[str, Tuple[Any, Optional[str], float]] = {}
+        _mappings.append(self)
+
+    def _io(self, func, *args):
+        return self.backend.call(func, *args)
+
+    def _remember(self, key, value):
+        if self.backend.shared:
+            # Отсутствие ключа тоже запоминается: повторные "in" не ходят в хранилище
+            snapshot = None if value is _MISSING else dumps(value)
+            self._cache[key] = (value, snapshot, time.monotonic())
+        return value
+
+    def _fresh(self, key):
+        """Запись кэша, которой еще можно доверять, или None"""
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[2] < self.cache_ttl:
+            return cached
+        return None
+
+    def _sync(self, key):
+        """Записывает значение обратно, если код изменил его на месте"""
+        value, snapshot, _ = self._cache.pop(key)
+        if value is _MISSING:
+            return
+        current = dumps(value)
+        if current != snapshot:
+            base, local = loads(snapshot), loads(current)  # Копии: значение могут менять дальше, пока идет запись
+            self.backend.write_behind(self.backend.update, self.namespace, key,
+                                      lambda stored: _merge(base, local, stored, f"{self.namespace}/{key}"),
+                                      _MISSING_JSON)
+
+    async def prefetch(self, *keys):
+        """
+        Читает ключи в потоке хранилища, не блокируя event loop: обработчик
+        обновления потом берет их из кэша.
+        """
+        if not self.backend.shared:
+            return
+        keys = [str(key) for key in keys if self._fresh(str(key)) is None]
+        if not keys:
+            return
+        for key in keys:
+            if key in self._cache:
+                self._sync(key)
+        started = time.monotonic()
+        values = await self.backend.run_async(
+            lambda: [self.backend.get(self.namespace, key, _MISSING) for key in keys])
+        for key, value in zip(keys, values):
+            cached = self._cache.get(key)
+            # Пока шло чтение, ключ мог быть записан - его значение новее прочитанного
+            if cached is None or cached[2] < started:
+                self._remember(key, value)
+
+    def mutate(self, key, func: Callable[[Any], Any], default=None, wait: bool = True):
+        """
+        Атомарно заменяет значение на func(текущее значение или default) и
+        возвращает новое. func может вызываться несколько раз (повтор при
+        конфликте), поэтому должна возвращать новое значение, не меняя старое.
+
+        Если ключ уже в кэше, запись уходит в поток хранилища без ожидания, а
+        возвращается func от значения из кэша. wait=False - не ждать записи
+        в любом случае (результат не нужен, возвращается None).
+        """
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] is not _MISSING and dumps(cached[0]) != cached[1]:
+            # Несохраненные изменения на месте - сначала записываем их
+            self._sync(key)
+            cached = None
+        if not wait and (cached is None or self._fresh(key) is None):
+            self._cache.pop(key, None)
+            self.backend.write_behind(self.backend.update, self.namespace, key, func, default)
+            return None
+        if cached is not None and self._fresh(key) is not None:
+            value = func(default if cached[0] is _MISSING else cached[0])
+            self.backend.write_behind(self.backend.update, self.namespace, key, func, default)
+        else:
+            value = self._io(self.backend.update, self.namespace, key, func, default)
+        return self._remember(key, value)
+
+    def __getitem__(self, key):
+        cached = self._cache.get(key)
+        if cached is not None:
+            if time.monotonic() - cached[2] < self.cache_ttl:
+                if cached[0] is _MISSING:
+                    raise KeyError(key)
+                return cached[0]
+            self._sync(key)
+        value = self._remember(key, self._io(self.backend.get, self.namespace, key, _MISSING))
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._remember(key, value)
+        if self.backend.blocking:
+            # Копия: значение могут изменить на месте раньше, чем оно запишется
+            self.backend.write_behind(self.backend.set, self.namespace, key, loads(dumps(value)))
+        else:
+            self.backend.set(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        cached = self._fresh(key)
+        if cached is not None:
+            exists = cached[0] is not _MISSING
+        else:
+            exists = self._io(self.backend.get, self.namespace, key, _MISSING) is not _MISSING
+        self._cache.pop(key, None)
+        if not exists:
+            raise KeyError(key)
+        self.backend.write_behind(self.backend.delete, self.namespace, key)
+        self._remember(key, _MISSING)
+
+    def __iter__(self):
+        return iter(self._io(self.backend.keys, self.namespace))
+
+    def __len__(self):
+        return self._io(self.backend.count, self.namespace)
+
+    def items(self):
+        # Одним запросом вместо запроса на каждый ключ
+        result = []
+        for key, value in self._io(self.backend.items, self.namespace):
+            cached = self._fresh(key)
+            if cached is not None and cached[0] is not _MISSING:
+                value = cached[0]
+            else:
+                cached = self._cache.get(key)
+                if cached is not None and cached[0] is not _MISSING:
+                    # Прочитанное раньше значение устарело: локальные изменения записываем, берем свежее
+                    self._sync(key)
+                    if dumps(cached[0]) != cached[1]:
+                        value = self._io(self.backend.get, self.namespace, key, value)
+                self._remember(key, value)
+            result.append((key, value))
+        return result
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def clear(self):
+        self._cache.clear()
+        self._io(self.backend.clear, self.namespace)
+
+    def flush(self):
+        """Записывает измененные на месте значения и сбрасывает локальный кэш"""
+        for key in list(self._cache):
+            try:
+                self._sync(key)
+            except Exception as e:
+                logging.error(f"❌ Ошибка записи {self.namespace}/{key} в хранилище: {e}")
+
+
+_mappings: List[BackendDict] = []
+
+
+def flush_mappings():
+    """Сбрасывает изменения всех BackendDict процесса в хранилище"""
+    for mapping in _mappings:
+        mapping.flush()
+
+
+async def close_state():
+    """При остановке: сбрасывает изменения и ждет, пока они запишутся"""
+    flush_mappings()
+    await state_backend.drain()
+
+
+class BackendFSMStorage(BaseStorage):
+    """Хранилище состояний FSM aiogram поверх StateBackend"""
+
+    STATE_NAMESPACE = "fsm_state"
+    DATA_NAMESPACE = "fsm_data"
+
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id,
+            getattr(key, "thread_id", None), getattr(key, "business_connection_id", None),
+            getattr(key, "destiny", "default"),
+        ))
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        value = state.state if isinstance(state, State) else state
+        if value is None:
+            await self.backend.run_async(self.backend.delete, self.STATE_NAMESPACE, self._key(key))
+        else:
+            await self.backend.run_async(self.backend.set, self.STATE_NAMESPACE, self._key(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.backend.run_async(self.backend.get, self.STATE_NAMESPACE, self._key(key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        if data:
+            await self.backend.run_async(self.backend.set, self.DATA_NAMESPACE, self._key(key), dict(data))
+        else:
+            await self.backend.run_async(self.backend.delete, self.DATA_NAMESPACE, self._key(key))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(await self.backend.run_async(self.backend.get, self.DATA_NAMESPACE, self._key(key)) or {})
+
+    async def close(self) -> None:
+        pass
+
+
+def create_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    """Создает хранилище по имени; при ошибке подключения откатывается к памяти"""
+    try:
+        if kind == "sqlite":
+            backend = SQLiteBackend(STATE_DB_FILE)
+        elif kind == "redis":
+            backend = RedisBackend(REDIS_URL)
+        else:
+            backend = MemoryBackend()
+        logging.info(f"🗄️ Хранилище состояния: {backend.name}")
+        return backend
+    except Exception as e:
+        logging.error(f"❌ Не удалось подключить хранилище {kind}: {e}, используем память процесса")
+        return MemoryBackend()
+
+
+state_backend = create_backend()
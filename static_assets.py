@@ -0,0 +1,185 @@
+"""
+file_id статичных картинок (bear.png и т.п.) вместо повторной выгрузки.
+
+Почти каждый переход по меню отправляет или подставляет в сообщение
+bear.png через FSInputFile, то есть каждый раз выгружает файл в Telegram.
+StaticAssetsMiddleware - middleware сессии Bot: первая отправка выгружает
+файл, file_id из ответа запоминается, а дальше в запросы вместо файла
+подставляется file_id. Вызовы answer_photo/edit_media менять не нужно.
+
+file_id хранится в state_backend по боту и пути файла вместе с размером и
+mtime: если картинку заменили, она выгружается заново. Если Telegram
+отклоняет file_id, он забывается и запрос повторяется с выгрузкой файла.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Callable, Dict, MutableMapping, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageMedia, SendAnimation, SendDocument, SendPhoto, SendVideo
+from aiogram.types import FSInputFile
+
+import metrics
+
+STATIC_ASSETS = ("bear.png",)  # Файлы, которые отправляются по file_id после первой выгрузки
+
+# Метод отправки -> поле с файлом (оно же - тип медиа в ответе)
+SEND_FIELDS = {SendPhoto: "photo", SendAnimation: "animation", SendVideo: "video", SendDocument: "document"}
+
+# Ответы Telegram, означающие, что file_id больше не годится
+REJECTED_FILE_ID_ERRORS = (
+    "wrong file identifier", "wrong remote file identifier", "file reference", "file_reference",
+    "wrong type of the web page content", "can't use file of type", "type of file mismatch", "media_empty",
+)
+
+
+class StaticAssets:
+    """Реестр file_id статичных файлов"""
+
+    def __init__(self, records: MutableMapping, save: Optional[Callable[[], None]] = None,
+                 paths=STATIC_ASSETS):
+        self.records = records  # "<id бота>:<путь>" -> {"file_id", "size", "mtime"}, хранится в state_backend
+        self.save = save  # Сохраняет records, если хранилище не переживает перезапуск
+        self.paths = {self._path(path) for path in paths}
+        self.sends: Dict[str, int] = {"file_id": 0, "upload": 0, "reupload": 0}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _path(path: str) -> str:
+        return os.path.normpath(path)
+
+    @staticmethod
+    def _fingerprint(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _saved(self):
+        if self.save is not None:
+            try:
+                self.save()
+            except Exception as e:
+                logging.error(f"❌ Не удалось сохранить file_id статичных файлов: {e}")
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    # --- Реестр ---
+
+    def file_id(self, key: str, path: str) -> Optional[str]:
+        """Сохраненный file_id, если файл с тех пор не менялся"""
+        record = self.records.get(key)
+        if not record:
+            return None
+        if (record.get("size"), record.get("mtime")) != self._fingerprint(path):
+            return None
+        return record.get("file_id")
+
+    def remember(self, key: str, path: str, file_id: str):
+        fingerprint = self._fingerprint(path)
+        if fingerprint is None:
+            return
+        self.records[key] = {"file_id": file_id, "size": fingerprint[0], "mtime": fingerprint[1]}
+        self._saved()
+
+    def forget(self, key: str):
+        try:
+            del self.records[key]
+        except KeyError:
+            return
+        self._saved()
+
+    # --- Запросы ---
+
+    def asset_of(self, method) -> Optional[Tuple[str, str]]:
+        """(путь, тип медиа), если запрос выгружает один из статичных файлов"""
+        if isinstance(method, EditMessageMedia):
+            value = method.media.media
+            kind = getattr(method.media.type, "value", method.media.type)
+        else:
+            field = SEND_FIELDS.get(type(method))
+            if field is None:
+                return None
+            value = getattr(method, field)
+            kind = field
+        if not isinstance(value, FSInputFile):
+            return None
+        path = self._path(value.path)
+        return (path, str(kind)) if path in self.paths else None
+
+    @staticmethod
+    def _with_file_id(method, file_id: str):
+        if isinstance(method, EditMessageMedia):
+            return method.model_copy(update={"media": method.media.model_copy(update={"media": file_id})})
+        return method.model_copy(update={SEND_FIELDS[type(method)]: file_id})
+
+    @staticmethod
+    def _result_file_id(result, kind: str) -> Optional[str]:
+        media = getattr(result, kind, None)
+        if isinstance(media, list):
+            media = media[-1] if media else None  # Фото - список размеров, берем самый большой
+        return getattr(media, "file_id", None)
+
+    async def _upload(self, make_request, bot, method, key: str, path: str, kind: str, mode: str):
+        result = await make_request(bot, method)
+        file_id = self._result_file_id(result, kind)
+        if file_id:
+            self.remember(key, path, file_id)
+        self.sends[mode] += 1
+        metrics.STATIC_ASSET_SENDS.labels(asset=path, mode=mode).inc()
+        return result
+
+    async def request(self, make_request, bot, method, path: str, kind: str):
+        """Запрос со статичным файлом: по file_id, а если его нет или он отклонен - с выгрузкой"""
+        key = f"{bot.id}:{path}"  # file_id действителен только для бота, который его получил
+        file_id = self.file_id(key, path)
+        if file_id is None:
+            # Первую выгрузку делает один запрос, остальные ждут его file_id
+            async with self._lock(key):
+                file_id = self.file_id(key, path)
+                if file_id is None:
+                    return await self._upload(make_request, bot, method, key, path, kind, "upload")
+        try:
+            result = await make_request(bot, self._with_file_id(method, file_id))
+        except TelegramBadRequest as e:
+            error = e.message.lower()
+            if not any(marker in error for marker in REJECTED_FILE_ID_ERRORS):
+                # В том числе "message is not modified": вызывающий ждет Message, у обработчиков есть запасной путь
+                raise
+            logging.warning(f"🖼 Telegram отклонил file_id для {path}: {e.message}. Выгружаем файл заново")
+            async with self._lock(key):
+                current = self.file_id(key, path)
+                if current == file_id:
+                    self.forget(key)
+                    current = None
+                if current is None:
+                    return await self._upload(make_request, bot, method, key, path, kind, "reupload")
+            file_id = current
+            result = await make_request(bot, self._with_file_id(method, file_id))
+        self.sends["file_id"] += 1
+        metrics.STATIC_ASSET_SENDS.labels(asset=path, mode="file_id").inc()
+        return result
+
+    def stats(self) -> dict:
+        return {"assets": len(self.records), **self.sends}
+
+
+class StaticAssetsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: статичные файлы отправляются по file_id"""
+
+    def __init__(self, assets: StaticAssets):
+        self.assets = assets
+
+    async def __call__(self, make_request, bot, method):
+        asset = self.assets.asset_of(method)
+        if asset is None:
+            return await make_request(bot, method)
+        return await self.assets.request(make_request, bot, method, *asset)
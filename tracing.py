@@ -0,0 +1,293 @@
+"""
+Лёгкая трассировка обработки обновлений.
+
+Каждое обновление - один трейс (корневой спан update.<тип>), внутри него
+вложенные спаны: ожидание в полосе (queue), провайдеры поиска, кэш,
+скачивание и конвертация, запросы к Telegram (tg.SendAudio,
+tg.EditMessageText, ...), запись на диск. Текущий спан хранится в
+contextvars, поэтому задачи, созданные из обработчика, попадают в его трейс.
+
+Завершённые трейсы лежат в кольцевом буфере (TRACE_BUFFER_SIZE), длительности
+спанов по именам - в окнах для перцентилей (/perf). При заданном
+TRACE_EXPORT_FILE трейсы дописываются в файл в формате OTLP/JSON (одна
+строка - один ExportTraceServiceRequest) из фонового потока.
+
+    @tracer.traced("cache.search")
+    def get_cached_search(query): ...
+
+    with tracer.span("search.youtube", query=query):
+        results = await youtube_client.search(query, limit)
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+TRACE_BUFFER_SIZE = 200  # Сколько последних трейсов хранить
+TRACE_MAX_SPANS = 200  # Спанов в одном трейсе; лишние только считаются
+TRACE_STATS_WINDOW = 1000  # Последних длительностей каждого спана для перцентилей
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")  # Файл OTLP/JSON; не задан - экспорт выключен
+TRACE_SERVICE_NAME = "telegram-music-bot"
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    """Отрезок работы внутри трейса"""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "start_ns", "duration", "attrs", "status")
+
+    def __init__(self, name: str, trace: Optional["Trace"], parent_id: Optional[str], attrs: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.duration = 0.0
+        self.attrs = attrs
+        self.status = "ok"
+
+
+class Trace:
+    """Трейс одного обновления"""
+
+    __slots__ = ("trace_id", "root", "spans", "dropped")
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.root: Optional[Span] = None
+        self.spans: List[Span] = []
+        self.dropped = 0
+
+    @property
+    def duration(self) -> float:
+        return self.root.duration if self.root else 0.0
+
+
+class Tracer:
+    """Кольцевой буфер трейсов и статистика длительностей спанов"""
+
+    def __init__(self, buffer_size: int = TRACE_BUFFER_SIZE, stats_window: int = TRACE_STATS_WINDOW,
+                 export_file: Optional[str] = TRACE_EXPORT_FILE):
+        self.traces = deque(maxlen=buffer_size)
+        self.stats_window = stats_window
+        self.durations: Dict[str, deque] = {}
+        self.export_file = export_file
+        self._export_queue = None
+        self._export_thread = None
+
+    # --- Спаны ---
+
+    def _finish(self, span: Span):
+        window = self.durations.get(span.name)
+        if window is None:
+            window = self.durations[span.name] = deque(maxlen=self.stats_window)
+        window.append(span.duration)
+        trace = span.trace
+        if trace is not None and span is not trace.root:
+            if len(trace.spans) < TRACE_MAX_SPANS:
+                trace.spans.append(span)
+            else:
+                trace.dropped += 1
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Спан внутри текущего трейса; вне трейса учитывается только длительность"""
+        parent = _current_span.get()
+        trace = parent.trace if parent is not None else None
+        span = Span(name, trace, parent.span_id if parent is not None else None, attrs)
+        token = _current_span.set(span) if trace is not None else None
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            if token is not None:
+                _current_span.reset(token)
+            self._finish(span)
+
+    def record(self, name: str, duration: float, **attrs):
+        """Завершённый спан с известной длительностью (например, конвертация в воркере)"""
+        parent = _current_span.get()
+        span = Span(name, parent.trace if parent is not None else None,
+                    parent.span_id if parent is not None else None, attrs)
+        span.duration = duration
+        span.start_ns -= int(duration * 1e9)
+        self._finish(span)
+
+    def traced(self, name: str):
+        """Декоратор: вызов функции (обычной или async) - спан name"""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """Новый трейс с корневым спаном name"""
+        trace = Trace()
+        root = Span(name, trace, None, attrs)
+        trace.root = root
+        token = _current_span.set(root)
+        started = time.perf_counter()
+        try:
+            yield root
+        except BaseException as e:
+            root.status = "error"
+            root.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            root.duration = time.perf_counter() - started
+            _current_span.reset(token)
+            self._finish(root)
+            self.traces.append(trace)
+            if self.export_file:
+                self._export(trace)
+
+    # --- Отчеты ---
+
+    def percentiles(self) -> Dict[str, dict]:
+        """p50/p95/p99 по именам спанов (в секундах)"""
+        report = {}
+        for name, window in list(self.durations.items()):
+            values = sorted(window)
+            if not values:
+                continue
+            report[name] = {
+                "count": len(values),
+                "p50": _percentile(values, 0.50),
+                "p95": _percentile(values, 0.95),
+                "p99": _percentile(values, 0.99),
+            }
+        return report
+
+    def slowest(self, limit: int = 5) -> List[Trace]:
+        return sorted(self.traces, key=lambda trace: trace.duration, reverse=True)[:limit]
+
+    # --- Экспорт OTLP/JSON ---
+
+    def _export(self, trace: Trace):
+        if self._export_thread is None:
+            self._export_queue = queue.Queue(TRACE_BUFFER_SIZE * 10)
+            self._export_thread = threading.Thread(target=self._export_loop, name="trace_exporter", daemon=True)
+            self._export_thread.start()
+        try:
+            self._export_queue.put_nowait(trace)
+        except queue.Full:
+            logging.warning("⚠️ Очередь экспорта трейсов переполнена, трейс пропущен")
+
+    def _export_loop(self):
+        while True:
+            trace = self._export_queue.get()
+            try:
+                line = json.dumps(to_otlp(trace), ensure_ascii=False)
+                with open(self.export_file, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except Exception as e:
+                logging.error(f"❌ Ошибка экспорта трейса в {self.export_file}: {e}")
+
+
+def _percentile(values: List[float], q: float) -> float:
+    index = min(len(values) - 1, max(0, int(q * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Trace) -> dict:
+    """Трейс в формате OTLP/JSON (ExportTraceServiceRequest)"""
+    spans = []
+    for span in [trace.root] + trace.spans:
+        item = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.start_ns + int(span.duration * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attrs.items()],
+            "status": {"code": 2 if span.status == "error" else 1},
+        }
+        if span.parent_id:
+            item["parentSpanId"] = span.parent_id
+        spans.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+        }]
+    }
+
+
+tracer = Tracer()
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    Middleware для dp.update: трейс на каждое обновление. Регистрируется после
+    UpdateExecutorMiddleware, чтобы трейс шел в полосе чата, а ожидание в полосе
+    попадало в спан queue.
+    """
+
+    def __init__(self, tracer: Tracer = tracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        attrs = {"update_id": getattr(event, "update_id", None)}
+        if chat:
+            attrs["chat_id"] = chat.id
+        if user:
+            attrs["user_id"] = user.id
+        with self.tracer.trace(f"update.{getattr(event, 'event_type', 'unknown')}", **attrs):
+            enqueued_at = data.get("update_enqueued_at")
+            if enqueued_at is not None:
+                self.tracer.record("queue", time.monotonic() - enqueued_at)
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: каждый запрос к Telegram - спан tg.<метод>"""
+
+    def __init__(self, tracer: Tracer = tracer):
+        self.tracer = tracer
+
+    async def __call__(self, make_request, bot, method):
+        with self.tracer.span(f"tg.{type(method).__name__}"):
+            return await make_request(bot, method)
@@ -0,0 +1,221 @@
+"""
+Локальный инвертированный индекс треков, которые бот уже видел.
+
+В индекс попадают результаты поиска, скачанные треки и треки из коллекций
+пользователей. Документ - трек (id/url, название, длительность, источник),
+термы - нормализованные слова названия и пары соседних слов. Поиск
+ранжирует документы по BM25 и отдаёт "локальные попадания" только если
+найдено достаточно уверенных совпадений (все слова запроса есть в названии),
+иначе вызывающий код идёт к сетевым провайдерам.
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from canonical import media_key, normalize_query
+
+TRACK_INDEX_FILE = os.path.join(os.path.dirname(__file__), "track_index.json")
+TRACK_INDEX_MAX_DOCS = 50000  # При превышении вытесняются давно не встречавшиеся треки
+TRACK_INDEX_MIN_HITS = 3  # Сколько уверенных совпадений нужно, чтобы ответить из индекса
+TRACK_INDEX_MAX_DURATION = 600  # Как и в search_music, длинные треки не показываем
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def _terms(title: str) -> List[str]:
+    """Слова и пары соседних слов нормализованного названия"""
+    words = normalize_query(title).split()
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class TrackIndex:
+    """Инвертированный индекс названий треков с ранжированием BM25"""
+
+    def __init__(self, max_docs: int = TRACK_INDEX_MAX_DOCS, min_hits: int = TRACK_INDEX_MIN_HITS):
+        self.max_docs = max_docs
+        self.min_hits = min_hits
+        self.docs: "OrderedDict[str, dict]" = OrderedDict()  # ключ трека -> результат поиска
+        self.doc_terms: Dict[str, Dict[str, int]] = {}  # ключ трека -> {терм: tf}
+        self.postings: Dict[str, Dict[str, int]] = {}  # терм -> {ключ трека: tf}
+        self.total_length = 0
+        self.lookups = 0
+        self.hits = 0
+        self.dirty = False
+
+    # --- Наполнение ---
+
+    def add(self, result: dict, source: Optional[str] = None) -> bool:
+        """Добавляет результат поиска ({'id'|'url', 'title', 'duration', 'source'})"""
+        if not result or not isinstance(result, dict):
+            return False
+        title = result.get("title")
+        source = result.get("source") or source
+        url = result.get("url") or ""
+        if source == "yt" and result.get("id"):
+            key = f"yt:{result['id']}"
+        elif url:
+            key = media_key(url)
+        else:
+            return False
+        if not title or key.startswith("url:"):
+            return False
+
+        if key in self.docs:
+            # Трек уже есть - только отмечаем, что он снова встретился
+            self.docs.move_to_end(key)
+            return True
+
+        doc = {"title": title, "duration": result.get("duration") or 0}
+        if key.startswith("yt:"):
+            doc.update({"id": key[3:], "url": f"https://www.youtube.com/watch?v={key[3:]}", "source": "yt"})
+        else:
+            doc.update({"url": f"https://soundcloud.com/{key[3:]}", "source": "sc"})
+
+        terms: Dict[str, int] = {}
+        for term in _terms(title):
+            terms[term] = terms.get(term, 0) + 1
+        if not terms:
+            return False
+
+        self.docs[key] = doc
+        self.doc_terms[key] = terms
+        self.total_length += sum(terms.values())
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[key] = tf
+        self.dirty = True
+
+        while len(self.docs) > self.max_docs:
+            self._remove(next(iter(self.docs)))
+        return True
+
+    def add_results(self, results) -> int:
+        added = 0
+        for result in results or []:
+            if self.add(result):
+                added += 1
+        return added
+
+    def add_collection_track(self, track: dict) -> bool:
+        """Добавляет трек из коллекции пользователя (название - имя файла, ссылка - original_url)"""
+        if not isinstance(track, dict) or not track.get("original_url"):
+            return False
+        title = os.path.splitext(track.get("title") or "")[0]
+        return self.add({"title": title, "url": track["original_url"], "duration": track.get("duration", 0)})
+
+    def add_collections(self, user_tracks: dict) -> int:
+        added = 0
+        for tracks in (user_tracks or {}).values():
+            for track in tracks or []:
+                if self.add_collection_track(track):
+                    added += 1
+        return added
+
+    def _remove(self, key: str):
+        self.docs.pop(key, None)
+        terms = self.doc_terms.pop(key, {})
+        self.total_length -= sum(terms.values())
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[term]
+
+    # --- Поиск ---
+
+    def search(self, query: str, limit: int = 5) -> Optional[List[dict]]:
+        """
+        Возвращает до limit треков, если уверенных совпадений не меньше min_hits,
+        иначе None (нужно идти в сеть).
+        """
+        self.lookups += 1
+        words = normalize_query(query).split()
+        if not words or not self.docs:
+            return None
+
+        # Уверенное совпадение - документ содержит все слова запроса
+        candidates = None
+        for word in set(words):
+            posting = self.postings.get(word)
+            if not posting:
+                return None
+            keys = set(posting)
+            candidates = keys if candidates is None else candidates & keys
+            if not candidates:
+                return None
+
+        candidates = [
+            key for key in candidates
+            if (self.docs[key].get("duration") or 0) <= TRACK_INDEX_MAX_DURATION
+        ]
+        if len(candidates) < self.min_hits:
+            return None
+
+        query_terms = _terms(query)
+        n_docs = len(self.docs)
+        avg_length = self.total_length / n_docs if n_docs else 1.0
+        scores = {}
+        for key in candidates:
+            doc_terms = self.doc_terms[key]
+            doc_length = sum(doc_terms.values())
+            score = 0.0
+            for term in query_terms:
+                tf = doc_terms.get(term)
+                if not tf:
+                    continue
+                df = len(self.postings.get(term, ()))
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avg_length))
+            scores[key] = score
+
+        ranked = sorted(candidates, key=lambda key: (-scores[key], len(self.docs[key]["title"])))
+        self.hits += 1
+        return [dict(self.docs[key]) for key in ranked[:limit]]
+
+    # --- Статистика и сохранение ---
+
+    def stats(self) -> dict:
+        return {
+            "docs": len(self.docs),
+            "terms": len(self.postings),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": (self.hits / self.lookups) if self.lookups else 0.0,
+        }
+
+    def save(self, path: str = TRACK_INDEX_FILE) -> bool:
+        """Сохраняет документы (постинги перестраиваются при загрузке)"""
+        if not self.dirty:
+            return True
+        try:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"time": time.time(), "docs": list(self.docs.values())}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self.dirty = False
+            return True
+        except Exception as e:
+            logging.error(f"❌ Ошибка сохранения индекса треков: {e}")
+            return False
+
+    def load(self, path: str = TRACK_INDEX_FILE) -> int:
+        try:
+            if not os.path.exists(path):
+                return 0
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            added = self.add_results(data.get("docs", []))
+            self.dirty = False
+            return added
+        except Exception as e:
+            logging.error(f"❌ Ошибка загрузки индекса треков: {e}")
+            return 0
+
+
+track_index = TrackIndex()
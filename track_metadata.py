@@ -0,0 +1,222 @@
+"""
+Метаданные трека, собранные один раз при скачивании.
+
+Из info yt-dlp берутся длительность, исполнитель, название, кодек и битрейт,
+обложка скачивается и уменьшается до THUMBNAIL_SIZE пикселей (JPEG, как
+требует Telegram для thumbnail). Обложка качается в фоне, чтобы не задерживать
+загрузку трека: в записи сразу стоит ее будущий путь, а audio_kwargs передает
+ее, только когда файл уже есть. Метаданные запоминаются по пути файла, а при
+добавлении трека в коллекцию копируются в его запись - при каждой отправке
+они передаются в answer_audio готовыми, без повторного разбора:
+
+    await message.answer_audio(types.FSInputFile(path),
+                               **audio_kwargs(track_metadata.lookup(path), title=title))
+
+Без Pillow обложки не делаются, остальные поля сохраняются.
+"""
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from aiogram import types
+
+from http_pool import get_session
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+    logging.warning("🐻‍❄️ Модуль Pillow не найден. Обложки треков не будут создаваться.")
+
+THUMBNAIL_DIR = os.path.join("cache", "thumbs")
+THUMBNAIL_SIZE = 320  # Максимальная сторона обложки (ограничение Telegram)
+THUMBNAIL_MAX_BYTES = 200 * 1024  # Больше Telegram обложку не примет
+THUMBNAIL_SOURCE_MAX_BYTES = 5 * 1024 * 1024  # Исходные картинки больше не скачиваем
+THUMBNAIL_TIMEOUT = 5  # Секунд на скачивание обложки
+THUMBNAIL_MAX_FILES = 5000  # Сколько обложек хранить; лишние, самые старые, удаляются при prune()
+METADATA_CACHE_SIZE = 2000  # Сколько записей путь -> метаданные держать в памяти
+
+# Поля метаданных в записи трека коллекции
+META_FIELDS = ("duration", "artist", "track_title", "codec", "bitrate", "thumbnail")
+
+
+def extract_metadata(info: dict, filename: Optional[str] = None, bitrate: Optional[int] = None) -> dict:
+    """
+    Поля трека из info yt-dlp. После конвертации в mp3 кодек и битрейт
+    определяются файлом и качеством конвертации (bitrate), а не источником.
+    """
+    info = info or {}
+    duration = info.get("duration")
+    artist = (info.get("artist") or info.get("creator") or info.get("uploader")
+              or info.get("channel") or "")
+    title = info.get("track") or info.get("title") or ""
+    ext = os.path.splitext(filename)[1].lstrip(".").lower() if filename else ""
+    if ext == "mp3":
+        codec = "mp3"
+    else:
+        codec = info.get("acodec") if info.get("acodec") not in (None, "none") else ext
+    abr = bitrate if bitrate and codec == "mp3" else info.get("abr")
+    return {
+        "duration": int(round(duration)) if isinstance(duration, (int, float)) and duration > 0 else 0,
+        "artist": str(artist)[:64],
+        "track_title": str(title)[:64],
+        "codec": codec or "",
+        "bitrate": int(abr) if isinstance(abr, (int, float)) and abr > 0 else 0,
+        "thumbnail": None,
+    }
+
+
+def track_fields(meta: Optional[dict]) -> dict:
+    """Поля метаданных для записи трека в коллекции"""
+    return {field: meta.get(field) for field in META_FIELDS} if meta else {}
+
+
+def audio_kwargs(meta: Optional[dict], title: Optional[str] = None, performer: Optional[str] = None,
+                 duration: Optional[int] = None) -> dict:
+    """
+    Аргументы answer_audio: сохраненные метаданные, а если их нет - то, что
+    известно вызывающему (название из результатов поиска и т.п.).
+    """
+    meta = meta or {}
+    kwargs = {
+        "title": meta.get("track_title") or title,
+        "performer": meta.get("artist") or performer,
+        "duration": meta.get("duration") or duration or None,
+    }
+    thumbnail = meta.get("thumbnail")
+    if thumbnail and os.path.exists(thumbnail):
+        kwargs["thumbnail"] = types.FSInputFile(thumbnail)
+    return {key: value for key, value in kwargs.items() if value}
+
+
+def resize_thumbnail(data: bytes, size: int = THUMBNAIL_SIZE) -> Optional[bytes]:
+    """Картинка -> JPEG не больше size x size и THUMBNAIL_MAX_BYTES (блокирующая)"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail((size, size))
+        for quality in (85, 70, 50):
+            out = io.BytesIO()
+            image.save(out, "JPEG", quality=quality, optimize=True)
+            if out.tell() <= THUMBNAIL_MAX_BYTES:
+                return out.getvalue()
+    return None
+
+
+class TrackMetadata:
+    """Метаданные по пути файла и кэш обложек на диске"""
+
+    def __init__(self, thumbnail_dir: str = THUMBNAIL_DIR, max_entries: int = METADATA_CACHE_SIZE):
+        self.thumbnail_dir = thumbnail_dir
+        self.max_entries = max_entries
+        self._by_file: "OrderedDict[str, dict]" = OrderedDict()
+        self._thumbnail_tasks: Dict[str, asyncio.Task] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path)
+
+    def remember(self, path: str, meta: dict):
+        with self._lock:
+            key = self._key(path)
+            self._by_file[key] = meta
+            self._by_file.move_to_end(key)
+            while len(self._by_file) > self.max_entries:
+                self._by_file.popitem(last=False)
+
+    def lookup(self, path: Optional[str]) -> Optional[dict]:
+        if not path:
+            return None
+        with self._lock:
+            return self._by_file.get(self._key(path))
+
+    # --- Обложки ---
+
+    def thumbnail_path(self, info: dict, filename: str) -> str:
+        source = f"{info.get('extractor_key') or ''}:{info.get('id') or ''}" if info.get("id") else filename
+        name = hashlib.sha1(source.encode("utf-8")).hexdigest()[:20]
+        return os.path.join(self.thumbnail_dir, f"{name}.jpg")
+
+    async def _fetch_thumbnail(self, url: str, path: str) -> Optional[str]:
+        try:
+            session = get_session("thumbnails", timeout=THUMBNAIL_TIMEOUT)
+            async with session.get(url) as response:
+                if response.status != 200:
+                    return None
+                data = await response.content.read(THUMBNAIL_SOURCE_MAX_BYTES + 1)
+            if len(data) > THUMBNAIL_SOURCE_MAX_BYTES:
+                return None
+            loop = asyncio.get_running_loop()
+            jpeg = await loop.run_in_executor(None, resize_thumbnail, data)
+            if not jpeg:
+                return None
+            os.makedirs(self.thumbnail_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(jpeg)
+            os.replace(tmp_path, path)
+            return path
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось получить обложку {url}: {e}")
+            return None
+
+    def _thumbnail_task(self, info: dict, filename: str) -> Optional[asyncio.Task]:
+        """Фоновая загрузка обложки (одна на трек) или None, если она уже есть или ее не будет"""
+        url = info.get("thumbnail")
+        if not PIL_AVAILABLE or not url:
+            return None
+        path = self.thumbnail_path(info, filename)
+        if os.path.exists(path):
+            return None
+        task = self._thumbnail_tasks.get(path)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_thumbnail(url, path))
+            self._thumbnail_tasks[path] = task
+            task.add_done_callback(lambda _: self._thumbnail_tasks.pop(path, None))
+        return task
+
+    def ingest(self, filename: str, info: dict, bitrate: Optional[int] = None) -> dict:
+        """
+        Запоминает метаданные скачанного файла сразу, не дожидаясь обложки:
+        в записи - путь, по которому она появится. Если обложку получить не
+        удалось, путь из записи убирается.
+        """
+        info = info or {}
+        meta = extract_metadata(info, filename, bitrate)
+        task = self._thumbnail_task(info, filename)
+        if PIL_AVAILABLE and info.get("thumbnail"):
+            meta["thumbnail"] = self.thumbnail_path(info, filename)
+        if task is not None:
+            def attach(done: asyncio.Task):
+                if done.cancelled() or done.result() is None:
+                    meta["thumbnail"] = None
+            task.add_done_callback(attach)
+        self.remember(filename, meta)
+        return meta
+
+    def prune(self, max_files: int = THUMBNAIL_MAX_FILES) -> int:
+        """Удаляет самые старые обложки сверх max_files"""
+        try:
+            with os.scandir(self.thumbnail_dir) as entries:
+                files = [(entry.stat().st_mtime, entry.path) for entry in entries
+                         if entry.name.endswith(".jpg") and entry.is_file()]
+        except FileNotFoundError:
+            return 0
+        removed = 0
+        for _, path in sorted(files)[:max(0, len(files) - max_files)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+track_metadata = TrackMetadata()
@@ -0,0 +1,213 @@
+"""
+Исполнитель обновлений Telegram с упорядоченными полосами по chat_id.
+
+Обновления одного чата выполняются строго по очереди (в своей полосе),
+разные чаты - параллельно, но не больше max_concurrency обработчиков
+одновременно. Если в очередях скопилось max_pending обновлений, submit
+ждёт освобождения места (backpressure): при polling с handle_as_tasks=False
+это притормаживает чтение новых обновлений, а не плодит задачи без предела.
+
+Подключается как outer-middleware на dp.update:
+    dp.update.outer_middleware(UpdateExecutorMiddleware(update_executor))
+
+Обработчик выполняется в полосе уже после того, как ErrorsMiddleware
+диспетчера вернул управление, поэтому ошибки обработчиков передаются в
+dp.errors из самой полосы; необработанные там попадают в лог полосы.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+
+UPDATE_MAX_CONCURRENCY = 32  # Одновременно выполняемых обработчиков
+UPDATE_MAX_PENDING = 1000  # Обновлений в очередях до включения backpressure
+UPDATE_LANE_IDLE_TIMEOUT = 60  # Через сколько секунд простоя полоса удаляется
+LATENCY_EWMA_ALPHA = 0.2  # Вес нового замера в скользящем среднем
+
+
+def _worker_cancelled() -> bool:
+    """Отменяют ли саму текущую задачу (Task.cancelling() есть с Python 3.11)"""
+    task = asyncio.current_task()
+    cancelling = getattr(task, "cancelling", None)
+    return bool(cancelling()) if cancelling is not None else False
+
+
+class UpdateLane:
+    """Очередь обновлений одного чата и её статистика"""
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.worker = None
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.avg_latency = 0.0
+        self.max_latency = 0.0
+        self.avg_wait = 0.0
+        self.last_activity = time.monotonic()
+
+    def record(self, wait: float, latency: float, failed: bool):
+        self.processed += 1
+        if failed:
+            self.errors += 1
+        if self.processed == 1:
+            self.avg_latency = latency
+            self.avg_wait = wait
+        else:
+            self.avg_latency += LATENCY_EWMA_ALPHA * (latency - self.avg_latency)
+            self.avg_wait += LATENCY_EWMA_ALPHA * (wait - self.avg_wait)
+        self.max_latency = max(self.max_latency, latency)
+        self.last_activity = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "key": self.key,
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "errors": self.errors,
+            "avg_latency": self.avg_latency,
+            "max_latency": self.max_latency,
+            "avg_wait": self.avg_wait,
+        }
+
+
+class UpdateExecutor:
+    """Распределяет обработчики по полосам чатов с общим лимитом параллельности"""
+
+    def __init__(self, max_concurrency: int = UPDATE_MAX_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING,
+                 lane_idle_timeout: float = UPDATE_LANE_IDLE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.lane_idle_timeout = lane_idle_timeout
+        self.lanes: Dict[Hashable, UpdateLane] = {}
+        self.pending = 0
+        self.running = 0
+        self.processed = 0
+        self.backpressure_waits = 0
+        # Примитивы asyncio создаются при первом использовании - внутри работающего loop
+        self._semaphore = None
+        self._not_full = None
+
+    def _ensure_primitives(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._not_full = asyncio.Event()
+            self._not_full.set()
+
+    async def submit(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args):
+        """Ставит вызов func(*args) в полосу key; ждет, если очереди переполнены"""
+        self._ensure_primitives()
+        while self.pending >= self.max_pending:
+            self.backpressure_waits += 1
+            self._not_full.clear()
+            await self._not_full.wait()
+
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = UpdateLane(key)
+            self.lanes[key] = lane
+        if lane.worker is None or lane.worker.done():
+            # Новая полоса или воркер полосы завершился аварийно - без него очередь не разберется
+            lane.worker = asyncio.create_task(self._run_lane(lane))
+
+        lane.queue.append((func, args, time.monotonic()))
+        lane.max_depth = max(lane.max_depth, len(lane.queue))
+        self.pending += 1
+        lane.wakeup.set()
+
+    async def _run_lane(self, lane: UpdateLane):
+        while True:
+            if not lane.queue:
+                lane.wakeup.clear()
+                try:
+                    await asyncio.wait_for(lane.wakeup.wait(), timeout=self.lane_idle_timeout)
+                except asyncio.TimeoutError:
+                    if not lane.queue:
+                        # Полоса простаивает - удаляем (без await между проверкой и удалением)
+                        self.lanes.pop(lane.key, None)
+                        return
+                continue
+
+            func, args, enqueued_at = lane.queue.popleft()
+            failed = False
+            async with self._semaphore:
+                self.running += 1
+                started = time.monotonic()
+                try:
+                    await func(*args)
+                except asyncio.CancelledError:
+                    if _worker_cancelled():
+                        raise
+                    # Обработчик получил отмену изнутри (например, отмененную загрузку из shield) -
+                    # это ошибка обновления, а не остановка полосы
+                    failed = True
+                    logging.error(f"❌ Обработчик в полосе {lane.key} отменен")
+                except Exception as e:
+                    failed = True
+                    logging.error(f"❌ Ошибка обработчика в полосе {lane.key}: {e}")
+                finally:
+                    finished = time.monotonic()
+                    self.running -= 1
+                    self.pending -= 1
+                    self.processed += 1
+                    lane.record(started - enqueued_at, finished - started, failed)
+                    if self.pending < self.max_pending:
+                        self._not_full.set()
+
+    def stats(self, top: int = 10) -> dict:
+        lanes = [lane.stats() for lane in self.lanes.values()]
+        return {
+            "lanes": len(lanes),
+            "pending": self.pending,
+            "running": self.running,
+            "processed": self.processed,
+            "backpressure_waits": self.backpressure_waits,
+            "max_concurrency": self.max_concurrency,
+            "max_pending": self.max_pending,
+            "deepest": sorted(lanes, key=lambda s: s["depth"], reverse=True)[:top],
+            "slowest": sorted(lanes, key=lambda s: s["avg_latency"], reverse=True)[:top],
+        }
+
+
+class UpdateExecutorMiddleware(BaseMiddleware):
+    """Outer-middleware для dp.update: передает обработку обновления в полосу его чата"""
+
+    def __init__(self, executor: UpdateExecutor):
+        self.executor = executor
+
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = chat.id if chat else (user.id if user else None)
+        if key is None:
+            return await handler(event, data)
+
+        data["update_enqueued_at"] = time.monotonic()  # Для спана ожидания в полосе (tracing)
+        await self.executor.submit(key, self._handle, handler, event, data)
+
+    @classmethod
+    async def _handle(cls, handler, event, data):
+        dispatcher = data.get("dispatcher")
+        if dispatcher is None:
+            return await cls._call(handler, event, data)
+        # Ошибки обработчика - наблюдателям dp.errors, как при обычной обработке
+        return await ErrorsMiddleware(dispatcher)(lambda e, d: cls._call(handler, e, d), event, data)
+
+    @staticmethod
+    async def _call(handler, event, data):
+        # Состояние FSM могло измениться, пока обновление ждало в полосе
+        state = data.get("state")
+        if state is not None:
+            data["raw_state"] = await state.get_state()
+        return await handler(event, data)
+
+
+update_executor = UpdateExecutor()
@@ -0,0 +1,138 @@
+"""
+Контекст пользователя на время обработки одного обновления.
+
+UserContextMiddleware (outer-middleware на dp.update) создаёт UserContext и
+передаёт его обработчикам аргументом user_context. Премиум-статус, права
+администратора и коллекция вычисляются при первом обращении и дальше
+берутся из контекста, поэтому в одном обновлении premium_users.json
+читается не больше одного раза.
+
+Контекст хранится ещё и в contextvars: функции, которые вызываются из
+обработчика (в том числе в созданных им задачах), получают его через
+current_user_context(), не принимая лишних аргументов:
+
+    @dp.callback_query(F.data.startswith("play:"))
+    async def play_track(callback: types.CallbackQuery, user_context: UserContext):
+        if user_context.is_premium:
+            ...
+"""
+
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+
+from rate_limiter import RateLimiter, rate_limiter
+
+TIER_PREMIUM = "premium"
+TIER_FREE = "free"
+
+_current_user: contextvars.ContextVar = contextvars.ContextVar("user_context", default=None)
+_UNSET = object()
+
+
+class UserContext:
+    """Пользователь текущего обновления; статусы вычисляются один раз"""
+
+    __slots__ = ("user_id", "username", "_premium_lookup", "_admin_lookup", "_tracks_lookup", "_limiter",
+                 "_is_premium", "_is_admin", "_tracks")
+
+    def __init__(self, user_id: str, username: Optional[str], premium_lookup: Callable[[str, Optional[str]], bool],
+                 admin_lookup: Callable[[str, Optional[str]], bool], tracks_lookup: Callable[[str], List],
+                 limiter: Optional[RateLimiter] = None):
+        self.user_id = user_id
+        self.username = username
+        self._premium_lookup = premium_lookup
+        self._admin_lookup = admin_lookup
+        self._tracks_lookup = tracks_lookup
+        self._limiter = limiter
+        self._is_premium = _UNSET
+        self._is_admin = _UNSET
+        self._tracks = _UNSET
+
+    @property
+    def is_premium(self) -> bool:
+        if self._is_premium is _UNSET:
+            self._is_premium = bool(self._premium_lookup(self.user_id, self.username))
+        return self._is_premium
+
+    @property
+    def tier(self) -> str:
+        return TIER_PREMIUM if self.is_premium else TIER_FREE
+
+    @property
+    def is_admin(self) -> bool:
+        if self._is_admin is _UNSET:
+            self._is_admin = bool(self._admin_lookup(self.user_id, self.username))
+        return self._is_admin
+
+    @property
+    def tracks(self) -> List:
+        """Коллекция пользователя (список из user_tracks, не копия)"""
+        if self._tracks is _UNSET:
+            self._tracks = self._tracks_lookup(self.user_id)
+        return self._tracks
+
+    @property
+    def rate_limit(self) -> dict:
+        """Состояние ведра ограничения частоты"""
+        if self._limiter is None:
+            return {}
+        return {
+            "tokens": self._limiter.tokens(self.user_id),
+            "throttled_streak": self._limiter.throttle_streak(self.user_id),
+        }
+
+    def refresh(self):
+        """Забыть вычисленные значения (после изменения премиума или коллекции)"""
+        self._is_premium = _UNSET
+        self._is_admin = _UNSET
+        self._tracks = _UNSET
+
+
+def current_user_context() -> Optional[UserContext]:
+    return _current_user.get()
+
+
+def context_for(user_id) -> Optional[UserContext]:
+    """Контекст текущего обновления, если он относится к пользователю user_id"""
+    context = _current_user.get()
+    if context is not None and user_id is not None and context.user_id == str(user_id):
+        return context
+    return None
+
+
+def invalidate(user_id=None):
+    """Сбрасывает закэшированные статусы в контексте текущего обновления"""
+    context = _current_user.get()
+    if context is not None and (user_id is None or context.user_id == str(user_id)):
+        context.refresh()
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Middleware для dp.update: UserContext в data["user_context"] и в contextvars"""
+
+    def __init__(self, premium_lookup: Callable[[str, Optional[str]], bool],
+                 admin_lookup: Callable[[str, Optional[str]], bool], tracks_lookup: Callable[[str], List],
+                 limiter: Optional[RateLimiter] = rate_limiter,
+                 prefetch: Optional[Callable[[str], Awaitable[None]]] = None):
+        self.premium_lookup = premium_lookup
+        self.admin_lookup = admin_lookup
+        self.tracks_lookup = tracks_lookup
+        self.limiter = limiter
+        self.prefetch = prefetch  # Читает состояние пользователя из хранилища до обработчика, не блокируя loop
+
+    async def __call__(self, handler, event, data: Dict[str, Any]):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        if self.prefetch is not None:
+            await self.prefetch(str(user.id))
+        context = UserContext(str(user.id), user.username, self.premium_lookup, self.admin_lookup,
+                              self.tracks_lookup, self.limiter)
+        data["user_context"] = context
+        token = _current_user.set(context)
+        try:
+            return await handler(event, data)
+        finally:
+            _current_user.reset(token)
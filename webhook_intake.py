@@ -0,0 +1,274 @@
+"""
+Приём webhook-обновлений Telegram: дедупликация по update_id и сброс на диск.
+
+Telegram повторяет доставку, если не получил 200 (в том числе при ответе 429),
+поэтому повторно пришедшие обновления отбрасываются по скользящему окну
+последних update_id. Когда очередь в памяти заполнена, обновление не
+отклоняется, а дописывается в локальный журнал (JSON lines). Пока в журнале
+есть необработанные записи, новые обновления тоже идут в журнал, чтобы
+сохранялся порядок. Позиция журнала хранится в отдельном файле и
+сдвигается только после того, как запись отдана на обработку, поэтому после
+перезапуска необработанный хвост журнала обрабатывается снова.
+
+Класс потокобезопасен: используется и из Flask (app_optimized.py, потоки),
+и из aiohttp (webhook_server.py, event loop).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))  # Обновлений в памяти до сброса на диск
+WEBHOOK_DEDUP_WINDOW = 10000  # Сколько последних update_id помнить для отсева повторов
+WEBHOOK_SPILL_FILE = os.path.join(os.path.dirname(__file__), "webhook_spill.jsonl")
+WEBHOOK_SPILL_BATCH = 100  # Сколько записей журнала за раз поднимать в память
+
+RESULT_QUEUED = "queued"
+RESULT_SPILLED = "spilled"
+RESULT_DUPLICATE = "duplicate"
+
+
+class WebhookIntake:
+    """Очередь обновлений с отсевом повторов и переполнением в журнал на диске"""
+
+    def __init__(self, maxsize: int = WEBHOOK_QUEUE_SIZE, dedup_window: int = WEBHOOK_DEDUP_WINDOW,
+                 spill_path: str = WEBHOOK_SPILL_FILE):
+        self.maxsize = maxsize
+        self.dedup_window = dedup_window
+        self.spill_path = spill_path
+        self.offset_path = spill_path + ".offset"
+        self._queue = deque()
+        self._seen_order = deque()
+        self._seen = set()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._spill_offset = 0  # Все записи до этой позиции отданы на обработку (сохраняется на диск)
+        self._read_offset = 0  # До этой позиции записи подняты в _replay
+        self._replay = deque()  # (обновление, позиция конца записи) - поднятые, но еще не отданные
+        self._spill_backlog = 0  # Записей в журнале, еще не отданных на обработку
+        self._loop = None
+        self._async_event = None
+        self.accepted = 0
+        self.duplicates = 0
+        self.spilled = 0
+        self.replayed = 0
+        self._restore_spill()
+
+    # --- Дедупликация ---
+
+    def _is_duplicate(self, update_id) -> bool:
+        if update_id is None:
+            return False
+        if update_id in self._seen:
+            return True
+        self._seen.add(update_id)
+        self._seen_order.append(update_id)
+        while len(self._seen_order) > self.dedup_window:
+            self._seen.discard(self._seen_order.popleft())
+        return False
+
+    # --- Журнал на диске ---
+
+    def _restore_spill(self):
+        """Находит непрочитанный хвост журнала, оставшийся от прошлого запуска"""
+        try:
+            if not os.path.exists(self.spill_path):
+                return
+            if os.path.exists(self.offset_path):
+                with open(self.offset_path, "r", encoding="utf-8") as f:
+                    self._spill_offset = int(f.read().strip() or 0)
+            self._read_offset = self._spill_offset
+            with open(self.spill_path, "rb") as f:
+                f.seek(self._spill_offset)
+                for line in f:
+                    if not line.strip():
+                        continue
+                    self._spill_backlog += 1
+                    # Повторная доставка уже сохраненных обновлений тоже должна отсеиваться
+                    try:
+                        self._is_duplicate(json.loads(line).get("update_id"))
+                    except ValueError:
+                        pass
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 1))
+                tail = f.read(1)
+            if tail and tail != b"\n":
+                # Запись оборвана при падении - закрываем строку, при чтении она будет пропущена
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    f.write("\n")
+            if self._spill_backlog:
+                logging.info(f"📼 В журнале webhook {self._spill_backlog} необработанных обновлений, обрабатываем")
+            else:
+                self._reset_spill()
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения журнала webhook: {e}")
+            self._spill_offset = 0
+            self._read_offset = 0
+            self._spill_backlog = 0
+
+    def _save_offset(self):
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(self._spill_offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def _reset_spill(self):
+        """Журнал прочитан полностью - обнуляем его"""
+        open(self.spill_path, "w").close()
+        self._spill_offset = 0
+        self._read_offset = 0
+        self._replay.clear()
+        self._spill_backlog = 0
+        self._save_offset()
+
+    def _append_spill(self, update: dict) -> bool:
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(update, ensure_ascii=False) + "\n")
+            self._spill_backlog += 1
+            self.spilled += 1
+            return True
+        except Exception as e:
+            logging.error(f"❌ Ошибка записи в журнал webhook: {e}")
+            return False
+
+    def _load_spill_batch(self):
+        """
+        Поднимает в память следующую порцию записей журнала. Позиция на диске
+        не меняется: записи остаются в журнале, пока не отданы (_take_replay).
+        """
+        try:
+            with open(self.spill_path, "rb") as f:
+                f.seek(self._read_offset)
+                loaded = 0
+                while loaded < WEBHOOK_SPILL_BATCH:
+                    line = f.readline()
+                    if not line:
+                        break
+                    self._read_offset = f.tell()
+                    if not line.strip():
+                        continue
+                    try:
+                        self._replay.append((json.loads(line), self._read_offset))
+                    except ValueError:
+                        logging.warning("⚠️ Пропущена поврежденная запись журнала webhook")
+                        self._spill_backlog -= 1
+                        continue
+                    loaded += 1
+                if not line:
+                    # Достигнут конец файла: кроме поднятых записей, в журнале ничего нет
+                    self._spill_backlog = len(self._replay)
+            if self._spill_backlog <= 0:
+                self._reset_spill()
+        except Exception as e:
+            logging.error(f"❌ Ошибка чтения журнала webhook: {e}")
+
+    def _take_replay(self) -> dict:
+        """Отдает следующую запись журнала и только после этого сдвигает сохраненную позицию"""
+        update, self._spill_offset = self._replay.popleft()
+        self._spill_backlog -= 1
+        self.replayed += 1
+        try:
+            if self._spill_backlog <= 0 and not self._replay:
+                self._reset_spill()
+            else:
+                self._save_offset()
+        except Exception as e:
+            logging.error(f"❌ Ошибка сохранения позиции журнала webhook: {e}")
+        return update
+
+    # --- Очередь ---
+
+    def offer(self, update: dict) -> str:
+        """Принимает обновление: queued, spilled или duplicate"""
+        with self._lock:
+            if self._is_duplicate(update.get("update_id")):
+                self.duplicates += 1
+                return RESULT_DUPLICATE
+            self.accepted += 1
+            # Пока журнал не дочитан, новые обновления идут за ним, чтобы не нарушать порядок
+            if len(self._queue) >= self.maxsize or self._spill_backlog > 0:
+                if self._append_spill(update):
+                    result = RESULT_SPILLED
+                else:
+                    # Диск недоступен - лучше превысить лимит памяти, чем потерять обновление
+                    self._queue.append(update)
+                    result = RESULT_QUEUED
+            else:
+                self._queue.append(update)
+                result = RESULT_QUEUED
+            self._not_empty.notify()
+        self._wakeup_async()
+        return result
+
+    def pop(self) -> Optional[dict]:
+        """Следующее обновление или None, если очередь и журнал пусты"""
+        with self._lock:
+            return self._pop_locked()
+
+    def _pop_locked(self) -> Optional[dict]:
+        if self._queue:
+            return self._queue.popleft()
+        if not self._replay and self._spill_backlog > 0:
+            self._load_spill_batch()
+        if self._replay:
+            return self._take_replay()
+        return None
+
+    def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Блокирующее получение для потоков; None по истечении timeout"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._not_empty:
+            while True:
+                update = self._pop_locked()
+                if update is not None:
+                    return update
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._not_empty.wait(remaining)
+
+    async def get_async(self) -> dict:
+        """Ожидание следующего обновления внутри event loop"""
+        if self._async_event is None or self._loop is not asyncio.get_running_loop():
+            self._loop = asyncio.get_running_loop()
+            self._async_event = asyncio.Event()
+        while True:
+            self._async_event.clear()
+            update = self.pop()
+            if update is not None:
+                return update
+            await self._async_event.wait()
+
+    def _wakeup_async(self):
+        loop, event = self._loop, self._async_event
+        if loop is None or event is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            pass
+
+    def qsize(self) -> int:
+        with self._lock:
+            return len(self._queue) + self._spill_backlog
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_memory": len(self._queue),
+                "spill_backlog": self._spill_backlog,
+                "accepted": self.accepted,
+                "duplicates": self.duplicates,
+                "spilled": self.spilled,
+                "replayed": self.replayed,
+                "dedup_window": len(self._seen),
+            }
+
+
+webhook_intake = WebhookIntake()
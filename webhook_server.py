@@ -0,0 +1,188 @@
+"""
+Webhook-сервер на aiohttp в одном процессе и одном event loop с Dispatcher.
+
+В отличие от app.py (Flask + отдельный поток бота + новый event loop на
+каждое обновление), обновление здесь попадает в webhook_intake (отсев
+повторов по update_id, сброс на диск при переполнении), а Telegram получает
+ответ 200 за миллисекунды. Отдельная задача выбирает обновления из очереди и
+передаёт их в dp.feed_webhook_update, не больше WEBHOOK_MAX_IN_FLIGHT
+одновременно. Метрики Prometheus отдаются на /metrics. Если установлен
+uvloop, он используется автоматически.
+
+Запуск (в том числе на Render):
+    python webhook_server.py
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from aiohttp import web
+
+import metrics
+from webhook_intake import webhook_intake, RESULT_DUPLICATE
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Проверяется по заголовку X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", 10000))
+KEEP_ALIVE_ENABLED = os.getenv("KEEP_ALIVE_AGGRESSIVE", "false").lower() == "true"
+KEEP_ALIVE_INTERVAL = 600  # Render засыпает после 15 минут без запросов
+WEBHOOK_MAX_IN_FLIGHT = 100  # Обновлений, одновременно переданных в Dispatcher
+
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+
+class WebhookServer:
+    """aiohttp-приложение, передающее обновления Telegram в Dispatcher"""
+
+    def __init__(self, bot, dp, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET, intake=webhook_intake):
+        self.bot = bot
+        self.dp = dp
+        self.intake = intake
+        self.path = path
+        self.secret = secret
+        self.started_at = time.time()
+        self.received = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self._tasks = set()  # Все фоновые задачи сервера: прием, keep alive и обработка обновлений
+        self._updates = set()  # Только задачи обработки обновлений
+        self._slots = None
+        metrics.register_gauge("musicbot_webhook_intake_depth", "Обновлений в очереди приема webhook",
+                               self.intake.qsize)
+        metrics.register_gauge("musicbot_webhook_in_flight", "Обновлений, переданных в Dispatcher",
+                               lambda: len(self._updates))
+
+    def _spawn(self, coro):
+        # Храним ссылку на задачу, иначе сборщик мусора может ее уничтожить
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logging.error(f"❌ Ошибка обработки обновления: {task.exception()}")
+
+    async def handle_webhook(self, request):
+        if self.secret and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret:
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            update = await request.json()
+        except Exception:
+            self.rejected += 1
+            return web.Response(status=400)
+
+        self.received += 1
+        if self.intake.offer(update) == RESULT_DUPLICATE:
+            self.duplicates += 1
+        return web.Response(text="ok")
+
+    async def _feed(self, update):
+        try:
+            await self.dp.feed_webhook_update(self.bot, update)
+        finally:
+            self._slots.release()
+
+    async def _drain(self):
+        """Передает обновления из очереди приема в Dispatcher"""
+        self._slots = asyncio.Semaphore(WEBHOOK_MAX_IN_FLIGHT)
+        while True:
+            update = await self.intake.get_async()
+            await self._slots.acquire()
+            task = self._spawn(self._feed(update))
+            self._updates.add(task)
+            task.add_done_callback(self._updates.discard)
+
+    async def handle_health(self, request):
+        return web.json_response({
+            "status": "healthy",
+            "uptime": time.time() - self.started_at,
+            "updates_received": self.received,
+            "updates_rejected": self.rejected,
+            "updates_duplicate": self.duplicates,
+            "updates_in_progress": len(self._updates),
+            "intake": self.intake.stats(),
+            "uvloop": UVLOOP_AVAILABLE,
+        })
+
+    async def handle_metrics(self, request):
+        # Значения метрик читаются в потоке: часть из них ходит в SQLite (очередь воркеров загрузок)
+        body, content_type = await asyncio.get_running_loop().run_in_executor(None, metrics.generate_metrics)
+        # aiohttp не принимает charset в content_type, передаем заголовок целиком
+        return web.Response(body=body, headers={"Content-Type": content_type})
+
+    async def _keep_alive(self):
+        """Пингует собственный /health, чтобы бесплатный инстанс Render не засыпал"""
+        from http_pool import get_session
+        url = f"{WEBHOOK_BASE_URL}/health"
+        while True:
+            await asyncio.sleep(KEEP_ALIVE_INTERVAL)
+            try:
+                async with get_session("keep_alive").get(url) as resp:
+                    logging.info(f"💓 Keep alive: {resp.status}")
+            except Exception as e:
+                logging.warning(f"⚠️ Keep alive не удался: {e}")
+
+    async def on_startup(self, app):
+        from music_bot_new import start_background_tasks
+
+        await self.dp.emit_startup(bot=self.bot)
+        start_background_tasks()
+        # Сначала дочитываем журнал прошлого запуска, затем принимаем новые обновления
+        self._spawn(self._drain())
+
+        if WEBHOOK_BASE_URL:
+            webhook_url = f"{WEBHOOK_BASE_URL.rstrip('/')}{self.path}"
+            await self.bot.set_webhook(
+                webhook_url,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+            )
+            logging.info(f"✅ Webhook установлен: {webhook_url}")
+            if KEEP_ALIVE_ENABLED:
+                self._spawn(self._keep_alive())
+        else:
+            logging.warning("⚠️ WEBHOOK_BASE_URL/RENDER_EXTERNAL_URL не задан, webhook не установлен")
+
+    async def on_shutdown(self, app):
+        for task in list(self._tasks):
+            task.cancel()
+        await self.dp.emit_shutdown(bot=self.bot)
+        await self.bot.session.close()
+        logging.info("✅ Webhook-сервер остановлен")
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_webhook)
+        app.router.add_get("/health", self.handle_health)
+        app.router.add_get("/status", self.handle_health)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/", self.handle_health)
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        return app
+
+
+def main():
+    if UVLOOP_AVAILABLE:
+        uvloop.install()
+        logging.info("⚡ Используется uvloop")
+
+    from music_bot_new import bot, dp
+
+    server = WebhookServer(bot, dp)
+    web.run_app(server.create_app(), host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+
+
+if __name__ == "__main__":
+    main()
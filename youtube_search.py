@@ -0,0 +1,127 @@
+"""
+Асинхронный поиск на YouTube через innertube (youtubei/v1/search).
+
+Запрос идёт через общий пул соединений http_pool, из ответа извлекаются
+только нужные боту поля (id, title, duration). Формат результата совпадает
+с тем, что отдаёт yt-dlp (ytsearchN: + extract_flat), поэтому результаты
+можно напрямую передавать в send_search_results. Если innertube недоступен,
+search возвращает None и вызывающий код откатывается на yt-dlp.
+"""
+
+import asyncio
+import logging
+from typing import List, Optional
+
+import aiohttp
+
+from http_pool import get_session
+
+YOUTUBE_INNERTUBE_URL = "https://www.youtube.com/youtubei/v1/search"
+YOUTUBE_CLIENT_NAME = "WEB"
+YOUTUBE_CLIENT_VERSION = "2.20240726.00.00"
+YOUTUBE_SEARCH_TIMEOUT = 10  # Таймаут запроса (сек)
+YOUTUBE_VIDEOS_ONLY_PARAMS = "EgIQAQ=="  # Фильтр "только видео"
+
+
+def parse_duration(text) -> Optional[int]:
+    """Переводит '1:02:03' / '3:45' в секунды"""
+    if not text:
+        return None
+    try:
+        seconds = 0
+        for part in text.split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+    except ValueError:
+        return None
+
+
+def _text(node) -> str:
+    """Текст из innertube-узла вида {'simpleText': ...} или {'runs': [{'text': ...}]}"""
+    if not node:
+        return ""
+    if "simpleText" in node:
+        return node["simpleText"]
+    return "".join(run.get("text", "") for run in node.get("runs", []))
+
+
+class YouTubeSearchClient:
+    """Клиент поиска YouTube через innertube API"""
+
+    def __init__(self, client_version: str = YOUTUBE_CLIENT_VERSION):
+        self.client_version = client_version
+
+    def _payload(self, query: str) -> dict:
+        return {
+            "context": {
+                "client": {
+                    "clientName": YOUTUBE_CLIENT_NAME,
+                    "clientVersion": self.client_version,
+                    "hl": "en",
+                    "gl": "US",
+                }
+            },
+            "query": query,
+            "params": YOUTUBE_VIDEOS_ONLY_PARAMS,
+        }
+
+    async def search(self, query: str, limit: int = 5) -> Optional[List[dict]]:
+        """
+        Ищет видео по запросу.
+        Возвращает список {'id', 'title', 'duration', 'url', 'source'} или None при ошибке.
+        """
+        try:
+            session = get_session("youtube", timeout=YOUTUBE_SEARCH_TIMEOUT)
+            async with session.post(
+                YOUTUBE_INNERTUBE_URL,
+                params={"prettyPrint": "false"},
+                json=self._payload(query),
+            ) as resp:
+                if resp.status != 200:
+                    logging.warning(f"⚠️ innertube вернул статус {resp.status} для запроса: {query}")
+                    return None
+                data = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning(f"⚠️ Ошибка запроса к innertube: {e}")
+            return None
+        except Exception as e:
+            logging.error(f"❌ Ошибка поиска YouTube через innertube: {e}")
+            return None
+
+        try:
+            return self.parse_results(data, limit)
+        except Exception as e:
+            logging.error(f"❌ Ошибка разбора ответа innertube: {e}")
+            return None
+
+    @staticmethod
+    def parse_results(data: dict, limit: int) -> List[dict]:
+        """Извлекает videoRenderer-ы из ответа innertube"""
+        results = []
+        sections = (
+            data.get("contents", {})
+            .get("twoColumnSearchResultsRenderer", {})
+            .get("primaryContents", {})
+            .get("sectionListRenderer", {})
+            .get("contents", [])
+        )
+        for section in sections:
+            items = section.get("itemSectionRenderer", {}).get("contents", [])
+            for item in items:
+                video = item.get("videoRenderer")
+                if not video or not video.get("videoId"):
+                    continue
+                video_id = video["videoId"]
+                results.append({
+                    "id": video_id,
+                    "title": _text(video.get("title")),
+                    "duration": parse_duration(_text(video.get("lengthText"))),
+                    "url": f"https://www.youtube.com/watch?v={video_id}",
+                    "source": "yt",
+                })
+                if len(results) >= limit:
+                    return results
+        return results
+
+
+youtube_client = YouTubeSearchClient()